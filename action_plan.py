@@ -0,0 +1,68 @@
+# -*- coding: UTF-8 -*-
+"""
+开售前预置动作：在等待开抢之前确定屏幕尺寸、立即预订按钮坐标，
+并预先编译开售后各页面要用到的定位语句，开售时第一下点击无需再做任何查询
+"""
+
+from logger import log
+from ui_snapshot import LocatorUnsupported, compile_locator
+
+
+# 开售后按顺序用到的选择器级联
+POST_SALE_CASCADES = ("session.date", "tier.ticket", "tier.plus_button",
+                      "tier.quantity", "tier.confirm", "order.submit")
+
+# 找不到立即预订按钮时的备选点击位置（屏幕宽高比例），按优先级排列
+BOOKING_FALLBACK_RATIOS = [
+    # 右下角位置 - 优先尝试
+    (0.9, 0.95),   # 最右下角
+    (0.85, 0.95),  # 右下角稍左
+    (0.9, 0.9),    # 右下角稍上
+    (0.8, 0.95),   # 更左一点
+    # 屏幕底部区域 - 备选尝试
+    (0.7, 0.95),
+    (0.6, 0.95),
+    # 屏幕底部中间位置 - 最后尝试
+    (0.5, 0.95),
+    (0.5, 0.9),
+]
+
+
+class ActionPlan:
+    """开售时直接执行的动作序列
+
+    参数:
+        screen_size: {'width': ..., 'height': ...}
+        booking_point: 立即预订按钮中心坐标，未找到时为 None
+        booking_selector: 定位到立即预订按钮的选择器
+    """
+
+    def __init__(self, screen_size, booking_point=None, booking_selector=None):
+        self.screen_size = screen_size
+        self.booking_point = booking_point
+        self.booking_selector = booking_selector
+
+    def point(self, x_ratio, y_ratio):
+        """按屏幕比例换算坐标"""
+        return int(self.screen_size['width'] * x_ratio), int(self.screen_size['height'] * y_ratio)
+
+    def booking_points(self):
+        """立即预订的点击位置：按钮中心优先，其后是备选位置"""
+        points = [self.point(rx, ry) for rx, ry in BOOKING_FALLBACK_RATIOS]
+        if self.booking_point is not None:
+            points = [self.booking_point] + [p for p in points if p != self.booking_point]
+        return points
+
+
+def compile_post_sale(cascades):
+    """预先编译开售后各级联的本地定位语句，开售后的首次求值不再承担解析开销"""
+    compiled = 0
+    for name in POST_SALE_CASCADES:
+        for by, value in cascades[name].selectors:
+            try:
+                compile_locator(by, value)
+                compiled += 1
+            except LocatorUnsupported:
+                continue
+    log.debug(f"已预编译开售后定位语句 {compiled} 条")
+    return compiled
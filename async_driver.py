@@ -0,0 +1,75 @@
+# -*- coding: UTF-8 -*-
+"""
+驱动查询的 asyncio 门面：互不依赖的查询（前台包名、页面层级、窗口尺寸）并发发出，
+总耗时约等于最慢的一次往返而不是逐条相加。
+
+- AsyncDriver 在线程池中调用会话自己的驱动对象，请求仍经过 TunedConnection 长连接池
+  或 DirectDriver 直连，不另建 HTTP 客户端
+- DriverLoop 在后台线程运行事件循环，供同步代码提交协程；一个事件循环与线程池可服务多台设备的会话
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# 同时在途的查询数上限，传输层的长连接池按此设置大小
+MAX_CONCURRENT_QUERIES = 4
+
+
+class AsyncDriver:
+    """一个会话的协程查询接口，阻塞调用在 DriverLoop 的线程池中执行"""
+
+    def __init__(self, driver, executor):
+        self.driver = driver
+        self._executor = executor
+
+    async def call(self, func, *args):
+        """在线程池中执行任意阻塞调用（如设备端的级联查找）"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def current_package(self):
+        return await self.call(lambda: self.driver.current_package)
+
+    async def current_activity(self):
+        return await self.call(lambda: self.driver.current_activity)
+
+    async def page_source(self):
+        return await self.call(lambda: self.driver.page_source)
+
+    async def window_size(self):
+        return await self.call(self.driver.get_window_size)
+
+
+class DriverLoop:
+    """后台线程中的事件循环，同步代码通过 run / gather 提交协程
+
+    参数:
+        max_workers: 执行阻塞驱动调用的线程数，即同时在途的查询数上限
+    """
+
+    def __init__(self, max_workers=MAX_CONCURRENT_QUERIES):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="DriverQuery")
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="DriverLoop", daemon=True)
+        self._thread.start()
+
+    def attach(self, driver):
+        """为一个会话的驱动创建协程门面，共用本事件循环与线程池"""
+        return AsyncDriver(driver, self.executor)
+
+    def run(self, coro, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def gather(self, *coros, timeout=None):
+        """并发执行多个协程，按顺序返回结果；任一失败时抛出该异常"""
+        async def _gather():
+            return await asyncio.gather(*coros)
+        return self.run(_gather(), timeout)
+
+    def stop(self):
+        if self.loop.is_running():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+        self.loop.close()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,161 @@
+# -*- coding: UTF-8 -*-
+"""
+抢票流程端到端延迟基准：在回放驱动上按不同的模拟设备延迟多次执行
+run_ticket_grabbing，统计各阶段耗时与设备往返次数的 p50/p95，
+并与基线比较，作为关键窗口的回归闸门
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import sys
+
+import logger
+from fake_driver import REPLAY_DIR, run_replay
+
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'bench_baseline.json')
+LATENCIES_MS = (5, 30, 100)
+PHASES = ("launch", "search", "result_select", "city", "pre_arm",
+          "booking", "date", "tier", "quantity", "attendee", "submit")
+# 开售时刻之后的关键窗口：从点击立即预订到提交订单
+CRITICAL_PHASES = ("booking", "date", "tier", "quantity", "attendee", "submit")
+
+
+def percentile(values, pct):
+    """最近秩法百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def phase_breakdown(bot):
+    """按阶段标记切分一次运行，返回 {阶段: (耗时毫秒, 设备往返次数)}，不含等待开售的阶段"""
+    marks = bot.phase_marks
+    commands = bot.driver.commands
+    result = {}
+    for (name, start), (_, end) in zip(marks, marks[1:]):
+        if name == "wait":
+            continue
+        round_trips = sum(1 for _, at in commands if start <= at < end)
+        result[name] = ((end - start) * 1000, round_trips)
+    return result
+
+
+def _summary(samples):
+    times = [t for t, _ in samples]
+    trips = [n for _, n in samples]
+    return {
+        "p50_ms": round(percentile(times, 50), 1),
+        "p95_ms": round(percentile(times, 95), 1),
+        "p50_rtt": percentile(trips, 50),
+        "p95_rtt": percentile(trips, 95),
+    }
+
+
+def run_benchmark(latencies_ms=LATENCIES_MS, runs=5, strategy="ranked", snapshot_mode=True,
+                  scenario_dir=REPLAY_DIR):
+    """按每种模拟延迟执行 runs 次回放，返回各阶段与关键窗口的统计"""
+    report = {
+        "strategy": strategy,
+        "snapshot_mode": snapshot_mode,
+        "runs": runs,
+        "latencies": {},
+    }
+    for latency_ms in latencies_ms:
+        per_phase = {name: [] for name in PHASES}
+        critical, totals, successes, wasted = [], [], 0, 0
+        for _ in range(runs):
+            # 流程本身的日志输出会干扰计时，也不是基准关心的内容
+            with contextlib.redirect_stdout(io.StringIO()):
+                success, _, bot = run_replay(latency_ms / 1000, scenario_dir, strategy,
+                                             snapshot_mode=snapshot_mode, log_level="CRITICAL")
+                logger.flush()
+            successes += bool(success)
+            wasted += bot.tap_metrics.total_wasted
+            breakdown = phase_breakdown(bot)
+            for name, sample in breakdown.items():
+                if name in per_phase:
+                    per_phase[name].append(sample)
+            window = [breakdown[name] for name in CRITICAL_PHASES if name in breakdown]
+            critical.append((sum(t for t, _ in window), sum(n for _, n in window)))
+            totals.append((sum(t for t, _ in breakdown.values()), sum(n for _, n in breakdown.values())))
+        report["latencies"][str(latency_ms)] = {
+            "success_rate": successes / runs,
+            "wasted_taps": wasted,
+            "phases": {name: _summary(samples) for name, samples in per_phase.items() if samples},
+            "critical": _summary(critical),
+            "total": _summary(totals),
+        }
+    return report
+
+
+def print_report(report):
+    print(f"策略: {report['strategy']}，快照模式: {report['snapshot_mode']}，每组 {report['runs']} 次")
+    for latency_ms, data in report["latencies"].items():
+        print(f"\n模拟设备延迟 {latency_ms} ms（成功率 {data['success_rate']:.0%}，"
+              f"无效点击 {data.get('wasted_taps', 0)} 次）")
+        print(f"  {'阶段':<14}{'p50 ms':>10}{'p95 ms':>10}{'p50 往返':>10}{'p95 往返':>10}")
+        rows = list(data["phases"].items()) + [("关键窗口", data["critical"]), ("合计", data["total"])]
+        for name, s in rows:
+            print(f"  {name:<14}{s['p50_ms']:>10}{s['p95_ms']:>10}{s['p50_rtt']:>10}{s['p95_rtt']:>10}")
+
+
+def check_regression(report, baseline, tolerance_ms):
+    """与基线比较关键窗口，返回回归描述列表，为空表示通过"""
+    problems = []
+    if (baseline.get("strategy"), baseline.get("snapshot_mode")) != (report["strategy"], report["snapshot_mode"]):
+        problems.append("基线与本次运行的策略/快照模式不一致，无法比较")
+        return problems
+    for latency_ms, data in report["latencies"].items():
+        base = baseline["latencies"].get(latency_ms)
+        if base is None:
+            continue
+        now, before = data["critical"], base["critical"]
+        if now["p95_rtt"] > before["p95_rtt"]:
+            problems.append(f"{latency_ms} ms: 关键窗口 p95 往返 {before['p95_rtt']} -> {now['p95_rtt']}")
+        if now["p95_ms"] > before["p95_ms"] + tolerance_ms:
+            problems.append(f"{latency_ms} ms: 关键窗口 p95 {before['p95_ms']} ms -> {now['p95_ms']} ms"
+                            f"（容差 {tolerance_ms} ms）")
+        if data["success_rate"] < base["success_rate"]:
+            problems.append(f"{latency_ms} ms: 成功率 {base['success_rate']:.0%} -> {data['success_rate']:.0%}")
+    return problems
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="抢票流程端到端延迟基准与回归闸门")
+    parser.add_argument("--latencies", type=int, nargs="+", default=list(LATENCIES_MS), help="模拟设备延迟（毫秒）")
+    parser.add_argument("--runs", type=int, default=5, help="每种延迟的运行次数")
+    parser.add_argument("--strategy", choices=["ranked", "sequential"], default="ranked", help="选择器级联策略")
+    parser.add_argument("--no-snapshot", action="store_true", help="关闭快照模式")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="基线文件")
+    parser.add_argument("--tolerance-ms", type=float, default=50, help="关键窗口 p95 允许增加的毫秒数")
+    parser.add_argument("--update-baseline", action="store_true", help="用本次结果覆盖基线")
+    parser.add_argument("--json", help="把本次结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    report = run_benchmark(args.latencies, args.runs, args.strategy, not args.no_snapshot)
+    print_report(report)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n已更新基线: {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            problems = check_regression(report, json.load(f), args.tolerance_ms)
+        if problems:
+            print("\n回归闸门未通过:")
+            for problem in problems:
+                print(f"  - {problem}")
+            sys.exit(1)
+        print("\n回归闸门通过")
@@ -0,0 +1,178 @@
+# -*- coding: UTF-8 -*-
+"""
+元素坐标缓存：按 (应用版本, 页面指纹, 分辨率, 选择器) 记录命中节点的 bounds，
+再次遇到同一页面时不求值定位语句、不查询设备，直接取缓存坐标。
+
+使用前先校验：当前快照中同一 bounds 处必须有 class、resource-id、text 都一致的节点；
+按文本、描述等内容定位的选择器（命中可能取决于其他节点的内容，如观演人姓名旁的复选框、
+排除"缺货登记"的票档行）再在快照中重新求值一次，结果须与缓存的节点相同。
+校验不通过时删除该条目并重新定位。每个应用版本的条目数有上限，超出时淘汰最久未用的条目
+"""
+
+import json
+import os
+import re
+from collections import OrderedDict
+
+from appium.webdriver.common.appiumby import AppiumBy
+
+from instrumentation import TRACER
+from logger import log
+from screen_classifier import Fingerprint, fingerprint_kept
+from ui_snapshot import LocatorUnsupported
+
+
+BOUNDS_FILE = os.path.join(os.path.dirname(__file__), 'bounds_cache.json')
+# 每个应用版本最多保留的条目数
+MAX_ENTRIES = 512
+# 校验时比对的节点属性
+SIGNATURE_ATTRS = ('class', 'resource-id', 'text')
+
+
+# 定位语句中引用节点内容的部分：XPath 的 @text/@content-desc/text()，UiSelector 的 text*/description*
+_CONTENT_RE = re.compile(r'@text|@content-desc|text\(|\.(?:text|description)\w*\(')
+
+
+def signature(snapshot, node):
+    return [snapshot.attr(node, name) or "" for name in SIGNATURE_ATTRS]
+
+
+def depends_on_content(selector):
+    """选择器的命中是否取决于节点内容（文本、描述），这类缓存条目使用前须重新求值"""
+    by, value = selector
+    if by in (AppiumBy.ID, AppiumBy.CLASS_NAME):
+        return False
+    return by == AppiumBy.ACCESSIBILITY_ID or bool(_CONTENT_RE.search(value))
+
+
+class BoundsCache:
+    """带校验与 LRU 淘汰的坐标缓存，按应用版本持久化
+
+    参数:
+        path: 缓存文件，为 None 时不读写文件
+        app_version: 应用版本，不同版本的坐标互不共用
+        max_entries: 每个应用版本最多保留的条目数
+    """
+
+    def __init__(self, path=BOUNDS_FILE, app_version="default", max_entries=MAX_ENTRIES):
+        self.path = path
+        self.app_version = app_version or "default"
+        self.max_entries = max_entries
+        self.tables = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.tables = json.load(f)
+            except Exception as e:
+                log.warning(f"读取坐标缓存失败: {e}")
+        # {键: [[bounds, 校验属性], ...]}，按最近使用排序
+        self.entries = OrderedDict((key, value) for key, value in self.tables.get(self.app_version, []))
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # 上一次计算的 (快照序号, 屏幕尺寸, 页面 key)
+        self._screen = (None, None, None)
+
+    def screen_key(self, snapshot):
+        """快照的页面指纹与分辨率；层级中没有屏幕尺寸时返回 None（不缓存）
+
+        同一份快照、或与上一份相比变化不影响指纹时沿用上一次的结果
+        """
+        serial, size, key = self._screen
+        if snapshot.serial == serial:
+            return key
+        current = snapshot.screen_size()
+        diff = snapshot.diff
+        if not (diff is not None and diff.base_serial == serial and current == size and fingerprint_kept(diff)):
+            key = f"{Fingerprint.of(snapshot).key}|{current['width']}x{current['height']}" if current else None
+        self._screen = (snapshot.serial, current, key)
+        return key
+
+    def _key(self, snapshot, selector):
+        screen = self.screen_key(snapshot)
+        return None if screen is None else f"{screen}|{selector[0]}|{selector[1]}"
+
+    def lookup(self, snapshot, selector):
+        """缓存坐标在当前快照中对应的节点；无记录返回 None，校验失败时删除该条目并返回 None"""
+        key = self._key(snapshot, selector)
+        entry = self.entries.get(key) if key else None
+        if entry is None:
+            return None
+        nodes = []
+        for bounds, expected in entry:
+            node = next((n for n in snapshot.nodes_at(bounds) if signature(snapshot, n) == expected), None)
+            if node is None:
+                return self._invalidate(key, selector)
+            nodes.append(node)
+        if depends_on_content(selector) and not self._still_matches(snapshot, selector, nodes):
+            return self._invalidate(key, selector)
+        self.entries.move_to_end(key)
+        self.dirty = True
+        self.hits += 1
+        return nodes
+
+    @staticmethod
+    def _still_matches(snapshot, selector, nodes):
+        """在快照中重新求值选择器，结果须与缓存的节点完全相同"""
+        try:
+            found = snapshot.find(*selector)
+        except LocatorUnsupported:
+            return False
+        return len(found) == len(nodes) and all(a is b for a, b in zip(found, nodes))
+
+    def _invalidate(self, key, selector):
+        self.invalidations += 1
+        del self.entries[key]
+        self.dirty = True
+        log.debug(f"缓存坐标已失效，重新定位: {selector[1]}")
+        return None
+
+    def store(self, snapshot, selector, nodes):
+        """记录选择器在该页面上命中的节点"""
+        key = self._key(snapshot, selector)
+        entry = [[snapshot.attr(node, 'bounds'), signature(snapshot, node)] for node in nodes]
+        if key is None or not entry or not all(bounds for bounds, _ in entry):
+            return
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.dirty = True
+
+    def find(self, snapshot, selector):
+        """按单个选择器取节点：先查缓存，未命中时在快照中求值并记录"""
+        nodes = self.lookup(snapshot, selector)
+        if nodes is not None:
+            return nodes
+        self.misses += 1
+        nodes = snapshot.find(*selector)
+        if nodes:
+            self.store(snapshot, selector, nodes)
+        return nodes
+
+    def resolve(self, cascade, snapshot):
+        """按级联排序取第一个有有效缓存的选择器，返回 (选择器, 节点列表)；都没有时返回 (None, [])"""
+        for selector in cascade.ranked():
+            with TRACER.span(cascade.name, "selector", selector=selector[1], cached=True) as span:
+                nodes = self.lookup(snapshot, selector)
+                span["hit"] = bool(nodes)
+            if nodes:
+                return selector, nodes
+        self.misses += 1
+        return None, []
+
+    def log_summary(self):
+        if self.hits or self.misses:
+            log.info(f"坐标缓存: 命中 {self.hits} 次，未命中 {self.misses} 次，校验失败 {self.invalidations} 次")
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        self.tables[self.app_version] = list(self.entries.items())
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self.tables, f, ensure_ascii=False, indent=1)
+            self.dirty = False
+        except Exception as e:
+            log.warning(f"保存坐标缓存失败: {e}")
@@ -0,0 +1,209 @@
+# -*- coding: UTF-8 -*-
+"""
+按设备标定超时与轮询间隔：预热阶段测量设备命令往返，流程中记录页面切换耗时，
+按两者的分布推导各步骤的超时和轮询间隔，按设备持久化。
+快手机不必等慢手机的默认超时，慢手机也不会因超时过短而误判失败
+"""
+
+import argparse
+import json
+import math
+import os
+import time
+
+from logger import log
+
+
+PROFILE_FILE = os.path.join(os.path.dirname(__file__), 'device_profiles.json')
+# 每类样本保留的最近条数
+MAX_SAMPLES = 200
+# 推导所需的最少样本数，不足时使用默认值
+MIN_SAMPLES = {"rtt": 5, "transition": 3}
+
+RTT = "rtt"
+TRANSITION = "transition"
+
+# 未标定时的默认值，与标定前硬编码的数值一致
+DEFAULT_TIMEOUTS = {
+    "find": 1.5,        # 当前页面上查找元素
+    "click": 2.0,       # 查找并点击，元素可能仍在加载
+    "transition": 3.0,  # 操作后等待页面切换
+    "load": 5.0,        # 页面切换后等待内容加载完成（如搜索结果）
+    "launch": 5.0,      # 等待 APP 启动到前台
+}
+DEFAULT_POLL = 0.02
+DEFAULT_MAX_POLL = 0.25
+
+
+def _clamp(value, low, high):
+    return max(low, min(value, high))
+
+
+def percentile(samples, p):
+    """最近邻百分位数，样本为空返回 None"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[max(1, math.ceil(p / 100 * len(ordered))) - 1]
+
+
+class DeviceProfile:
+    """一台设备的延迟样本与由此推导的超时
+
+    参数:
+        name: 设备标识
+        samples: {"rtt": [...], "transition": [...]}，单位秒
+    """
+
+    def __init__(self, name, samples=None):
+        self.name = name
+        self.samples = {RTT: [], TRANSITION: []}
+        for kind, values in (samples or {}).items():
+            self.samples[kind] = list(values)[-MAX_SAMPLES:]
+
+    def observe(self, kind, seconds):
+        values = self.samples.setdefault(kind, [])
+        values.append(round(seconds, 4))
+        del values[:-MAX_SAMPLES]
+
+    def stat(self, kind, p):
+        """样本足够时返回第 p 百分位数，否则返回 None"""
+        values = self.samples.get(kind, [])
+        if len(values) < MIN_SAMPLES.get(kind, 1):
+            return None
+        return percentile(values, p)
+
+    def timeouts(self):
+        """各步骤的超时（秒）；缺少对应样本的步骤使用默认值"""
+        timeouts = dict(DEFAULT_TIMEOUTS)
+        rtt_p95 = self.stat(RTT, 95)
+        tr_p50 = self.stat(TRANSITION, 50)
+        tr_p95 = self.stat(TRANSITION, 95)
+        if rtt_p95 is not None:
+            timeouts["find"] = _clamp(rtt_p95 * 6, 0.3, 3.0)
+            timeouts["click"] = _clamp(rtt_p95 * 4 + (tr_p50 or 0.2), 0.5, 4.0)
+        if tr_p95 is not None:
+            timeouts["transition"] = _clamp(tr_p95 * 2.5, 1.0, 8.0)
+            timeouts["load"] = _clamp(tr_p95 * 4 + (rtt_p95 or 0) * 4, 2.0, 12.0)
+            timeouts["launch"] = _clamp(tr_p95 * 6, 3.0, 20.0)
+        return timeouts
+
+    def poll_interval(self):
+        """(首次轮询间隔, 轮询间隔上限)：每次轮询本身就是一次往返，间隔随往返延迟缩放"""
+        rtt_p50 = self.stat(RTT, 50)
+        tr_p50 = self.stat(TRANSITION, 50)
+        poll = DEFAULT_POLL if rtt_p50 is None else _clamp(rtt_p50 / 2, 0.005, 0.05)
+        max_poll = DEFAULT_MAX_POLL if tr_p50 is None else _clamp(tr_p50 / 2, poll, DEFAULT_MAX_POLL)
+        return poll, max_poll
+
+    def summary(self):
+        result = {"device": self.name}
+        for kind in (RTT, TRANSITION):
+            values = self.samples.get(kind, [])
+            result[kind] = {"count": len(values),
+                            "p50_ms": round((percentile(values, 50) or 0) * 1000, 1),
+                            "p95_ms": round((percentile(values, 95) or 0) * 1000, 1)}
+        result["timeouts"] = {step: round(value, 3) for step, value in self.timeouts().items()}
+        result["poll"] = [round(value, 3) for value in self.poll_interval()]
+        return result
+
+    def to_dict(self):
+        return {"samples": self.samples, "updated": time.strftime("%Y-%m-%d %H:%M:%S")}
+
+
+class Calibration:
+    """按设备持久化的标定表
+
+    参数:
+        path: 标定文件，为 None 时不读写文件
+    """
+
+    def __init__(self, path=PROFILE_FILE):
+        self.path = path
+        self.profiles = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self.profiles = {name: DeviceProfile(name, entry.get("samples"))
+                                 for name, entry in data.items()}
+            except Exception as e:
+                log.warning(f"读取设备标定文件失败: {e}")
+        self.profile = None
+        self.use("default")
+        self.dirty = False
+
+    def use(self, device):
+        """切换到 device 的标定，不存在时新建"""
+        device = device or "default"
+        self.profile = self.profiles.setdefault(device, DeviceProfile(device))
+        return self.profile
+
+    def observe(self, kind, seconds):
+        self.profile.observe(kind, seconds)
+        self.dirty = True
+
+    def timeout(self, step):
+        return self.profile.timeouts()[step]
+
+    def poll_interval(self):
+        return self.profile.poll_interval()
+
+    def needs_warmup(self):
+        return self.profile.stat(RTT, 50) is None
+
+    def warm_up(self, driver, samples=8):
+        """预热：连续发送轻量命令测量设备往返，返回往返中位数（秒）"""
+        measured = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            driver.current_package
+            measured.append(time.perf_counter() - start)
+        for seconds in measured:
+            self.observe(RTT, seconds)
+        median = percentile(measured, 50)
+        log.info(f"设备 {self.profile.name} 命令往返中位数 {median * 1000:.1f} ms（{samples} 次）")
+        return median
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                # 没有任何样本的设备不写入
+                json.dump({name: profile.to_dict() for name, profile in self.profiles.items()
+                           if any(profile.samples.values())},
+                          f, ensure_ascii=False, indent=1)
+            self.dirty = False
+        except Exception as e:
+            log.warning(f"保存设备标定文件失败: {e}")
+
+
+def device_key(driver, override=None):
+    """设备标识：配置指定优先，其次取会话能力中的设备序列号/名称与系统版本"""
+    if override:
+        return override
+    capabilities = getattr(driver, 'capabilities', None) or {}
+    name = capabilities.get('udid') or capabilities.get('deviceName')
+    if not name:
+        return "default"
+    version = capabilities.get('platformVersion')
+    return f"{name}/{version}" if version else name
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="设备标定：查看各设备的延迟分布与推导出的超时")
+    parser.add_argument("--file", default=PROFILE_FILE, help="标定文件")
+    parser.add_argument("--replay-latency-ms", type=float,
+                        help="用离线回放驱动按该延迟标定一次并输出结果（不写文件）")
+    args = parser.parse_args()
+
+    if args.replay_latency_ms is not None:
+        import logger
+        from fake_driver import run_replay
+        success, _, bot = run_replay(args.replay_latency_ms / 1000, calibrate=True)
+        logger.flush()
+        print(json.dumps(bot.calibration.profile.summary(), ensure_ascii=False, indent=1))
+    else:
+        for profile in Calibration(args.file).profiles.values():
+            print(json.dumps(profile.summary(), ensure_ascii=False, indent=1))
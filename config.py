@@ -2,18 +2,86 @@
 import json
 import re
 
+from logger import log
+
 
 class Config:
-    def __init__(self, server_url, keyword, users, city, date, price, price_index, if_commit_order, time=None):
+    def __init__(self, server_url, keyword, users, city, date, price, price_index, if_commit_order, time=None,
+                 snapshot_mode=True, snapshot_max_age=0.3, trace_file=None, log_level="INFO", log_file=None,
+                 timezone=None, time_server=None, app_version=None, device_profile=None, calibrate=False,
+                 device_name="OPPO Find X8 Pro", platform_version="15", udid=None, direct_mode=False,
+                 uia2_port=8200, bounds_cache=True, snapshot_max_depth=None, advance_seconds=0.0):
         self.server_url = server_url
         self.keyword = keyword
         self.users = users
         self.city = city
         self.date = date
         self.time = time
+        # 提前于开抢时刻触发的秒数，按 schedule_jitter.jsonl 中的触发误差调整
+        self.advance_seconds = advance_seconds
         self.price = price
         self.price_index = price_index
         self.if_commit_order = if_commit_order
+        # 快照模式：一次拉取页面层级并在本地求值选择器
+        self.snapshot_mode = snapshot_mode
+        self.snapshot_max_age = snapshot_max_age
+        # 页面层级的最大深度（UiAutomator2 设置 snapshotMaxDepth），为空使用服务器默认值
+        self.snapshot_max_depth = snapshot_max_depth
+        # 计时输出文件：.json 为 Chrome Trace，.jsonl 为 JSON Lines，为空则不记录
+        self.trace_file = trace_file
+        # 控制台日志级别；低于该级别的记录只进入环形缓冲区，失败时输出
+        self.log_level = log_level
+        self.log_file = log_file
+        # 开抢时间的时区（如 "Asia/Shanghai"、"+08:00"），为空使用本机时区
+        self.timezone = timezone
+        # SNTP 参考服务器，用于测量并补偿本机时钟偏差，为空不补偿
+        self.time_server = time_server
+        # 大麦 APP 版本，页面指纹表按版本区分
+        self.app_version = app_version
+        # 设备标定的名称，为空时按会话能力中的设备名与系统版本区分
+        self.device_profile = device_profile
+        # 每次启动都预热测量设备往返；为 False 时只在该设备没有样本时测量
+        self.calibrate = calibrate
+        # 连接的设备：名称与系统版本写入会话能力，多台设备连接同一 Appium 服务器时用 udid 区分
+        self.device_name = device_name
+        self.platform_version = platform_version
+        self.udid = udid
+        # 直连模式：查找、点击、页面层级等热点命令直接发往 UiAutomator2 服务器（本机转发端口 uia2_port）
+        self.direct_mode = direct_mode
+        self.uia2_port = uia2_port
+        # 坐标缓存：按页面指纹与分辨率记住元素坐标，校验通过时跳过定位
+        self.bounds_cache = bounds_cache
+
+    @staticmethod
+    def from_dict(config):
+        return Config(config['server_url'],
+                      config['keyword'],
+                      config['users'],
+                      config['city'],
+                      config['date'],
+                      config['price'],
+                      config['price_index'],
+                      config['if_commit_order'],
+                      config['time'],
+                      snapshot_mode=config.get('snapshot_mode', True),
+                      snapshot_max_age=config.get('snapshot_max_age', 0.3),
+                      trace_file=config.get('trace_file'),
+                      log_level=config.get('log_level', "INFO"),
+                      log_file=config.get('log_file'),
+                      timezone=config.get('timezone'),
+                      time_server=config.get('time_server'),
+                      app_version=config.get('app_version'),
+                      device_profile=config.get('device_profile'),
+                      calibrate=config.get('calibrate', False),
+                      device_name=config.get('device_name', "OPPO Find X8 Pro"),
+                      platform_version=config.get('platform_version', "15"),
+                      udid=config.get('udid'),
+                      direct_mode=config.get('direct_mode', False),
+                      uia2_port=config.get('uia2_port', 8200),
+                      bounds_cache=config.get('bounds_cache', True),
+                      snapshot_max_depth=config.get('snapshot_max_depth'),
+                      advance_seconds=config.get('advance_seconds', 0.0)
+                      )
 
     @staticmethod
     def load_config():
@@ -23,18 +91,9 @@ class Config:
             config_path = os.path.join(os.path.dirname(__file__), 'config.json')
             with open(config_path, 'r', encoding='utf-8') as config_file:
                 config = json.load(config_file)
-                print(json.dumps(config, ensure_ascii=False, indent=2))
-            return Config(config['server_url'],
-                        config['keyword'],
-                        config['users'],
-                        config['city'],
-                        config['date'],
-                        config['price'],
-                        config['price_index'],
-                        config['if_commit_order'],
-                        config['time']
-                        )
+                log.info(json.dumps(config, ensure_ascii=False, indent=2))
+            return Config.from_dict(config)
                         
         except Exception as e:
-            print(f"加载配置文件失败: {e}")
+            log.error(f"加载配置文件失败: {e}")
             raise
@@ -2,353 +2,642 @@
 
 
 import time
-from datetime import datetime, timedelta
+from contextlib import contextmanager
 from appium import webdriver
 from appium.options.common.base import AppiumOptions
 from appium.webdriver.common.appiumby import AppiumBy
-from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException
+from selenium.common.exceptions import TimeoutException
 
+from action_plan import ActionPlan, compile_post_sale
+from async_driver import DriverLoop
+from bounds_cache import BoundsCache
+from calibration import Calibration, device_key
 from config import Config
+from direct_driver import DirectDriver, uia2_url
+from gestures import perform_taps
+from instrumentation import TRACER, InstrumentedDriver, traced
+import logger
+from logger import log
+from scheduler import Scheduler
+from screen_classifier import (ATTENDEE, CITY_LIST, DETAIL, DONE, HOME, ORDER, RESULTS, SEARCH, SESSION,
+                               TIER, UNKNOWN, ScreenClassifier)
+from screen_flow import ScreenFlow
+from session import SessionManager
+import transport
+from selector_cascade import CascadeStats, SelectorCascade, compile_cascades
+from ui_snapshot import LocalElement, LocatorUnsupported, Snapshot, rect_bounds, rect_center
+from verify import TapMetrics, verified_tap
+from waits import Waiter, hierarchy_changed, node_selected, package_is, screen_changed, screen_in
 
 
-delay_time = 0.05
+# 开抢前不再保活的窗口相对重建会话耗时的倍数
+KEEP_ALIVE_SAFETY = 1.5
+
 
 class DamaiBot:
-    def __init__(self):
-        self.config = Config.load_config()
+    def __init__(self, config=None, driver_factory=None, selector_stats=None, scheduler=None, classifier=None,
+                 calibration=None, bounds_cache=None):
+        """
+        参数:
+            config: 配置对象，默认从 config.json 加载
+            driver_factory: 可选的驱动工厂（如离线回放用的 FakeDriver），默认连接 Appium 服务器
+            selector_stats: 选择器命中统计，默认读写 selector_stats.json
+            scheduler: 开抢时刻调度器，默认按配置创建
+            classifier: 页面识别器，默认读写 screen_fingerprints.json
+            calibration: 设备标定（超时与轮询间隔），默认读写 device_profiles.json
+            bounds_cache: 元素坐标缓存，默认读写 bounds_cache.json
+        """
+        # 启动各阶段最近一次的耗时 {阶段: 毫秒}，进入详情页开始等待前输出
+        self.startup_stages = {}
+        with self.startup_stage("config"):
+            self.config = config or Config.load_config()
+            logger.setup_logging(self.config.log_level, self.config.log_file)
+        # 启动时一次性编译全部页面的选择器级联
+        with self.startup_stage("cascades"):
+            self.selector_stats = selector_stats or CascadeStats()
+            self.cascades = compile_cascades(self.config, self.selector_stats)
+        self.driver_factory = driver_factory
+        self.scheduler = scheduler or Scheduler.from_config(self.config)
+        self._base_keep_alive_margin = self.scheduler.keep_alive_margin
+        self.classifier = classifier or ScreenClassifier(app_version=self.config.app_version)
+        self.calibration = calibration or Calibration()
+        if bounds_cache is None:
+            bounds_cache = (BoundsCache(app_version=self.config.app_version) if self.config.bounds_cache
+                            else BoundsCache(path=None, max_entries=0))
+        self.bounds_cache = bounds_cache
         self.driver = None
-        self.wait = None
+        # 并发查询用的事件循环与协程门面，会话建立后创建
+        self.driver_loop = DriverLoop()
+        self.async_driver = None
+        self._snapshot = None
+        self.plan = None
+        self.flow = None
+        self.waiter = Waiter()
+        # 关键动作的点击次数与无效点击次数
+        self.tap_metrics = TapMetrics()
+        self._city_selected = False
+        self.phase_marks = []
+        self.session = SessionManager(self)
+        # 等待开抢期间每次重建会话并重新预置的耗时（秒）
+        self.rearm_costs = []
+        if self.config.trace_file:
+            TRACER.enable()
         self._setup_driver()
 
+    def _create_remote_driver(self):
+        """按设备能力连接 Appium 服务器，创建远程会话"""
+        log.info("开始初始化驱动配置...")
+        capabilities = {
+            "platformName": "Android",  # 操作系统
+            "platformVersion": str(self.config.platform_version),  # 系统版本
+            "deviceName": self.config.device_name,  # 设备名称
+            "appPackage": "cn.damai",  # app 包名
+            "appActivity": ".launcher.splash.SplashMainActivity",  # app 启动 Activity
+            "unicodeKeyboard": True,  # 支持 Unicode 输入
+            "resetKeyboard": True,  # 隐藏键盘
+            "noReset": True,  # 不重置 app
+            "newCommandTimeout": 6000,  # 超时时间
+            "automationName": "UiAutomator2",  # 使用 uiautomator2
+            "skipServerInstallation": False,  # 跳过服务器安装
+            "ignoreHiddenApiPolicyError": True,  # 忽略隐藏 API 策略错误
+            "disableWindowAnimation": True,  # 禁用窗口动画
+            # 优化性能配置
+            "mjpegServerFramerate": 1,  # 降低截图帧率
+            "shouldTerminateApp": False,
+            "adbExecTimeout": 20000,
+            "connectionTimeout": 30000,  # 增加连接超时时间
+            "commandTimeout": 30000,  # 增加命令超时时间
+        }
+
+        if self.config.udid:
+            capabilities["udid"] = self.config.udid  # 设备序列号（adb devices）
+        if self.config.direct_mode:
+            capabilities["systemPort"] = self.config.uia2_port  # UiAutomator2 服务器转发到本机的端口
+
+        log.info("设置AppiumOptions...")
+        device_app_info = AppiumOptions()
+        log.info("AppiumOptions设置完成")
+        
+        # 直接设置capabilities而不是使用load_capabilities
+        for key, value in capabilities.items():
+            device_app_info.set_capability(key, value)
+            
+        log.info(f"尝试连接Appium服务器: {self.config.server_url}")
+        # 适配Appium 3.0版本：不带 /wd/hub 基础路径
+        server_url = (self.config.server_url or "http://127.0.0.1:4723").rstrip('/')
+        log.info(f"使用服务器URL: {server_url}")
+        
+        # 添加必要的capabilities
+        device_app_info.set_capability("appium:automationName", "UiAutomator2")
+        
+        # 调优的长连接传输：TCP_NODELAY、不经代理、记录每条命令耗时
+        driver = webdriver.Remote(transport.TunedConnection(server_url), options=device_app_info)
+        log.info("成功连接到Appium服务器")
+        return driver
+
     def _setup_driver(self):
         """初始化驱动配置"""
-        device_app_info = None
         try:
-            print("开始初始化驱动配置...")
-            capabilities = {
-                "platformName": "Android",  # 操作系统
-                "platformVersion": "15",  # 系统版本
-                "deviceName": "OPPO Find X8 Pro",  # 设备名称
-                "appPackage": "cn.damai",  # app 包名
-                "appActivity": ".launcher.splash.SplashMainActivity",  # app 启动 Activity
-                "unicodeKeyboard": True,  # 支持 Unicode 输入
-                "resetKeyboard": True,  # 隐藏键盘
-                "noReset": True,  # 不重置 app
-                "newCommandTimeout": 6000,  # 超时时间
-                "automationName": "UiAutomator2",  # 使用 uiautomator2
-                "skipServerInstallation": False,  # 跳过服务器安装
-                "ignoreHiddenApiPolicyError": True,  # 忽略隐藏 API 策略错误
-                "disableWindowAnimation": True,  # 禁用窗口动画
-                # 优化性能配置
-                "mjpegServerFramerate": 1,  # 降低截图帧率
-                "shouldTerminateApp": False,
-                "adbExecTimeout": 20000,
-                "connectionTimeout": 30000,  # 增加连接超时时间
-                "commandTimeout": 30000,  # 增加命令超时时间
-            }
-
-            print("设置AppiumOptions...")
-            device_app_info = AppiumOptions()
-            print("AppiumOptions设置完成")
-            
-            # 直接设置capabilities而不是使用load_capabilities
-            for key, value in capabilities.items():
-                device_app_info.set_capability(key, value)
-                
-            print(f"尝试连接Appium服务器: {self.config.server_url}")
-            # 适配Appium 3.0版本
-            server_url = "http://127.0.0.1:4723"
-            print(f"使用服务器URL: {server_url}")
-            
-            # 添加必要的capabilities
-            device_app_info.set_capability("appium:automationName", "UiAutomator2")
-            
-            self.driver = webdriver.Remote(server_url, options=device_app_info)
-            print("成功连接到Appium服务器")
+            with self.startup_stage("session"):
+                if self.driver_factory is not None:
+                    log.info("使用自定义驱动工厂创建会话...")
+                    self.driver = self.driver_factory()
+                else:
+                    self.driver = self._create_remote_driver()
+            if self.config.direct_mode:
+                self._enable_direct_mode()
+            if TRACER.enabled:
+                # 代理驱动，记录每条设备命令的耗时与次数
+                self.driver = InstrumentedDriver(self.driver)
+            self.async_driver = self.driver_loop.attach(self.driver)
             
             # 更激进的性能优化设置
-            self.driver.update_settings({
-                "waitForIdleTimeout": 0,  # 空闲时间，0 表示不等待，让 UIAutomator2 不等页面"空闲"再返回
-                "actionAcknowledgmentTimeout": 0,  # 禁止等待动作确认
-                "keyInjectionDelay": 0,  # 禁止输入延迟
-                "waitForSelectorTimeout": 0.01,  # 从500减少到300ms
-                "ignoreUnimportantViews": False,  # 保持false避免元素丢失
-                "allowInvisibleElements": True,
-                "enableNotificationListener": False,  # 禁用通知监听
-            })
-
-            # 极短的显式等待，抢票场景下速度优先
-            self.wait = WebDriverWait(self.driver, 0.05)  # 从5秒减少到2秒
+            with self.startup_stage("settings"):
+                settings = {
+                    "waitForIdleTimeout": 0,  # 空闲时间，0 表示不等待，让 UIAutomator2 不等页面"空闲"再返回
+                    "actionAcknowledgmentTimeout": 0,  # 禁止等待动作确认
+                    "keyInjectionDelay": 0,  # 禁止输入延迟
+                    "waitForSelectorTimeout": 0.01,  # 从500减少到300ms
+                    "ignoreUnimportantViews": False,  # 保持false避免元素丢失
+                    "allowInvisibleElements": True,
+                    "enableNotificationListener": False,  # 禁用通知监听
+                }
+                if self.config.snapshot_max_depth:
+                    # 限制页面层级的深度，减少每次拉取的字节数（同时作用于设备端 XPath 查询）
+                    settings["snapshotMaxDepth"] = self.config.snapshot_max_depth
+                self.driver.update_settings(settings)
+
+            with self.startup_stage("calibrate"):
+                self._calibrate()
         except Exception as e:
-            print(f"初始化驱动配置或连接Appium服务器时出错: {e}")
-            print("请确保Appium服务器已启动，并且设备已连接")
+            log.warning(f"初始化驱动配置或连接Appium服务器时出错: {e}")
+            log.info("请确保Appium服务器已启动，并且设备已连接")
             raise
 
-    def ultra_fast_click(self, by, value, timeout=1.5):
-        """超快速点击 - 适合抢票场景"""
+    def _enable_direct_mode(self):
+        """热点命令改为直连 UiAutomator2 服务器，连接失败时保持经 Appium"""
         try:
-            # 直接查找并点击，不等待可点击状态
-            el = WebDriverWait(self.driver, timeout).until(
-                EC.presence_of_element_located((by, value))
-            )
-            # 直接使用元素ID点击
-            self.driver.execute_script('mobile: clickGesture', {'elementId': el.id})
-            return True
-        except TimeoutException:
-            return False
-            
-    def smart_wait_and_click(self, *selectors, timeout=2, retry_count=3):
-        """智能等待并点击元素，支持多种选择器尝试
-        
-        参数:
-            *selectors: 选择器列表，每个选择器格式为(by, value)
-            timeout: 等待超时时间
-            retry_count: 重试次数
+            self.driver = DirectDriver(self.driver, uia2_url(port=self.config.uia2_port))
+            log.info(f"已启用直连模式: {self.driver.base_url}")
+        except Exception as e:
+            log.warning(f"无法直连 UiAutomator2 服务器，继续经 Appium: {e}")
+
+    @contextmanager
+    def startup_stage(self, name):
+        """记录一个启动阶段的耗时"""
+        start = time.perf_counter()
+        with TRACER.span(name, "startup"):
+            yield
+        self.startup_stages[name] = (time.perf_counter() - start) * 1000
+
+    def log_startup(self):
+        """输出启动各阶段耗时，以及从流程开始到进入详情页的导航耗时"""
+        stages = dict(self.startup_stages)
+        if self.phase_marks:
+            stages["navigate"] = (time.perf_counter() - self.phase_marks[0][1]) * 1000
+        log.info("启动耗时: " + "，".join(f"{name} {ms:.0f} ms" for name, ms in stages.items()))
+
+    def _keep_alive(self):
+        """等待开抢期间的会话保活：一次往返，会话失效时立即重新创建，并确认仍在详情页、重新预置"""
+        if self.session.check() is None:
+            log.warning("等待开抢期间会话失效，重新创建会话")
+            start = time.perf_counter()
+            self.session.reconnect()
+            self._rearm_detail()
+            self.rearm_costs.append(time.perf_counter() - start)
+            self.scheduler.keep_alive_margin = self._keep_alive_margin()
+
+    def _keep_alive_margin(self):
+        """开抢前不再保活的时长（秒），须覆盖一次重建会话加重新预置的耗时，以免重建推迟触发
+
+        有实测的重建耗时时取其最大值，否则按启动时会话、设置、标定、启动 APP 与预置各阶段的耗时估计
         """
-        print(f"调试: smart_wait_and_click 被调用，选择器数量: {len(selectors)}")
-        
-        # 处理选择器参数
-        all_selectors = []
-        for selector in selectors:
-            # 如果是元组且长度为2，直接添加
-            if isinstance(selector, tuple) and len(selector) == 2:
-                all_selectors.append(selector)
-            # 如果是列表，尝试将其中的元组添加进来
-            elif isinstance(selector, list):
-                for item in selector:
-                    if isinstance(item, tuple) and len(item) == 2:
-                        all_selectors.append(item)
-            # 其他情况，尝试构建AppiumBy选择器
-            elif isinstance(selector, str):
-                # 尝试处理常见的选择器字符串格式
-                if selector.startswith('new UiSelector()'):
-                    all_selectors.append((AppiumBy.ANDROID_UIAUTOMATOR, selector))
-                elif selector.startswith('//'):
-                    all_selectors.append((AppiumBy.XPATH, selector))
-                elif selector.startswith('#'):
-                    all_selectors.append((AppiumBy.ID, selector[1:]))
-        
-        print(f"处理后的选择器列表: {all_selectors}")
-        
-        # 如果没有有效选择器，直接返回失败
-        if not all_selectors:
-            print("没有有效的选择器，无法执行点击操作")
-            return False
-            
-        # 保存页面源码以便调试
+        if self.rearm_costs:
+            cost = max(self.rearm_costs)
+        else:
+            cost = sum(self.startup_stages.get(stage, 0)
+                       for stage in ("session", "settings", "calibrate", "launch", "pre_arm")) / 1000
+        return max(self._base_keep_alive_margin, cost * KEEP_ALIVE_SAFETY)
+
+    def _rearm_detail(self):
+        """会话重建后：APP 回到前台，确认仍在详情页并重新预置动作计划
+
+        不在详情页时作废动作计划，开抢后由状态机重新导航，回到详情页时再预置
+        """
+        self._snapshot = None
+        self._ensure_app()
+        state = self.classify_screen()
+        if state == DETAIL:
+            self.pre_arm()
+            log.info("会话重建后仍在详情页，已重新预置")
+        else:
+            log.warning(f"会话重建后当前页面为 {state}，开抢后重新导航到详情页")
+            self.plan = None
+
+    def _calibrate(self):
+        """按当前设备的标定设置轮询间隔；没有往返样本或配置要求时先预热测量"""
+        self.calibration.use(device_key(self.driver, self.config.device_profile))
+        if self.config.calibrate or self.calibration.needs_warmup():
+            try:
+                self.calibration.warm_up(self.driver)
+            except Exception as e:
+                log.warning(f"设备预热测量失败，使用默认超时: {e}")
+        self.waiter = Waiter(*self.calibration.poll_interval())
+        log.debug(f"设备标定: {self.calibration.profile.summary()}")
+
+    def timeout(self, step):
+        """当前设备某一步骤的超时（秒），见 calibration.DEFAULT_TIMEOUTS"""
+        return self.calibration.timeout(step)
+
+    def mark_phase(self, name):
+        """记录抢票流程某一阶段的起点，供基准测试按阶段切分耗时与设备往返"""
+        self.phase_marks.append((name, time.perf_counter()))
+        if name == "end":
+            TRACER.end_phase()
+        else:
+            TRACER.begin_phase(name)
+
+    def take_snapshot(self):
+        """获取页面层级快照，未过期且未作废时复用上一次的结果"""
+        if self._snapshot is None or not self._snapshot.is_fresh(self.config.snapshot_max_age):
+            with TRACER.span("take_snapshot", "snapshot"):
+                # 与上一份相同则复用其解析结果，不同则记录差异
+                self._snapshot = Snapshot.capture(self.driver, previous=self._snapshot)
+        return self._snapshot
+
+    def adopt_source(self, source):
+        """用与其他查询并发取得的层级源码作为当前快照"""
+        with TRACER.span("adopt_snapshot", "snapshot"):
+            self._snapshot = Snapshot.from_source(source, previous=self._snapshot)
+        return self._snapshot
+
+    def concurrent(self, *queries):
+        """并发发出互不依赖的查询（AsyncDriver 的方法名，如 "current_package"），按顺序返回结果"""
+        return self.driver_loop.gather(*(getattr(self.async_driver, query)() for query in queries))
+
+    def probe(self):
+        """一次并发往返取得前台包名与页面层级（快照模式下层级作为当前快照），返回包名"""
+        if not self.config.snapshot_mode:
+            return self.driver.current_package
+        package, source = self.concurrent("current_package", "page_source")
+        self.adopt_source(source)
+        return package
+
+    def classify_screen(self):
+        """用一份快照识别当前页面（快照未过期时不产生设备往返）"""
+        return self.classifier.classify(self.take_snapshot())
+
+    def wait_for(self, condition, timeout, name="条件"):
+        """等待可观察条件成立（见 waits.py），返回条件的值，超时返回 None"""
+        return self.waiter.until(condition, timeout, name)
+
+    def fresh_snapshot(self):
+        """未过期的快照，没有时返回 None（不产生设备往返）"""
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.is_fresh(self.config.snapshot_max_age):
+            return snapshot
+        return None
+
+    def dump_page(self, path, snapshot=None):
+        """失败时把页面层级（默认为最近一份快照）交给后台线程写入 path，不阻塞调用方"""
+        snapshot = snapshot or self._snapshot
+        if snapshot is None:
+            return
+        logger.dump_file(path, snapshot.source)
+        log.info(f"已保存页面源码到 {path}")
+
+    def invalidate_snapshot(self):
+        """页面可能发生变化（点击、跳转）后调用，使下一次查找重新拉取快照"""
+        if self._snapshot is not None:
+            self._snapshot.stale = True
+
+    @traced
+    def find_cascade(self, cascade, timeout=0, poll=None):
+        """按选择器级联查找元素，返回 (命中的选择器, 元素列表)
+
+        快照模式下每轮只拉取一次页面层级，在本地求值整个级联，返回 LocalElement；
+        快照始终未命中或级联中有无法本地求值的选择器时，回退到设备端查询。
+        坐标缓存中有该页面的记录且在快照中校验通过时，直接返回缓存的节点
+        """
+        if isinstance(cascade, str):
+            cascade = self.cascades[cascade]
+        if poll is None:
+            poll = self.waiter.poll
+        if not self.config.snapshot_mode:
+            return self._find_remote(cascade, timeout, poll)
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                snapshot = self.take_snapshot()
+                # 树在这里才解析，源码不合法时同样回退
+                selector, nodes, unsupported = self._resolve_snapshot(cascade, snapshot)
+            except Exception as e:
+                log.warning(f"获取页面快照失败，回退到设备端查询: {e}")
+                break
+            if nodes:
+                return selector, [LocalElement(self.driver, snapshot, node) for node in nodes]
+            if unsupported or time.monotonic() >= deadline:
+                break
+            # 页面可能尚未加载完成，下一轮重新拉取快照
+            snapshot.stale = True
+            time.sleep(poll)
+
+        # 快照可能已过期，或存在只能在设备端求值的选择器
+        return cascade.resolve(self.driver, max(0, deadline - time.monotonic()), poll)
+
+    def _resolve_snapshot(self, cascade, snapshot):
+        """在一份快照中求值级联（先查坐标缓存），返回 (命中的选择器, 节点列表, 是否存在无法本地求值的选择器)"""
+        selector, nodes = self.bounds_cache.resolve(cascade, snapshot)
+        if nodes:
+            return selector, nodes, False
+        selector, nodes, unsupported = cascade.resolve_local(snapshot)
+        if nodes:
+            self.bounds_cache.store(snapshot, selector, nodes)
+        return selector, nodes, unsupported
+
+    def nodes_in(self, cascade, snapshot):
+        """在给定快照中按级联查找节点，不产生设备往返"""
+        if isinstance(cascade, str):
+            cascade = self.cascades[cascade]
+        return self._resolve_snapshot(cascade, snapshot)[1]
+
+    def _find_remote(self, cascade, timeout, poll):
+        """非快照模式：识别页面时拉取的快照仍未过期时先查坐标缓存，未命中再到设备端查询"""
+        snapshot = self.fresh_snapshot()
+        if snapshot is not None:
+            selector, nodes = self.bounds_cache.resolve(cascade, snapshot)
+            if nodes:
+                return selector, [LocalElement(self.driver, snapshot, node) for node in nodes]
+        selector, elements = cascade.resolve(self.driver, timeout, poll)
+        if elements and snapshot is not None:
+            self._learn_bounds(snapshot, selector, len(elements))
+        return selector, elements
+
+    def _learn_bounds(self, snapshot, selector, count=None):
+        """设备端命中后，在快照中找到同样数量（count 为 None 时不限）的节点时记入坐标缓存（不产生往返）"""
+        try:
+            nodes = snapshot.find(*selector)
+        except LocatorUnsupported:
+            return
+        if nodes and count in (None, len(nodes)):
+            self.bounds_cache.store(snapshot, selector, nodes)
+
+    @traced
+    def click_cascade(self, cascade, timeout=None):
+        """按选择器级联定位并点击第一个命中元素，返回命中的选择器，未命中返回 None"""
+        if timeout is None:
+            timeout = self.timeout("click")
+        selector, elements = self.find_cascade(cascade, timeout)
+        name = cascade if isinstance(cascade, str) else cascade.name
+        if not elements:
+            log.warning(f"选择器级联 {name} 未命中")
+            return None
+        element = elements[0]
+        if isinstance(element, LocalElement):
+            # 按快照中的 bounds 中心坐标点击，无需再次查找元素
+            element.click()
+        else:
+            self.driver.execute_script('mobile: clickGesture', {'elementId': element.id})
+        self.invalidate_snapshot()
+        log.info(f"成功点击 {name}: {selector}")
+        return selector
+
+    @traced
+    def pre_arm(self):
+        """开售前预置：获取屏幕尺寸、定位立即预订按钮、预编译开售后的定位语句"""
+        if self.config.snapshot_mode:
+            # 重新拉取一份层级，屏幕尺寸取自层级根节点，按钮在本地求值
+            self.invalidate_snapshot()
+            self.take_snapshot()
+            screen_size = self._screen_size()
+            selector, point = self._locate_booking()
+        else:
+            # 窗口尺寸与设备端查找立即预订按钮互不依赖，并发执行
+            screen_size, (selector, point) = self.driver_loop.gather(
+                self.async_driver.window_size(), self.async_driver.call(self._locate_booking))
+        log.debug(f"屏幕尺寸: {screen_size['width']}x{screen_size['height']}")
+        plan = ActionPlan(screen_size, point, selector)
+        if point is not None:
+            log.info(f"已定位立即预订按钮: {point}")
+        compile_post_sale(self.cascades)
+        self.plan = plan
+        return plan
+
+    def _locate_booking(self):
+        """定位立即预订按钮，返回 (命中的选择器, 中心坐标)，未找到时坐标为 None"""
         try:
-            page_source = self.driver.page_source
-            print(f"页面源码片段: {page_source[:200]}...")
+            selector, elements = self.find_cascade("detail.booking")
+            if elements:
+                rect = elements[0].rect
+                return selector, (rect['x'] + rect['width'] // 2, rect['y'] + rect['height'] // 2)
+            log.warning("开售前未找到立即预订按钮，开售时按备选位置点击")
         except Exception as e:
-            print(f"获取页面源码失败: {e}")
-            
-        for attempt in range(retry_count):
-            print(f"尝试点击，第 {attempt+1}/{retry_count} 次")
-            for selector in all_selectors:
-                try:
-                    by, value = selector
-                    print(f"尝试使用选择器: ({by}, {value})")
-                    
-                    # 先尝试查找元素是否存在
-                    try:
-                        el = WebDriverWait(self.driver, timeout/2).until(
-                            EC.presence_of_element_located((by, value))
-                        )
-                        print(f"找到元素: {el.tag_name}, ID: {el.id}")
-                    except Exception as find_err:
-                        print(f"元素未找到: {find_err}")
-                        continue
-                        
-                    if self.ultra_fast_click(by, value, timeout):
-                        print(f"成功点击元素: ({by}, {value})")
-                        return True
-                    else:
-                        print(f"点击失败: ({by}, {value})")
-                except Exception as e:
-                    print(f"点击过程中出错: {e}")
-                    continue
-            print(f"所有选择器尝试失败，等待0.5秒后重试")
-            time.sleep(delay_time)
-        print(f"所有尝试均失败")
-        return False
+            log.warning(f"定位立即预订按钮失败: {e}")
+        return None, None
 
-    def batch_click(self, elements_info, delay=0.1):
-        """批量点击操作"""
-        for by, value in elements_info:
-            if self.ultra_fast_click(by, value):
-                if delay > 0:
-                    time.sleep(delay_time)
-            else:
-                print(f"点击失败: {value}")
+    def tap_sequence(self, points):
+        """同一页面上的一串点击编成一个 W3C actions 请求，一次往返执行完"""
+        perform_taps(self.driver, points)
+        self.invalidate_snapshot()
+
+    def read_back(self, before, settled):
+        """点击后读回层级：等到层级相对点击前的快照 before 有变化且 settled(快照) 成立
+
+        界面更新较慢时不会按点击前的状态误判而补点（补点会取消勾选或多加票数）；
+        超过 find 超时仍未成立时返回最新一份快照，由调用方决定是否补点
+        """
+        snapshot = self.wait_for(hierarchy_changed(self, before.source, settled), self.timeout("find"), "等待点击生效")
+        return snapshot or self.take_snapshot()
+
+    @traced
+    def ultra_batch_click(self, elements_info, timeout=None):
+        """批量勾选：从一份快照解析全部目标，一次请求发出整串点击，再读回勾选状态，未勾上的补点一次
+
+        返回确认已勾选的数量
+        """
+        if timeout is None:
+            timeout = self.timeout("click")
+        if not self.config.snapshot_mode:
+            return self._batch_click_remote(elements_info, timeout)
+
+        # {(定位方式, 定位语句): (快照, 节点)}，等待全部出现在同一份快照中，超时后按已找到的部分执行
+        targets = {}
 
-    def ultra_batch_click(self, elements_info, timeout=2):
-        """超快批量点击 - 带等待机制"""
+        def all_located():
+            snapshot = self.take_snapshot()
+            targets.clear()
+            for by, value in elements_info:
+                nodes = self.bounds_cache.find(snapshot, (by, value))
+                if nodes:
+                    targets[(by, value)] = (snapshot, nodes[0])
+            if len(targets) == len(elements_info):
+                return targets
+            snapshot.stale = True
+            return None
+
+        try:
+            self.wait_for(all_located, timeout, "等待批量点击目标")
+        except LocatorUnsupported:
+            return self._batch_click_remote(elements_info, timeout)
+        for locator in elements_info:
+            if locator not in targets:
+                log.warning(f"超时未找到用户: {locator[1]}")
+        log.info(f"成功找到 {len(targets)} 个用户")
+
+        # 已勾选的不再点击，否则会取消勾选
+        pending = [(locator, snapshot.center(node), snapshot.attr(node, 'bounds'))
+                   for locator, (snapshot, node) in targets.items() if snapshot.attr(node, 'checked') != 'true']
+        before = next(iter(targets.values()))[0] if targets else None
+
+        def unchecked(snapshot):
+            # 只流式读取本次点击的复选框的勾选状态；布局有变化时按定位语句重新查找
+            states = snapshot.attrs_at(bounds for _, _, bounds in pending)
+            return [(locator, point, bounds) for locator, point, bounds in pending
+                    if not (states[bounds].get('checked') == 'true' if bounds in states else
+                            any(snapshot.attr(node, 'checked') == 'true'
+                                for node in self.bounds_cache.find(snapshot, locator)))]
+
+        for attempt in range(2):
+            if not pending:
+                break
+            self.tap_sequence([point for _, point, _ in pending])
+            log.debug(f"已批量点击用户: {[locator[1] for locator, _, _ in pending]}")
+            # 读回：等本次点击的复选框都勾上（或到截止时间），仍未勾上的补点一次
+            before = self.read_back(before, lambda s: not unchecked(s))
+            tapped = len(pending)
+            pending = unchecked(before)
+            self.tap_metrics.record("attendee", True, tapped - len(pending))
+            self.tap_metrics.record("attendee", False, len(pending))
+            if pending and attempt == 0:
+                log.warning(f"以下用户未勾选成功，补点一次: {[locator[1] for locator, _, _ in pending]}")
+        if pending:
+            log.warning(f"以下用户仍未勾选: {[locator[1] for locator, _, _ in pending]}")
+        return len(targets) - len(pending)
+
+    def _batch_click_remote(self, elements_info, timeout):
+        """非快照模式：逐个在设备端定位坐标（坐标缓存校验通过的跳过），再一次请求发出整串点击（不读回勾选状态）"""
         coordinates = []
+        snapshot = self.fresh_snapshot()
         # 批量收集坐标，带超时等待
         for by, value in elements_info:
+            nodes = self.bounds_cache.lookup(snapshot, (by, value)) if snapshot is not None else None
+            if nodes:
+                coordinates.append(snapshot.center(nodes[0]))
+                continue
             try:
                 # 等待元素出现
-                el = WebDriverWait(self.driver, timeout).until(
-                    EC.presence_of_element_located((by, value))
-                )
+                with TRACER.span("WebDriverWait", "wait", selector=value):
+                    el = WebDriverWait(self.driver, timeout).until(
+                        EC.presence_of_element_located((by, value))
+                    )
                 rect = el.rect
                 x = rect['x'] + rect['width'] // 2
                 y = rect['y'] + rect['height'] // 2
-                coordinates.append((x, y, value))
+                coordinates.append((x, y))
+                if snapshot is not None:
+                    self._learn_bounds(snapshot, (by, value))
             except TimeoutException:
-                print(f"超时未找到用户: {value}")
+                log.warning(f"超时未找到用户: {value}")
             except Exception as e:
-                print(f"查找用户失败 {value}: {e}")
-        print(f"成功找到 {len(coordinates)} 个用户")
-        # 快速连续点击
-        for i, (x, y, value) in enumerate(coordinates):
-            self.driver.execute_script("mobile: clickGesture", {
-                "x": x,
-                "y": y,
-                "duration": 30
-            })
-            if i < len(coordinates) - 1:
-                time.sleep(delay_time)
-            print(f"点击用户: {value}")
+                log.warning(f"查找用户失败 {value}: {e}")
+        log.info(f"成功找到 {len(coordinates)} 个用户")
+        self.tap_sequence(coordinates)
+        return len(coordinates)
 
+    @traced
     def select_first_search_result(self):
         """选择搜索结果中的第一个项目"""
         try:
-            print("\n===== 尝试选择第一个搜索结果 =====")
-            # 等待页面加载
-            time.sleep(delay_time)  # 增加等待时间，确保搜索结果完全加载
-            
-            # 检查当前Activity
+            log.info("\n===== 尝试选择第一个搜索结果 =====")
+            # 等待进入搜索结果页，快照同时用于后续的级联查找
             try:
-                current_activity = self.driver.current_activity
-                print(f"当前Activity: {current_activity}")
+                if not self.wait_for(screen_in(self, RESULTS), self.timeout("load"), "等待搜索结果页"):
+                    log.warning(f"当前不在搜索结果页: {self.classify_screen()}")
             except Exception as e:
-                print(f"获取当前Activity失败: {e}")
+                log.warning(f"识别当前页面失败: {e}")
             
-            # 保存页面源码以便调试
-            try:
-                page_source = self.driver.page_source
-                print(f"搜索结果页面源码片段: {page_source[:300]}...")
-                
-                # 保存页面源码到文件
-                try:
-                    with open("search_results_page.xml", "w", encoding="utf-8") as f:
-                        f.write(page_source)
-                    print("已保存搜索结果页面源码到search_results_page.xml")
-                except Exception as e:
-                    print(f"保存页面源码到文件失败: {e}")
-            except Exception as e:
-                print(f"获取页面源码失败: {e}")
-            
-            
-            # 扩展搜索结果选择器
-            # 搜索结果选择器 - 优先使用演员名称
+            # 搜索结果页的层级留作失败时的调试材料（不产生往返，成功时不写文件）
+            results_snapshot = self.fresh_snapshot()
+
+            # 搜索结果选择器级联 - 优先使用演员名称
             keyword = self.config.keyword  # 默认使用配置中的关键词（如"刘若英"）
-            
-            # 确保使用演员名称进行搜索
-            result_selectors = [
-                # 演员名称特定选择器（最高优先级）
-                (AppiumBy.XPATH, f'//android.widget.TextView[contains(@text, "{keyword}")]/parent::*'),
-                (AppiumBy.ANDROID_UIAUTOMATOR, f'new UiSelector().textContains("{keyword}")'),
-                
-                # 第一个搜索结果选择器（通用）
-                (AppiumBy.XPATH, '//android.widget.LinearLayout[@resource-id="cn.damai:id/ll_search_item"][1]'),
-                (AppiumBy.XPATH, '//android.widget.TextView[@resource-id="cn.damai:id/item_title"][1]'),
-                (AppiumBy.XPATH, '//android.widget.ListView/android.widget.LinearLayout[1]'),
-                (AppiumBy.XPATH, '//android.widget.RecyclerView/android.widget.LinearLayout[1]'),
-                (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().className("android.widget.ListView").childSelector(new UiSelector().index(0))'),
-                (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().className("android.widget.RecyclerView").childSelector(new UiSelector().index(0))')
-            ]
-            
-            print(f"尝试点击包含'{keyword}'的第一个搜索结果...")
+            log.info(f"尝试点击包含'{keyword}'的第一个搜索结果...")
             success = False
             
-            # 使用选择器精确定位并模拟点击
-            for by, value in result_selectors:
-                if success:
-                    break
-                    
+            # 使用选择器级联精确定位并模拟点击，增加等待时间确保元素完全加载
+            selector, elements = self.find_cascade("results.first_result", timeout=5)
+            if elements:
+                element = elements[0]
                 try:
-                    print(f"尝试使用选择器: ({by}, {value})")
-                    # 增加等待时间，确保元素完全加载
-                    element = WebDriverWait(self.driver, 5).until(
-                        EC.presence_of_element_located((by, value))
-                    )
-                    print(f"找到元素: {element.tag_name}, 尝试点击...")
+                    log.debug(f"使用选择器: {selector}")
+                    log.debug(f"找到元素: {element.tag_name}, 尝试点击...")
                     
-                    # 获取元素位置和大小，用于模拟点击
-                    location = element.location
-                    size = element.size
-                    center_x = location['x'] + size['width'] // 2
-                    center_y = location['y'] + size['height'] // 2
+                    # 一次取得元素位置和大小，用于模拟点击
+                    rect = element.rect
+                    center_x = rect['x'] + rect['width'] // 2
+                    center_y = rect['y'] + rect['height'] // 2
                     
-                    print(f"元素中心点坐标: ({center_x}, {center_y})")
+                    log.debug(f"元素中心点坐标: ({center_x}, {center_y})")
                     
                     # 尝试多种点击方式
                     try:
                         # 方式1: 使用driver.tap方法模拟点击
                         self.driver.tap([(center_x, center_y)])
-                        print(f"已使用tap方法模拟点击坐标 ({center_x}, {center_y})")
+                        self.invalidate_snapshot()
+                        log.debug(f"已使用tap方法模拟点击坐标 ({center_x}, {center_y})")
                         success = True
                     except Exception as touch_err:
-                        print(f"tap方法点击失败: {touch_err}，尝试其他方式")
+                        log.warning(f"tap方法点击失败: {touch_err}，尝试其他方式")
                         
                         try:
                             # 方式2: 直接点击元素
                             element.click()
-                            print("已使用element.click()点击搜索结果")
+                            log.info("已使用element.click()点击搜索结果")
                             success = True
                         except Exception as click_err:
-                            print(f"直接点击失败: {click_err}，尝试使用JS点击")
+                            log.warning(f"直接点击失败: {click_err}，尝试使用JS点击")
                             
                             # 方式3: 使用JS点击
                             try:
                                 self.driver.execute_script('mobile: clickGesture', {'elementId': element.id})
-                                print("已使用JS点击搜索结果")
+                                log.info("已使用JS点击搜索结果")
                                 success = True
                             except Exception as js_err:
-                                print(f"JS点击也失败: {js_err}，尝试使用坐标点击")
+                                log.warning(f"JS点击也失败: {js_err}，尝试使用坐标点击")
                                 # 方式4: 使用坐标点击
                                 try:
-                                    rect = element.rect
-                                    x = rect['x'] + rect['width'] // 2
-                                    y = rect['y'] + rect['height'] // 2
-                                    self.driver.tap([(x, y)], 500)  # 增加点击时间
-                                    print(f"已使用坐标({x}, {y})点击第一个搜索结果")
+                                    # 复用开头取得的中心坐标，改为长按
+                                    self.driver.tap([(center_x, center_y)], 500)  # 增加点击时间
+                                    self.invalidate_snapshot()
+                                    log.debug(f"已使用坐标({center_x}, {center_y})点击第一个搜索结果")
                                     success = True
                                 except Exception as tap_err:
-                                    print(f"坐标点击也失败: {tap_err}")
+                                    log.warning(f"坐标点击也失败: {tap_err}")
                     
-                    # 等待页面跳转
-                    time.sleep(delay_time)  # 增加等待时间
+                    # 等待页面离开搜索结果页
+                    self.wait_for(screen_changed(self, RESULTS), self.timeout("transition"), "等待进入详情页")
                     
                     # 验证是否成功进入演出详情页
                     if self.verify_detail_page():
                         return True
                         
                 except Exception as e:
-                    print(f"尝试点击 {by}={value} 失败: {e}")
-                    continue
+                    log.warning(f"尝试点击 {selector} 失败: {e}")
             
             # 方法2: 如果所有选择器都失败，尝试点击搜索结果区域
             if not success:
-                print("尝试点击搜索结果区域...")
+                log.info("尝试点击搜索结果区域...")
                 try:
-                    # 尝试获取屏幕尺寸
-                    screen_size = self.driver.get_window_size()
-                    width = screen_size['width']
-                    height = screen_size['height']
-                    print(f"屏幕尺寸: {width}x{height}")
-                    
-                    # 定义可能的搜索结果位置
+                    # 按屏幕比例换算可能的搜索结果位置，屏幕尺寸取自快照
+                    plan = self._screen_plan()
                     click_positions = [
-                        (width // 2, int(height * 0.25)),  # 屏幕上部
-                        (width // 2, int(height * 0.3)),   # 稍微往下一点
-                        (width // 2, int(height * 0.35)),  # 再往下一点
-                        (width // 2, int(height * 0.4))    # 更往下一点
+                        plan.point(0.5, 0.25),  # 屏幕上部
+                        plan.point(0.5, 0.3),   # 稍微往下一点
+                        plan.point(0.5, 0.35),  # 再往下一点
+                        plan.point(0.5, 0.4)    # 更往下一点
                     ]
                     
                     for i, (x, y) in enumerate(click_positions):
@@ -358,764 +647,473 @@ class DamaiBot:
                         try:
                             # 使用长按确保点击成功
                             self.driver.tap([(x, y)], 500)  # 增加点击时间
-                            print(f"尝试点击位置 {i+1}: ({x}, {y})")
-                            time.sleep(delay_time)
+                            self.invalidate_snapshot()
+                            log.debug(f"尝试点击位置 {i+1}: ({x}, {y})")
+                            self.wait_for(screen_changed(self, RESULTS), self.timeout("find"), "等待进入详情页")
                             
                             # 验证是否成功进入演出详情页
                             if self.verify_detail_page():
                                 success = True
                                 return True
                         except Exception as e:
-                            print(f"点击位置 {i+1} 失败: {e}")
+                            log.warning(f"点击位置 {i+1} 失败: {e}")
                 except Exception as e:
-                    print(f"使用坐标点击失败: {e}")
+                    log.warning(f"使用坐标点击失败: {e}")
             
-            print("无法找到搜索结果")
+            log.warning("无法找到搜索结果")
+            self.dump_page("search_results_page.xml", results_snapshot)
             return False
         except Exception as e:
-            print(f"选择第一个搜索结果时出错: {e}")
+            log.warning(f"选择第一个搜索结果时出错: {e}")
+            self.dump_page("search_results_page.xml")
             return False
             
+    @traced
     def verify_detail_page(self):
-        """验证是否已进入详情页面"""
+        """验证是否已进入详情页面：按一份快照的页面指纹判定，不再逐个查找指示元素"""
         try:
-            # 检查Activity变化
-            try:
-                current_activity = self.driver.current_activity
-                print(f"当前Activity: {current_activity}")
-                if ".detail." in current_activity or "DetailActivity" in current_activity:
-                    print("已成功进入演出详情页 (Activity包含detail)")
-                    return True
-            except Exception as e:
-                print(f"获取当前Activity失败: {e}")
-            
-            # 检查页面元素
-            detail_indicators = [
-                (AppiumBy.ID, "cn.damai:id/detail_title"),
-                (AppiumBy.ID, "cn.damai:id/detail_subtitle"),
-                (AppiumBy.ID, "cn.damai:id/detail_time"),
-                (AppiumBy.ID, "cn.damai:id/detail_address"),
-                (AppiumBy.XPATH, "//android.widget.Button[contains(@text, '立即购买') or contains(@text, '确定')]"),
-                (AppiumBy.XPATH, "//android.widget.TextView[contains(@text, '场次') or contains(@text, '票档')]")
-            ]
-            
-            for by, value in detail_indicators:
-                try:
-                    element = self.driver.find_element(by, value)
-                    if element:
-                        print(f"找到详情页指示元素: {by}={value}")
-                        return True
-                except Exception:
-                    continue
-            
-                
-            return False
-        except Exception as e:
-            print(f"验证详情页时出错: {e}")
+            screen = self.classify_screen()
+            log.debug(f"当前页面: {screen}")
+            if screen in (DETAIL, CITY_LIST):
+                log.info("已成功进入演出详情页")
+                return True
             return False
         except Exception as e:
-            print(f"选择搜索结果时出错: {e}")
+            log.warning(f"验证详情页时出错: {e}")
             return False
 
-    def run_ticket_grabbing(self):
-        """执行抢票主流程"""
-        try:
-            print("开始抢票流程...")
-            start_time = time.time()
+    def _screen_handlers(self):
+        return {
+            HOME: self._on_home,
+            SEARCH: self._on_search,
+            RESULTS: self._on_results,
+            DETAIL: self._on_detail,
+            CITY_LIST: self._on_city_list,
+            SESSION: self._on_session,
+            TIER: self._on_tier,
+            ATTENDEE: self._on_attendee,
+            ORDER: self._on_order,
+            DONE: self._on_done,
+            UNKNOWN: self._on_unknown,
+        }
 
-            # 检查APP是否已启动
-            try:
-                print("检查APP是否已启动...")
-                current_activity = self.driver.current_activity
-                current_package = self.driver.current_package
-                print(f"当前活动: {current_activity}, 当前包: {current_package}")
-                
-                # 如果APP未启动，尝试启动它
-                if current_package != "cn.damai":
-                    print("大麦APP未启动，尝试启动...")
-                    self.driver.activate_app("cn.damai")
-                    time.sleep(delay_time)  # 等待APP启动
-                    print("APP启动完成")
-            except Exception as e:
-                print(f"检查APP状态时出错: {e}")
-            
-            
-            # 先点击精选菜单栏
+    def _screen_size(self):
+        """屏幕尺寸：优先取最近一份快照根节点上的宽高（无需往返），没有时查询设备"""
+        size = self._snapshot.screen_size() if self._snapshot is not None else None
+        return size or self.driver.get_window_size()
+
+    def _screen_plan(self):
+        """开售前预置的动作计划；未经过详情页时只取屏幕尺寸"""
+        if self.plan is None:
+            self.plan = ActionPlan(self._screen_size())
+        return self.plan
+
+    def _on_home(self):
+        """首页：点击精选菜单栏，再点击搜索框进入搜索页"""
+        log.info("尝试点击精选菜单栏...")
+        if not self.click_cascade("home.featured_tab"):
+            log.warning("未找到精选菜单栏，尝试点击底部导航栏...")
+            if self.click_cascade("home.nav_button"):
+                self.click_cascade("home.featured_tab")
+            else:
+                log.warning("无法找到导航按钮")
+
+        self.mark_phase("search")
+        log.info("尝试点击搜索框...")
+        if not self.click_cascade("home.search_box"):
+            log.warning("未找到搜索框，尝试点击导航按钮后重试...")
+            self.click_cascade("home.nav_button")
+
+    def _on_search(self):
+        """搜索页：输入关键词；再次进入时说明未自动出结果，改为点击搜索按钮或回车"""
+        if self.flow.repeats == 0:
             try:
-                print("尝试点击精选菜单栏...")
-                featured_tab_selectors = [
-                    (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().text("精选")'),
-                    (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().textContains("精选")'),
-                    (By.XPATH, '//android.widget.TextView[@text="精选"]'),
-                    (By.XPATH, '//*[contains(@text, "精选")]')
-                ]
-                
-                if self.smart_wait_and_click(*featured_tab_selectors[0], featured_tab_selectors[1:]):
-                    print("成功点击精选菜单栏")
-                else:
-                    print("未找到精选菜单栏，尝试点击底部导航栏...")
-                    # 尝试点击底部导航栏的任意按钮
-                    nav_btn_selectors = [
-                        (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().text("首页")'),
-                        (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().text("我的")'),
-                        (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().text("发现")'),
-                        (By.XPATH, '//android.widget.TextView[@text="首页"]'),
-                        (By.XPATH, '//android.widget.TextView[@text="我的"]'),
-                        (By.XPATH, '//android.widget.TextView[@text="发现"]')
-                    ]
-                    if self.smart_wait_and_click(*nav_btn_selectors[0], nav_btn_selectors[1:]):
-                        print("成功点击导航按钮")
-                        # 再次尝试点击精选菜单栏
-                        if self.smart_wait_and_click(*featured_tab_selectors[0], featured_tab_selectors[1:]):
-                            print("成功点击精选菜单栏")
-                        else:
-                            print("无法找到精选菜单栏")
-                    else:
-                        print("无法找到导航按钮")
+                # 优先使用EditText类查找输入框
+                search_input = self.driver.find_element(AppiumBy.CLASS_NAME, "android.widget.EditText")
+                search_input.clear()
+                search_input.send_keys(self.config.keyword)
+                log.info(f"已输入搜索关键词: {self.config.keyword}")
+                return None
             except Exception as e:
-                print(f"点击精选菜单栏时出错: {e}")
-            
-            # 尝试搜索关键词
+                log.warning(f"输入搜索关键词时出错: {e}")
+
+        log.info("尝试点击搜索按钮或使用回车键...")
+        if self.click_cascade("search.search_button"):
+            log.info("成功点击搜索按钮")
+            return None
+        try:
+            from selenium.webdriver.common.keys import Keys
+            from selenium.webdriver import ActionChains
+            ActionChains(self.driver).send_keys(Keys.ENTER).perform()
+            log.info("已使用回车键搜索")
+        except Exception as e:
+            log.warning(f"使用回车键失败: {e}")
+
+    def _on_results(self):
+        """搜索结果页：点击第一个搜索结果进入详情页"""
+        self.mark_phase("result_select")
+        log.info(f"尝试点击包含'{self.config.keyword}'的第一个搜索结果...")
+        selector, elements = self.find_cascade("results.first_result", timeout=self.timeout("load"))
+        if not elements:
+            log.warning("选择器未找到搜索结果元素，尝试按位置点击...")
+            self.select_first_search_result()
+            return None
+
+        element = elements[0]
+        rect = element.rect
+        center_x = rect['x'] + rect['width'] // 2
+        center_y = rect['y'] + rect['height'] // 2
+        log.debug(f"使用选择器 {selector}，元素中心点坐标: ({center_x}, {center_y})")
+        try:
+            self.driver.tap([(center_x, center_y)], 500)
+        except Exception as e:
+            log.warning(f"tap方法点击失败: {e}，尝试直接点击元素")
+            element.click()
+        self.invalidate_snapshot()
+        log.info("成功点击搜索结果，等待页面加载...")
+
+    def _on_city_list(self):
+        """城市列表：点击配置的城市回到详情页"""
+        self.mark_phase("city")
+        if self.click_cascade("detail.city"):
+            self._city_selected = True
+            log.info(f"已完成城市选择: {self.config.city}")
+        else:
+            log.warning("城市选择可能失败")
+
+    def _on_detail(self):
+        """详情页：选择城市，开售前预置动作，等到开抢时刻后点击立即预订"""
+        if not self._city_selected:
+            self.mark_phase("city")
+            log.info(f"尝试选择城市: {self.config.city}")
+            if self.click_cascade("detail.city"):
+                log.info(f"已完成城市选择: {self.config.city}")
+            else:
+                log.warning("城市选择可能失败，继续执行后续流程")
+            self._city_selected = True
+
+        self.mark_phase("pre_arm")
+        with self.startup_stage("pre_arm"):
+            self.pre_arm()
+
+        self.log_startup()
+        self.mark_phase("wait")
+        self.scheduler.keep_alive_margin = self._keep_alive_margin()
+        # 会话建立、APP 启动与进入详情页都已在开售前完成，在详情页保活等待开抢
+        with TRACER.span("wait_until", "schedule"):
+            self.scheduler.wait(self.config.time, self.config.advance_seconds, keep_alive=self._keep_alive)
+        # 保活期间可能重建了会话并重新预置；已离开详情页时交给状态机重新导航
+        plan = self.plan
+        if plan is None:
+            log.warning("开抢时不在详情页，重新导航")
+            return None
+        self.mark_phase("booking")
+        # 开售后的关键窗口内只输出警告与错误，其余记录在提交订单后补输出
+        logger.begin_quiet()
+        log.info("尝试点击立即预订按钮...")
+
+        # 预置的按钮坐标优先，其后是备选位置；点击后进入场次及之后的页面才算生效，
+        # 仍停留在详情页时立即改点下一个位置，页面加载中或已到其他页面时不再盲点
+        point, _ = verified_tap(self, "booking", plan.booking_points(),
+                                lambda p: self.driver.tap([p], 100),
+                                lambda p: screen_in(self, SESSION, TIER, ATTENDEE, ORDER), self.timeout("transition"),
+                                retry_if=lambda: self.classify_screen() == DETAIL)
+        if point is not None:
+            log.debug(f"已模拟点击坐标: {point}")
+            return None
+        log.warning("所有点击立即预订按钮的尝试均未生效，请检查页面状态")
+        return False
+
+    def _on_session(self):
+        """场次选择：点击目标日期，找不到时点击屏幕中间位置"""
+        self.mark_phase("date")
+        log.info(f"开始选择日期: {self.config.date}")
+        _, dates = self.find_cascade("session.date", timeout=0)
+        # 日期元素优先，其后是屏幕中间位置；点击后进入票档及之后的页面才算生效，仍在场次页时才改点下一个
+        candidates = [rect_center(dates[0].rect)] if dates else []
+        if not dates:
+            log.warning("未找到日期元素，尝试点击屏幕中间位置...")
+        candidates.append(self._screen_plan().point(0.5, 0.4))
+        point, _ = verified_tap(self, "date", candidates,
+                                lambda p: self.driver.execute_script('mobile: clickGesture', {'x': p[0], 'y': p[1]}),
+                                lambda p: screen_in(self, TIER, ATTENDEE, ORDER), self.timeout("transition"),
+                                retry_if=lambda: self.classify_screen() == SESSION)
+        if point is None:
+            log.warning("选择日期后页面未变化")
+        else:
+            log.debug(f"已点击日期位置: {point}")
+
+    def _on_tier(self):
+        """票档选择：点击第一个可用票档并按人数点击加号，确认票档已选中、数量足够后点击确定
+
+        票档与加号编成一个请求，随后读回一份层级：票档未被选中时立即改点下一个可用票档，
+        数量不足时补点加号；确定按钮取自读回的层级
+        """
+        self.mark_phase("tier")
+        ticket_selector, ticket_elements = self.find_cascade("tier.ticket")
+        if not ticket_elements:
+            log.warning("未找到票档选项")
+            return None
+        log.debug(f"使用选择器 {ticket_selector} 找到 {len(ticket_elements)} 个票档选项")
+        # 票档页一次性解析：加号取自同一份快照，与票档一起按坐标连续点击
+        _, plus_buttons = self.find_cascade("tier.plus_button")
+
+        # 过滤掉包含"缺货登记"的元素，没有可用票档时选择第一个
+        available_tickets = []
+        for element in ticket_elements:
             try:
-                print("尝试搜索关键词...")
-                
-                # 简化后的搜索框选择器，优先使用textContains("搜索")
-                search_box_selectors = [
-                    (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().textContains("搜索")'),
-                    (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().resourceId("cn.damai:id/search_bar")'),
-                    (By.XPATH, '//*[contains(@text, "搜索")]')
-                ]
-                
-                # 尝试点击搜索框
-                print("尝试点击搜索框...")
-                if self.smart_wait_and_click(*search_box_selectors):
-                    print("成功点击搜索框")
-                    
-                    # 检查是否已进入搜索页面
-                    try:
-                        current_activity = self.driver.current_activity
-                        print(f"当前Activity: {current_activity}")
-                    except Exception as e:
-                        print(f"获取当前Activity失败: {e}")
-                    
-                    # 简化后的搜索输入框查找和输入逻辑
-                    try:
-                        # 优先使用EditText类查找输入框
-                        search_input = self.driver.find_element(AppiumBy.CLASS_NAME, "android.widget.EditText")
-                        print("找到搜索输入框: class name=android.widget.EditText")
-                        
-                        # 清除并输入关键词
-                        search_input.clear()
-                        search_input.send_keys(self.config.keyword)
-                        print(f"已输入搜索关键词: {self.config.keyword}")
-                    except Exception as e:
-                        print(f"输入搜索关键词时出错: {e}")
-                        
-                        # 点击搜索按钮或回车
-                        print("尝试点击搜索按钮或使用回车键...")
-                        
-                        # 简化的搜索按钮选择器
-                        search_btn_selectors = [
-                            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().text("搜索")'),
-                            (By.XPATH, '//android.widget.TextView[@text="搜索"]')
-                        ]
-                        
-                        # 尝试点击搜索按钮
-                        if self.smart_wait_and_click(*search_btn_selectors):
-                            print("成功点击搜索按钮")
-                        else:
-                            # 使用回车键搜索
-                            try:
-                                from selenium.webdriver.common.keys import Keys
-                                from selenium.webdriver import ActionChains
-                                actions = ActionChains(self.driver)
-                                actions.send_keys(Keys.ENTER).perform()
-                                print("已使用回车键搜索")
-                            except Exception as e:
-                                print(f"使用回车键失败: {e}")
-                        
-                        # 等待搜索结果加载
-                        print("等待搜索结果加载...")
+                if "缺货登记" not in element.text:
+                    available_tickets.append(element)
+            except Exception:
+                continue
+        candidates = [element.rect for element in (available_tickets or ticket_elements[:1])]
+        wanted = len(self.config.users)
+        plus_point = rect_center(plus_buttons[0].rect) if plus_buttons else None
+        log.info(f"抢票人数: {wanted}，需要点击加号 {wanted - 1} 次")
+        plus_sent = []
 
-                        # 检查当前Activity
-                        try:
-                            current_activity = self.driver.current_activity
-                            print(f"搜索后当前Activity: {current_activity}")
-                        except Exception as e:
-                            print(f"获取搜索后当前Activity失败: {e}")
-                    except Exception as e:
-                        print(f"输入搜索关键词失败: {e}")
-                else:
-                    print("未找到搜索框，尝试点击首页按钮...")
-                    # 尝试点击底部导航栏的任意按钮
-                    nav_btn_selectors = [
-                        (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().text("首页")'),
-                        (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().text("我的")'),
-                        (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().text("发现")'),
-                        (By.XPATH, '//android.widget.TextView[@text="首页"]'),
-                        (By.XPATH, '//android.widget.TextView[@text="我的"]'),
-                        (By.XPATH, '//android.widget.TextView[@text="发现"]')
-                    ]
-                    if self.smart_wait_and_click(*nav_btn_selectors[0], nav_btn_selectors[1:]):
-                        print("成功点击导航按钮")
-                        # 再次尝试点击搜索框
-                        if self.smart_wait_and_click(*search_box_selectors[0], search_box_selectors[1:]):
-                            print("成功点击搜索框")
-                            # 输入搜索关键词
-                            try:
-                                search_input = self.driver.find_element(AppiumBy.CLASS_NAME, "android.widget.EditText")
-                                search_input.send_keys(self.config.keyword)
-                
-                                # 点击搜索按钮
-                                search_btn_selectors = [
-                                    (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().text("搜索")'),
-                                    (By.XPATH, '//android.widget.TextView[@text="搜索"]')
-                                ]
-                                if self.smart_wait_and_click(*search_btn_selectors[0], search_btn_selectors[1:]):
-                                    print("成功点击搜索按钮")
-                                    # 选择第一个搜索结果
-                                    self.select_first_search_result()
-                                else:
-                                    # 尝试按回车键
-                                    search_input.send_keys("\n")
-                                    print("已按回车键搜索")
-                                    # 选择第一个搜索结果
-                                    self.select_first_search_result()
-                            except Exception as e:
-                                print(f"输入搜索关键词失败: {e}")
-                        else:
-                            print("无法找到搜索框")
-                    else:
-                        print("无法找到导航按钮")
-            except Exception as e:
-                print(f"导航到搜索界面时出错: {e}")
-                
-            # 城市选择功能已移除，只保留演员搜索
-            print("已跳过城市选择，只进行演员搜索...")
-            
-            # 确保点击搜索结果进入详情页
-            print("尝试点击搜索结果进入详情页...")
-            keyword = self.config.keyword
-            
-            # 搜索结果选择器 - 优先使用演员名称
-            result_selectors = [
-                # 演员名称特定选择器（最高优先级）
-                (AppiumBy.XPATH, f'//android.widget.TextView[contains(@text, "{keyword}")]/parent::*'),
-                (AppiumBy.ANDROID_UIAUTOMATOR, f'new UiSelector().textContains("{keyword}")'),
-                
-                # 第一个搜索结果选择器（通用）
-                (AppiumBy.XPATH, '//android.widget.LinearLayout[@resource-id="cn.damai:id/ll_search_item"][1]'),
-                (AppiumBy.XPATH, '//android.widget.TextView[@resource-id="cn.damai:id/item_title"][1]'),
-                (AppiumBy.XPATH, '//android.widget.ListView/android.widget.LinearLayout[1]'),
-                (AppiumBy.XPATH, '//android.widget.RecyclerView/android.widget.LinearLayout[1]'),
-                (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().className("android.widget.ListView").childSelector(new UiSelector().index(0))'),
-                (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().className("android.widget.RecyclerView").childSelector(new UiSelector().index(0))')
-            ]
-            
-            print(f"尝试点击包含'{keyword}'的第一个搜索结果...")
-            success = False
-            
-            # 使用选择器精确定位并模拟点击
-            for by, value in result_selectors:
-                if success:
-                    break
-                    
-                try:
-                    print(f"尝试使用选择器: ({by}, {value})")
-                    # 增加等待时间，确保元素完全加载
-                    element = WebDriverWait(self.driver, 5).until(
-                        EC.presence_of_element_located((by, value))
-                    )
-                    print(f"找到元素: {element.tag_name}, ID: {element.id}")
-                    
-                    # 获取元素位置和大小，用于模拟点击
-                    rect = element.rect
-                    center_x = rect['x'] + rect['width'] // 2
-                    center_y = rect['y'] + rect['height'] // 2
-                    
-                    print(f"元素中心点坐标: ({center_x}, {center_y})")
-                    
-                    # 尝试多种点击方式
-                    try:
-                        # 方式1: 使用driver.tap方法模拟点击
-                        self.driver.tap([(center_x, center_y)], 500)
-                        print(f"已使用tap方法模拟点击坐标 ({center_x}, {center_y})")
-                        success = True
-                    except Exception as touch_err:
-                        print(f"tap方法点击失败: {touch_err}，尝试其他方式")
-                        
-                        try:
-                            # 方式2: 直接点击元素
-                            element.click()
-                            print("已使用element.click()点击搜索结果")
-                            success = True
-                        except Exception as click_err:
-                            print(f"直接点击失败: {click_err}，尝试使用JS点击")
-                            
-                            # 方式3: 使用JS点击
-                            try:
-                                self.driver.execute_script('mobile: clickGesture', {'elementId': element.id})
-                                print("已使用JS点击搜索结果")
-                                success = True
-                            except Exception as js_err:
-                                print(f"JS点击也失败: {js_err}，尝试使用坐标点击")
-                                # 方式4: 使用坐标点击
-                                try:
-                                    x = rect['x'] + rect['width'] // 2
-                                    y = rect['y'] + rect['height'] // 2
-                                    self.driver.tap([(x, y)], 500)  # 增加点击时间
-                                    print(f"已使用坐标({x}, {y})点击第一个搜索结果")
-                                    success = True
-                                except Exception as tap_err:
-                                    print(f"坐标点击也失败: {tap_err}")
-                    
-                    
-                    if success:
-                        print("成功点击搜索结果，等待页面加载...")
-                        break
-                        
-                except Exception as e:
-                    print(f"使用选择器 ({by}, {value}) 查找元素失败: {e}")
-                    continue
-            
-            if not success:
-                print("所有选择器都无法找到搜索结果元素，请检查页面状态或选择器")
-                return False
-            
-            # 进入详情页后选择城市
-            print("已进入详情页，尝试选择城市...")
-            print(f"要选择的城市: {self.config.city}")
-                      
-            # 针对截图中的城市列表界面，直接尝试选择城市
-            city_selected = False
-            
-            # 1. 首先尝试直接点击城市名称
-            city_direct_selectors = [
-                # 精确匹配城市名
-                (AppiumBy.XPATH, f'//android.widget.TextView[@text="{self.config.city}"]'),
-                (AppiumBy.ANDROID_UIAUTOMATOR, f'new UiSelector().text("{self.config.city}")'),
-                
-                # 包含城市名
-                (AppiumBy.XPATH, f'//android.widget.TextView[contains(@text, "{self.config.city}")]'),
-                (AppiumBy.ANDROID_UIAUTOMATOR, f'new UiSelector().textContains("{self.config.city}")'),
-                
-                # 城市名所在的父元素
-                (AppiumBy.XPATH, f'//*[contains(@text, "{self.config.city}")]/parent::*'),
-                (AppiumBy.XPATH, f'//*[contains(@text, "{self.config.city}")]/..'),
-                
-                # 城市卡片选择器
-                (AppiumBy.XPATH, f'//android.view.View[contains(@content-desc, "{self.config.city}")]'),
-                (AppiumBy.ANDROID_UIAUTOMATOR, f'new UiSelector().descriptionContains("{self.config.city}")'),
-                
-                # 针对城市列表页面的特殊选择器
-                (AppiumBy.XPATH, f'//android.widget.FrameLayout[.//android.widget.TextView[contains(@text, "{self.config.city}")]]'),
-                (AppiumBy.XPATH, f'//android.view.ViewGroup[.//android.widget.TextView[contains(@text, "{self.config.city}")]]'),
-                
-                # 针对热卖中标签的选择器
-                (AppiumBy.XPATH, f'//android.widget.TextView[contains(@text, "{self.config.city}")]/following-sibling::android.widget.TextView[contains(@text, "热卖中")]/../..'),
-                (AppiumBy.XPATH, f'//android.widget.TextView[contains(@text, "{self.config.city}")]/parent::*/parent::*'),
-                
-                # 针对截图中的布局添加更精确的选择器
-                (AppiumBy.XPATH, f'//android.widget.TextView[@text="{self.config.city}"]/parent::android.view.ViewGroup'),
-                (AppiumBy.XPATH, f'//android.widget.TextView[@text="{self.config.city}"]/following-sibling::android.widget.TextView'),
-                (AppiumBy.XPATH, f'//android.widget.TextView[@text="{self.config.city}"]/../..'),
-                
-                # 针对日期和热卖中标签的组合选择器
-                (AppiumBy.XPATH, f'//android.widget.TextView[@text="{self.config.city}"]/following-sibling::*[1]')
-            ]
-            
-            print(f"尝试直接选择城市: {self.config.city}")
-            if self.smart_wait_and_click(*city_direct_selectors[0], city_direct_selectors[1:]):
-                print(f"成功直接选择城市: {self.config.city}")
-                city_selected = True
-            
-                
-            if city_selected:
-                print(f"已完成城市选择: {self.config.city}")
+        def tap_ticket(rect):
+            # 换候选时按最近一份快照中的数量计算还需点击加号的次数
+            clicks = 0
+            if plus_point is not None:
+                clicks = max(0, wanted - (self._ticket_quantity(self._snapshot) or 1))
+            self.tap_sequence([rect_center(rect)] + [plus_point] * clicks)
+            plus_sent.append(clicks)
+
+        # 票档列表不暴露选中状态时读回无法确认，不改点其他票档，以免悄悄换成别的票档
+        rect, snapshot = verified_tap(self, "tier", candidates, tap_ticket,
+                                      lambda r: node_selected(self, rect_bounds(r)), self.timeout("find"),
+                                      retry_if=lambda: self._tier_selection_exposed(candidates))
+        if rect is None:
+            log.warning("点击票档后未能确认选中，按当前页面继续")
+            snapshot = self.take_snapshot()
+        else:
+            log.info("已选择第一个可用票档" if available_tickets else "未找到可用票档，选择第一个票档")
+
+        self.mark_phase("quantity")
+        if plus_point is None and wanted > 1:
+            # 加号在选中票档后才出现：从读回的层级中取加号，不论能否读到数量都先按人数点击
+            plus_nodes = self.nodes_in("tier.plus_button", snapshot)
+            if plus_nodes:
+                plus_point = snapshot.center(plus_nodes[0])
+                clicks = max(0, wanted - (self._ticket_quantity(snapshot) or 1))
+                self.tap_sequence([plus_point] * clicks)
+                plus_sent.append(clicks)
+                snapshot = self.read_back(snapshot, lambda s: (self._ticket_quantity(s) or wanted) >= wanted)
             else:
-                print("城市选择可能失败，继续执行后续流程")
+                log.warning("选中票档后仍未找到加号按钮")
+        snapshot = self._ensure_quantity(snapshot, wanted, plus_point, plus_sent[-1] if plus_sent else 0)
 
-            wait_until(self.config.time)#时间需要在抢票开始前1分钟进行
-            # 点击立即预订按钮
-            print("尝试点击立即预订按钮...")
+        confirm_nodes = self.nodes_in("tier.confirm", snapshot)
+        if confirm_nodes:
+            LocalElement(self.driver, snapshot, confirm_nodes[0]).click()
+        else:
+            _, confirm_buttons = self.find_cascade("tier.confirm", timeout=self.timeout("find"))
+            if not confirm_buttons:
+                log.warning("未找到确定按钮")
+                return None
+            confirm_buttons[0].click()
+        self.invalidate_snapshot()
+        log.info("成功点击确定按钮")
 
+    def _tier_selection_exposed(self, rects):
+        """仍在票档页，且票档列表中有节点可勾选或已选中（即界面暴露了选中状态）"""
+        if self.classify_screen() != TIER:
+            return False
+        def marked(attrs):
+            return 'true' in (attrs.get('checkable'), attrs.get('selected'), attrs.get('checked'))
+
+        snapshot = self.take_snapshot()
+        return any(snapshot.subtree_any(rect_bounds(rect), marked) for rect in rects)
+
+    def _ticket_quantity(self, snapshot):
+        """快照中显示的购票数量，读不到时返回 None"""
+        if snapshot is None:
+            return None
+        nodes = self.nodes_in("tier.quantity", snapshot)
+        try:
+            return int(snapshot.attr(nodes[0], 'text'))
+        except (IndexError, TypeError, ValueError):
+            return None
+
+    def _ensure_quantity(self, snapshot, wanted, plus_point, sent):
+        """读回购票数量，不足时补点一次加号并再读回；返回最新的快照
+
+        sent 为随票档一起发出的加号点击次数，未生效的部分计为无效点击
+        """
+        def reached(snapshot):
+            count = self._ticket_quantity(snapshot)
+            return count is None or count >= wanted
+
+        quantity = self._ticket_quantity(snapshot)
+        if quantity is None:
+            log.debug("读不到购票数量，跳过数量确认")
+            return snapshot
+        if quantity < wanted and sent:
+            # 随票档发出的加号可能尚未反映到界面，等层级变化后再决定是否补点
+            snapshot = self.read_back(snapshot, reached)
+            quantity = self._ticket_quantity(snapshot) or quantity
+        missing = max(0, wanted - quantity)
+        self.tap_metrics.record("quantity", True, sent - min(missing, sent))
+        self.tap_metrics.record("quantity", False, min(missing, sent))
+        if not missing:
+            log.debug(f"已确认购票数量: {quantity}")
+            return snapshot
+        if plus_point is None:
+            plus_nodes = self.nodes_in("tier.plus_button", snapshot)
+            if not plus_nodes:
+                log.warning(f"购票数量为 {quantity}，未找到加号按钮")
+                return snapshot
+            plus_point = snapshot.center(plus_nodes[0])
+        log.warning(f"购票数量为 {quantity}，补点加号 {missing} 次")
+        self.tap_sequence([plus_point] * missing)
+        snapshot = self.read_back(snapshot, reached)
+        quantity = self._ticket_quantity(snapshot) or 0
+        self.tap_metrics.record("quantity", True, min(missing, max(0, quantity - (wanted - missing))))
+        self.tap_metrics.record("quantity", False, max(0, wanted - quantity))
+        if quantity < wanted:
+            log.warning(f"补点后购票数量仍为 {quantity}")
+        return snapshot
+
+    def _attendee_clicks(self):
+        return [(AppiumBy.XPATH, f'//android.widget.CheckBox[..//*[contains(@text, "{user}")]]')
+                for user in self.config.users]
+
+    def _on_attendee(self):
+        """独立的观演人选择页：勾选配置的观演人后确定"""
+        self.mark_phase("attendee")
+        if self.flow.repeats == 0:
+            self.ultra_batch_click(self._attendee_clicks())
+        self.click_cascade("tier.confirm")
+
+    def _on_order(self):
+        """确认订单页：勾选观演人并提交订单"""
+        self.mark_phase("attendee")
+        # 再次进入时观演人已勾选，再点会取消勾选
+        if self.flow.repeats == 0:
+            log.info("开始勾选观演人...")
+            self.ultra_batch_click(self._attendee_clicks())
+        self.mark_phase("submit")
+        if self.click_cascade("order.submit"):
+            return True
+        log.warning("未找到提交订单按钮")
+
+    def _on_done(self):
+        log.info("订单已提交")
+        return True
+
+    def _on_unknown(self):
+        """无法识别的页面：第一次等待加载，仍无法识别时返回上一页"""
+        if self.flow.repeats == 0:
+            log.warning("无法识别当前页面，等待页面加载...")
+            return None
+        log.warning("仍无法识别当前页面，尝试返回上一页")
+        self.driver.back()
+        self.invalidate_snapshot()
+
+    def _ensure_app(self):
+        """APP 不在前台时启动并等待其进入前台"""
+        try:
+            log.info("检查APP是否已启动...")
+            # 包名与页面层级并发获取，APP 已在前台时随后的页面识别直接使用这份层级
+            current_package = self.probe()
+            log.debug(f"当前包: {current_package}")
             
-            # 获取屏幕尺寸
-            screen_size = self.driver.get_window_size()
-            screen_width = screen_size['width']
-            screen_height = screen_size['height']
-            print(f"屏幕尺寸: {screen_width}x{screen_height}")
-            
-            # 定义多个可能的点击位置
-            click_positions = [
-                # 右下角位置 - 优先尝试
-                (int(screen_width * 0.9), int(screen_height * 0.95)),  # 最右下角
-                (int(screen_width * 0.85), int(screen_height * 0.95)), # 右下角稍左
-                (int(screen_width * 0.9), int(screen_height * 0.9)),   # 右下角稍上
-                (int(screen_width * 0.8), int(screen_height * 0.95)),  # 更左一点
-                
-                # 屏幕底部区域 - 备选尝试
-                (int(screen_width * 0.7), int(screen_height * 0.95)),
-                (int(screen_width * 0.6), int(screen_height * 0.95)),
-                
-                # 屏幕底部中间位置 - 最后尝试
-                (int(screen_width * 0.5), int(screen_height * 0.95)),
-                (int(screen_width * 0.5), int(screen_height * 0.9))
-            ]
-            
-            # 尝试多个位置点击
-            click_success = False
-            for i, (x, y) in enumerate(click_positions):
-                try:
-                    print(f"尝试点击位置 {i+1}/{len(click_positions)}: ({x}, {y})")
-                    
-                    # 使用tap方法模拟点击，增加点击持续时间
-                    self.driver.tap([(x, y)], 100)  # 增加到1000ms
-                    print(f"已模拟点击坐标: ({x}, {y})")
-                    
-                    
-                    # 检查是否点击成功 - 可以通过页面变化来判断
-                    # 这里简单等待，实际应该检查页面元素变化
-                    click_success = True
-                    print(f"位置 {i+1} 点击可能成功，继续流程")
-                    break
-                    
-                except Exception as e:
-                    print(f"位置 {i+1} 点击失败: {e}")
-                    continue
-            
-            
-            if click_success:
-                print("立即预订按钮点击操作完成")
-                print("开始选择日期...")
-                target_date = self.config.date
-                print(f"目标日期: {target_date}")
-                
-                # 检查是否已经在票档选择页面（跳过了日期选择）
-                try:
-                    ticket_elements = self.driver.find_elements(AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "票档")]')
-                    if ticket_elements and len(ticket_elements) > 0:
-                        print("已经在票档选择页面，无需选择日期")
-                        return True
-                except Exception:
-                    pass  # 忽略检查错误，继续尝试选择日期
-                
-
-                
-                # 尝试找到日期选择器 - 扩展选择器列表
-                date_selectors = [
-                    # 匹配截图中的日期格式 "YYYY-MM-DD 周X HH:MM"
-                    (AppiumBy.XPATH, f'//android.widget.TextView[starts-with(@text, "{target_date}")]'),
-                    
-                    # 匹配日期部分（不含时间和星期）
-                    (AppiumBy.XPATH, f'//android.widget.TextView[contains(@text, "{target_date}")]'),
-                    (AppiumBy.ANDROID_UIAUTOMATOR, f'new UiSelector().textContains("{target_date}")'),
-                    
-                    # 匹配月日部分（例如"11-01"或"11-02"）
-                    (AppiumBy.XPATH, f'//android.widget.TextView[contains(@text, "{"-".join(target_date.split("-")[1:]) if "-" in target_date and len(target_date.split("-")) > 2 else target_date}")]'),
-                    
-                    # 匹配场次选择界面中的日期元素
-                    (AppiumBy.XPATH, '//android.view.ViewGroup//android.widget.TextView[contains(@text, "周") and contains(@text, ":")]'),
-                    
-                    # 匹配常见日期元素
-                    (AppiumBy.XPATH, '//android.widget.TextView[contains(@resource-id, "dateItemText")]'),
-                    (AppiumBy.XPATH, '//android.widget.TextView[contains(@resource-id, "date")]'),
-                    
-                    # 匹配可选择的日期（通常是亮色显示的）
-                    (AppiumBy.XPATH, '//android.widget.TextView[@enabled="true" and contains(@resource-id, "date")]'),
-                    
-                    # 匹配日历视图中的日期
-                    (AppiumBy.XPATH, '//android.view.ViewGroup[contains(@resource-id, "calendar")]/android.widget.TextView')
-                ]
-                
-                date_found = False
-                # 如果找不到日期，尝试点击屏幕中间位置
-                if not date_found:
-                    print("未找到日期元素，尝试点击屏幕中间位置...")
-                    try:
-                        screen_size = self.driver.get_window_size()
-                        screen_width = screen_size['width']
-                        screen_height = screen_size['height']
-                        
-                        # 点击屏幕中间位置
-                        x = int(screen_width * 0.5)
-                        y = int(screen_height * 0.4)
-                        self.driver.tap([(x, y)], 500)
-                        print(f"已点击屏幕位置: ({x}, {y})")
-
-                        date_found = True
-                    except Exception as e:
-                        print(f"点击屏幕中间位置失败: {str(e)}")
-                
-                
-                # 选择票档
-                try:
-                    print("开始选择票档...")
-                    
-                    # 尝试找到票档列表
-                    ticket_selectors = [
-                        # 匹配截图中的价格元素格式（如"499元"、"699元"等）
-                        (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "元") and not(contains(@text, "缺货登记"))]/../..'),
-                        (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "元")]/../..'),
-                        
-                        # 匹配价格数字（如"499"、"699"等）
-                        (AppiumBy.XPATH, '//android.widget.TextView[matches(@text, "[0-9]+元") and not(contains(@text, "缺货登记"))]/../..'),
-                        (AppiumBy.XPATH, '//android.widget.TextView[matches(@text, "[0-9]+元")]/../..'),
-                        
-                        # 原有选择器
-                        (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "票档")]/../..'),
-                        (AppiumBy.XPATH, '//android.view.ViewGroup[contains(@resource-id, "item_container")]'),
-                        (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "¥")]/../..'),
-                        (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().textContains("¥")'),
-                        (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().textContains("票档")'),
-                        (AppiumBy.XPATH, '//android.widget.FrameLayout[contains(@resource-id, "item_container")]'),
-                        (AppiumBy.XPATH, '//android.widget.LinearLayout[contains(@resource-id, "item_container")]')
-                    ]
-                    
-                    ticket_found = False
-                    for selector_type, selector_value in ticket_selectors:
-                        try:
-                            print(f"尝试使用选择器: {selector_type} - {selector_value}")
-                            ticket_elements = self.driver.find_elements(selector_type, selector_value)
-                            
-                            if ticket_elements and len(ticket_elements) > 0:
-                                print(f"找到 {len(ticket_elements)} 个票档选项")
-                                
-                                # 过滤掉包含"缺货登记"的元素
-                                available_tickets = []
-                                for element in ticket_elements:
-                                    try:
-                                        element_text = element.text
-                                        print(f"票档元素文本: {element_text}")
-                                        if "缺货登记" not in element_text:
-                                            available_tickets.append(element)
-                                    except Exception:
-                                        continue
-                                
-                                # 如果有可用票档，选择第一个
-                                if available_tickets:
-                                    available_tickets[0].click()
-                                    print("已选择第一个可用票档")
-                                    ticket_found = True
-                                # 如果没有可用票档，选择第一个票档
-                                elif ticket_elements:
-                                    ticket_elements[0].click()
-                                    print("未找到可用票档，选择第一个票档")
-                                    ticket_found = True
-                                
-                                
-                                # 选择数量，根据配置中的抢票人数
-                                try:
-                                    print("开始选择数量...")
-                                    # 获取抢票人数
-                                    num_tickets = len(self.config.users)
-                                    print(f"抢票人数: {num_tickets}")
-                                    
-                                    # 如果人数为1，则不需要点击加号，直接进行下一步
-                                    if num_tickets == 1:
-                                        print("抢票人数为1，无需点击加号，直接进行下一步")
-                                        # 保存选择数量后的截图
-                                        
-                                        # 点击确定按钮
-                                        print("人数为1，直接点击确定按钮...")
-                                        confirm_selectors = [
-                                            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().textMatches(".*确定.*|.*购买.*")'),
-                                            (AppiumBy.XPATH, '//android.widget.Button[contains(@text, "确定")]'),
-                                            (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "确定")]'),
-                                            (By.ID, "btn_buy_view")
-                                        ]
-                                        
-                                        for selector_type, selector_value in confirm_selectors:
-                                            try:
-                                                if self.ultra_fast_click(selector_type, selector_value):
-                                                    print(f"成功点击确定按钮: {selector_type} - {selector_value}")
-                                                    # 设置标记，表示已完成选择数量和确认
-                                                    ticket_found = True
-                                                    break
-                                            except Exception as e:
-                                                print(f"点击确定按钮失败: {selector_type} - {selector_value} - {e}")
-                                                continue
-                                    else:
-                                        
-                                        # 直接使用固定坐标点击加号按钮
-                                        clicks_needed = num_tickets - 1
-                                        print(f"需要点击加号 {clicks_needed} 次")
-                                        
-                                        # 获取屏幕尺寸
-                                        window_size = self.driver.get_window_size()
-                                        width = window_size['width']
-                                        height = window_size['height']
-                                        
-                                        # 尝试先通过元素定位加号按钮
-                                        try:
-                                            # 尝试通过各种选择器定位加号按钮
-                                            plus_selectors = [
-                                                (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "+")]'),
-                                                (AppiumBy.XPATH, '//android.widget.Button[contains(@resource-id, "plus")]'),
-                                                (AppiumBy.XPATH, '//android.widget.ImageView[contains(@resource-id, "plus")]'),
-                                                (AppiumBy.XPATH, '//android.view.View[contains(@resource-id, "plus")]'),
-                                                (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "1")]/following-sibling::*'),
-                                                (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "1张")]/following-sibling::*')
-                                            ]
-                                            
-                                            plus_button = None
-                                            for selector_type, selector_value in plus_selectors:
-                                                try:
-                                                    elements = self.driver.find_elements(selector_type, selector_value)
-                                                    if elements and len(elements) > 0:
-                                                        plus_button = elements[0]
-                                                        print(f"找到加号按钮元素: {selector_type} - {selector_value}")
-                                                        break
-                                                except Exception:
-                                                    continue
-                                            
-                                            # 如果找到了加号按钮元素，直接点击
-                                            if plus_button:
-                                                for i in range(clicks_needed):
-                                                    plus_button.click()
-                                                    print(f"成功点击加号按钮元素，当前数量: {i + 2}")
-                                                    time.sleep(delay_time)
-                                                    
-                                                
-                                                # 点击确定按钮
-                                                print("数量选择完成，点击确定按钮...")
-                                                confirm_selectors = [
-                                                    (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().textMatches(".*确定.*|.*购买.*")'),
-                                                    (AppiumBy.XPATH, '//android.widget.Button[contains(@text, "确定")]'),
-                                                    (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "确定")]'),
-                                                    (By.ID, "btn_buy_view"),
-                                                    (AppiumBy.XPATH, '//android.view.View[contains(@text, "确定")]')
-                                                ]
-                                                
-                                                confirm_clicked = False
-                                                for selector_type, selector_value in confirm_selectors:
-                                                    try:
-                                                        confirm_elements = self.driver.find_elements(selector_type, selector_value)
-                                                        if confirm_elements and len(confirm_elements) > 0:
-                                                            confirm_elements[0].click()
-                                                            print(f"成功点击确定按钮: {selector_type} - {selector_value}")
-                                                            confirm_clicked = True
-                                                            
-                                                            # 等待观演人选择页面加载
-                                                            time.sleep(delay_time)
-                                                            print("开始勾选观演人...")
-                                                            
-                                                            try:
-                                                                # 检查是否在观演人选择页面
-                                                                page_source = self.driver.page_source
-                                                                if "观演人" in page_source or "选择收货人" in page_source or "选择购票人" in page_source:
-                                                                    print("已确认进入观演人选择页面")
-                                                                else:
-                                                                    print("警告：可能未进入观演人选择页面，尝试继续执行...")
-                                                                
-                                                                
-                                                                # 方法1：使用用户名称精确匹配
-                                                                user_clicks = []
-                                                                for user in self.config.users:
-                                                                    print(f"准备勾选观演人: {user}")
-                                                                    user_clicks.append((AppiumBy.XPATH, f'//android.widget.CheckBox[..//*[contains(@text, "{user}")]]'))
-
-                                                                # 尝试使用ultra_batch_click进行批量点击
-                                                                self.ultra_batch_click(user_clicks)
-                                                                
-                                                                
-                                                                
-                                                                # 尝试点击提交订单按钮
-                                                                submit_selectors = [
-                                                                    (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().text("立即提交")'),
-                                                                    (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().textMatches(".*提交.*|.*确认.*")'),
-                                                                    (By.XPATH, '//*[contains(@text,"提交")]')
-                                                                 ]
-                                                                self.smart_wait_and_click(*submit_selectors[0], submit_selectors[1:])
-                                                                
-                                                            except Exception as e:
-                                                                print(f"勾选观演人过程中出现错误: {str(e)}")
-
-
-                                                            if ticket_found:
-                                                                return True
-                                                            time.sleep(delay_time)
-                                                            break
-                                                    except Exception as e:
-                                                        print(f"点击确定按钮失败: {selector_type} - {selector_value} - {e}")
-                                                        continue
-                                                
-                                        except Exception as e:
-                                            print(f"通过元素定位加号按钮失败: {str(e)}")
-                                    
-                                        
-                                except Exception as e:
-                                    print(f"选择数量过程中出现错误: {str(e)}")
-                        except Exception as e:
-                            print(f"使用选择器 {selector_type} - {selector_value} 选择票档失败: {str(e)}")
-                            continue
-                    print("人数选择完成")
-                    
-                    
-                except Exception as e:
-                    print(f"选择票档过程中出现错误: {str(e)}")
+            # 如果APP未启动，尝试启动它
+            if current_package != "cn.damai":
+                log.info("大麦APP未启动，尝试启动...")
+                self.invalidate_snapshot()
+                self.driver.activate_app("cn.damai")
+                if self.wait_for(package_is(self.driver, "cn.damai"), self.timeout("launch"), "等待APP启动"):
+                    log.info("APP启动完成")
+                else:
+                    log.warning("等待APP启动超时")
+        except Exception as e:
+            log.warning(f"检查APP状态时出错: {e}")
 
-                
-                return True
-            else:
-                print("所有点击立即预订按钮的尝试均失败，请检查页面状态")
-                return False
+    @traced
+    def run_ticket_grabbing(self):
+        """执行抢票主流程：每一步识别当前页面并调用对应的处理函数，直到提交订单"""
+        try:
+            log.info("开始抢票流程...")
+            self.phase_marks = []
+            self._city_selected = False
 
+            self.mark_phase("launch")
+            # 检查APP是否已启动
+            with self.startup_stage("launch"):
+                self._ensure_app()
 
+            self.flow = ScreenFlow(self, self._screen_handlers())
+            success = self.flow.run()
+            log.info(f"页面路径: {' -> '.join(self.flow.history)}")
+            return success
         except Exception as e:
-            print(f"抢票过程发生错误: {e}")
+            log.error(f"抢票过程发生错误: {e}")
+            logger.dump_debug("抢票过程发生错误")
             return False
         finally:
-            time.sleep(delay_time)  # 给最后的操作一点时间
+            self.mark_phase("end")
+            logger.end_quiet()
+            # 提交订单的点击发出后，等页面离开确认订单页再断开会话
+            if self.flow is not None and self.flow.history[-1:] == [ORDER]:
+                self.wait_for(screen_changed(self, ORDER), self.timeout("transition"), "等待提交完成")
+            self.selector_stats.save()
+            self.classifier.save()
+            self.calibration.save()
+            self.bounds_cache.save()
+
+    def close(self):
+        """结束会话，写出计时数据"""
+        try:
+            self.driver_loop.stop()
             self.driver.quit()
+        except Exception as e:
+            log.warning(f"结束会话时出错: {e}")
+        finally:
+            transport.HISTOGRAM.log_summary()
+            self.bounds_cache.log_summary()
+            self.tap_metrics.log_summary()
+            if TRACER.enabled and self.config.trace_file:
+                TRACER.print_summary()
+                try:
+                    TRACER.write(self.config.trace_file)
+                    log.info(f"已写入计时数据: {self.config.trace_file}")
+                except Exception as e:
+                    log.warning(f"写入计时数据失败: {e}")
 
     def run_with_retry(self, max_retries=3):
-        """带重试机制的抢票"""
-            
-        for attempt in range(max_retries):
-            print(f"第 {attempt + 1} 次尝试...")
-            if self.run_ticket_grabbing():
-                print("抢票成功！")
-                return True
-            else:
-                print(f"第 {attempt + 1} 次尝试失败")
+        """带重试机制的抢票：失败后复用当前会话返回可继续的页面，会话失效时才重新创建"""
+        try:
+            for attempt in range(max_retries):
+                log.info(f"第 {attempt + 1} 次尝试...")
+                if self.run_ticket_grabbing():
+                    log.info("抢票成功！")
+                    return True
+                log.warning(f"第 {attempt + 1} 次尝试失败")
+                logger.dump_debug(f"第 {attempt + 1} 次尝试失败")
                 if attempt < max_retries - 1:
-                    print("2秒后重试...")
-                    time.sleep(delay_time)
-                    # 重新初始化驱动
-                    try:
-                        self.driver.quit()
-                    except:
-                        pass
-                    self._setup_driver()
+                    log.info("恢复会话后重试...")
+                    self.session.recover()
 
-        print("所有尝试均失败")
-        return False
+            log.error("所有尝试均失败")
+            return False
+        finally:
+            self.close()
 
 
-def wait_until(target_time: str, check_interval=0.01, advance_seconds=0):
+def wait_until(target_time: str, advance_seconds=0):
     """
-    等待直到目标时间（格式: HH:MM:SS），期间每隔 check_interval 检查一次
+    等待直到目标时间（"HH:MM:SS" 或完整时间戳），使用本机时区且不做时钟偏差补偿
     """
-    target = datetime.strptime(target_time, "%H:%M:%S").replace(
-        year=datetime.now().year,
-        month=datetime.now().month,
-        day=datetime.now().day
-    ) - timedelta(seconds=advance_seconds)
-    print(f"等待到 {target} ...")
-
-    while True:
-        now = datetime.now()
-        print(f"当前时间: {now}")
-        if now >= target:
-            print("时间已到，开始执行点击操作！")
-            break
-        time.sleep(check_interval)
+    return Scheduler().wait(target_time, advance_seconds)
 
 
 # 使用示例
 if __name__ == "__main__":
     config = Config.load_config()
-    wait_until(config.time, advance_seconds=20)
-    bot = DamaiBot()
+    scheduler = Scheduler.from_config(config)
+    # 启动即建立会话并导航到详情页，在详情页等待开抢，启动耗时不落在开售后的关键路径上
+    bot = DamaiBot(config=config, scheduler=scheduler)
     bot.run_with_retry(max_retries=3)
+    logger.flush()
@@ -0,0 +1,288 @@
+# -*- coding: UTF-8 -*-
+"""
+直连 UiAutomator2 服务器：热点命令（查找元素、点击、页面层级、点击手势、W3C actions）不经 Appium 服务器转发，
+直接发往设备上 UiAutomator2 服务器经 adb 转发到本机的端口（Appium 能力 systemPort，默认 8200）。
+会话仍由 Appium 创建和管理，其余命令照常经 Appium；直连请求出错时回退到 Appium。
+
+直接运行本文件用本地替身服务器对比两条路径的每条命令耗时
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import urllib3
+from selenium.common.exceptions import NoSuchElementException, WebDriverException
+from selenium.webdriver.remote.command import Command
+
+from async_driver import MAX_CONCURRENT_QUERIES
+from logger import log
+from transport import HISTOGRAM, SOCKET_OPTIONS, TunedConnection, start_stub_server
+
+
+DEFAULT_PORT = 8200
+ELEMENT_KEY = "element-6066-11e4-a52e-4f735466cecf"
+# 长按以上的时长交给 Appium 的 tap 实现
+LONG_PRESS_MS = 500
+
+
+class DirectResponseError(WebDriverException):
+    """直连的响应不是 WebDriver 的 JSON（如代理返回的错误页、服务器重启中），按连接失败回退到 Appium"""
+
+
+# 直连请求出现这些错误时回退到 Appium
+FALLBACK_ERRORS = (urllib3.exceptions.HTTPError, OSError, DirectResponseError)
+
+
+def _response_value(response):
+    """响应中的 value；响应体无法按 JSON 解析时抛出 DirectResponseError"""
+    if not response.data:
+        return None
+    try:
+        body = json.loads(response.data.decode('utf-8'))
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        raise DirectResponseError(f"HTTP {response.status}，响应不是 WebDriver JSON: {response.data[:80]!r}")
+    return body.get('value')
+
+
+def uia2_url(host="127.0.0.1", port=DEFAULT_PORT):
+    return f"http://{host}:{port}/wd/hub"
+
+
+class DirectElement:
+    """UiAutomator2 服务器上的元素，元素 ID 与 Appium 返回的一致"""
+
+    def __init__(self, direct, element_id):
+        self._direct = direct
+        self.id = element_id
+
+    def _element(self, method, suffix="", payload=None, name=None):
+        return self._direct.request(method, f"/element/{self.id}{suffix}", payload, name)
+
+    @property
+    def rect(self):
+        rect = self._element("GET", "/rect", name="element_rect")
+        return {k: rect[k] for k in ('x', 'y', 'width', 'height')}
+
+    @property
+    def location(self):
+        rect = self.rect
+        return {'x': rect['x'], 'y': rect['y']}
+
+    @property
+    def size(self):
+        rect = self.rect
+        return {'width': rect['width'], 'height': rect['height']}
+
+    @property
+    def text(self):
+        return self._element("GET", "/text", name="element_text")
+
+    def get_attribute(self, name):
+        return self._element("GET", f"/attribute/{name}", name="element_attribute")
+
+    def click(self):
+        self._element("POST", "/click", {}, name="element_click")
+
+    def __getattr__(self, name):
+        # 其余元素操作经 Appium
+        return getattr(self._direct.wrapped_driver.create_web_element(self.id), name)
+
+
+class DirectDriver:
+    """包装 Appium 驱动，热点命令直连 UiAutomator2 服务器
+
+    参数:
+        driver: 已建立会话的 Appium 驱动
+        base_url: UiAutomator2 服务器地址，如 "http://127.0.0.1:8200/wd/hub"
+        timeout: 单个请求的超时（秒）
+        histogram: 记录每条命令耗时的直方图
+    """
+
+    def __init__(self, driver, base_url, timeout=30, histogram=HISTOGRAM):
+        self._driver = driver
+        self.base_url = base_url.rstrip('/')
+        self.histogram = histogram
+        self._http = urllib3.PoolManager(maxsize=MAX_CONCURRENT_QUERIES, block=False, retries=False, timeout=timeout,
+                                         socket_options=SOCKET_OPTIONS)
+        self.uia2_session = self._discover_session()
+        self.fallbacks = 0
+
+    @property
+    def wrapped_driver(self):
+        return self._driver
+
+    def __getattr__(self, name):
+        return getattr(self._driver, name)
+
+    def _discover_session(self):
+        """UiAutomator2 服务器同时只有一个会话，取其 ID"""
+        response = self._http.request("GET", f"{self.base_url}/sessions")
+        sessions = _response_value(response) or []
+        if not sessions:
+            raise WebDriverException(f"UiAutomator2 服务器 {self.base_url} 上没有会话")
+        return sessions[0]['id']
+
+    def request(self, method, suffix, payload=None, name=None):
+        """发送一条命令，返回 value；找不到元素时抛出 NoSuchElementException"""
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        start = time.perf_counter()
+        try:
+            response = self._http.request(method, f"{self.base_url}/session/{self.uia2_session}{suffix}",
+                                          body=body, headers={"Content-Type": "application/json"})
+        finally:
+            if self.histogram is not None:
+                self.histogram.record(f"direct:{name or suffix}", time.perf_counter() - start)
+        # 先按状态码区分，错误响应的响应体也可能不是 JSON
+        value = _response_value(response)
+        if response.status >= 400 or (isinstance(value, dict) and 'error' in value):
+            value = value if isinstance(value, dict) else {}
+            if value.get('error') == 'no such element':
+                raise NoSuchElementException(value.get('message', ''))
+            raise WebDriverException(f"{value.get('error', response.status)}: {value.get('message', '')}")
+        return value
+
+    def _fallback(self, error):
+        self.fallbacks += 1
+        if self.fallbacks == 1:
+            log.warning(f"直连 UiAutomator2 失败，回退到 Appium: {error}")
+
+    @property
+    def page_source(self):
+        try:
+            return self.request("GET", "/source", name="page_source")
+        except FALLBACK_ERRORS as e:
+            self._fallback(e)
+            return self._driver.page_source
+
+    def find_element(self, by, value):
+        try:
+            found = self.request("POST", "/element", {"strategy": by, "using": by, "selector": value,
+                                                      "value": value}, name="find_element")
+        except FALLBACK_ERRORS as e:
+            self._fallback(e)
+            return self._driver.find_element(by, value)
+        return DirectElement(self, found.get(ELEMENT_KEY) or found.get('ELEMENT'))
+
+    def find_elements(self, by, value):
+        try:
+            found = self.request("POST", "/elements", {"strategy": by, "using": by, "selector": value,
+                                                       "value": value}, name="find_elements")
+        except NoSuchElementException:
+            return []
+        except FALLBACK_ERRORS as e:
+            self._fallback(e)
+            return self._driver.find_elements(by, value)
+        return [DirectElement(self, item.get(ELEMENT_KEY) or item.get('ELEMENT')) for item in found or []]
+
+    def _click_gesture(self, params):
+        payload = {}
+        if 'elementId' in params:
+            payload['origin'] = {ELEMENT_KEY: params['elementId'], 'ELEMENT': params['elementId']}
+        if 'x' in params:
+            payload['offset'] = {'x': params['x'], 'y': params['y']}
+        self.request("POST", "/appium/gestures/click", payload, name="click_gesture")
+
+    def tap(self, positions, duration=None):
+        if duration and duration >= LONG_PRESS_MS:
+            return self._driver.tap(positions, duration)
+        try:
+            for x, y in positions:
+                self._click_gesture({'x': x, 'y': y})
+        except FALLBACK_ERRORS as e:
+            self._fallback(e)
+            return self._driver.tap(positions, duration)
+        return self
+
+    def execute(self, command, params=None):
+        if command == Command.W3C_ACTIONS:
+            try:
+                self.request("POST", "/actions", params, name="actions")
+                return {"value": None}
+            except FALLBACK_ERRORS as e:
+                self._fallback(e)
+        return self._driver.execute(command, params)
+
+    def execute_script(self, script, *args):
+        if script == 'mobile: clickGesture' and args:
+            try:
+                return self._click_gesture(args[0])
+            except FALLBACK_ERRORS as e:
+                self._fallback(e)
+        return self._driver.execute_script(script, *args)
+
+
+# ---- 替身服务器与基准 ----
+
+def start_appium_standin(uia2_base, hop_latency=0.0):
+    """模拟 Appium 服务器的替身：每条命令加上转发开销后转发给 UiAutomator2 替身，返回 (server, url)"""
+    upstream = urllib3.PoolManager(maxsize=8, retries=False)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _forward(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            body = self.rfile.read(length) if length else None
+            if hop_latency:
+                time.sleep(hop_latency)
+            response = upstream.request(self.command, uia2_base + self.path, body=body)
+            self.wfile.write(b"HTTP/1.1 " + str(response.status).encode('ascii') + b" OK\r\n"
+                             b"Content-Type: application/json; charset=utf-8\r\n"
+                             b"Content-Length: " + str(len(response.data)).encode('ascii') + b"\r\n\r\n"
+                             + response.data)
+
+        do_GET = _forward
+        do_POST = _forward
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="AppiumStandin", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def _mean(samples):
+    return round(sum(samples) / len(samples), 3)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="直连 UiAutomator2 与经 Appium 转发的每条命令耗时对比（本地替身服务器）")
+    parser.add_argument("--requests", type=int, default=300, help="每条路径发送的命令数")
+    parser.add_argument("--device-ms", type=float, default=5, help="UiAutomator2 替身的应答延迟（毫秒）")
+    parser.add_argument("--hop-ms", type=float, default=3, help="Appium 替身每条命令的转发开销（毫秒）")
+    args = parser.parse_args()
+
+    import logger
+    uia2_server, uia2_root = start_stub_server(args.device_ms / 1000)
+    appium_server, appium_url = start_appium_standin(uia2_root, args.hop_ms / 1000)
+    via_appium = TunedConnection(appium_url, histogram=None)
+
+    class _Direct(DirectDriver):
+        def _discover_session(self):
+            return "stub"
+
+    direct = _Direct(None, uia2_root, histogram=None)
+
+    results = {}
+    for name, send in [("经 Appium", lambda: via_appium.execute("getPageSource", {"sessionId": "stub"})),
+                       ("直连 UiAutomator2", lambda: direct.request("GET", "/source"))]:
+        for _ in range(10):
+            send()
+        samples = []
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            send()
+            samples.append((time.perf_counter() - start) * 1000)
+        results[name] = _mean(samples)
+        print(f"{name}: 平均 {results[name]} ms")
+    print(f"直连每条命令节省 {results['经 Appium'] - results['直连 UiAutomator2']:.3f} ms")
+    appium_server.shutdown()
+    uia2_server.shutdown()
+    logger.flush()
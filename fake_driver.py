@@ -0,0 +1,330 @@
+# -*- coding: UTF-8 -*-
+"""
+离线替身驱动：回放录制的页面层级 XML，实现 DamaiBot 用到的驱动子集，
+按可配置的单命令延迟模拟设备往返，无需手机和 Appium 服务器即可计时整个抢票流程
+"""
+
+import argparse
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+from collections import Counter
+from datetime import datetime
+
+from selenium.common.exceptions import InvalidSelectorException, NoSuchElementException, WebDriverException
+from selenium.webdriver.remote.command import Command
+
+import logger
+from config import Config
+from gestures import action_taps
+from node_store import ElementStore
+from ui_snapshot import LocatorUnsupported, Snapshot
+
+
+REPLAY_DIR = os.path.join(os.path.dirname(__file__), 'replay')
+
+
+def load_scenario(scenario_dir=REPLAY_DIR):
+    with open(os.path.join(scenario_dir, 'scenario.json'), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class FakeElement:
+    """回放页面中的一个节点，属性读取与操作都按一次设备往返计"""
+
+    def __init__(self, driver, screen, node):
+        self._driver = driver
+        self._screen = screen
+        self._node = node
+        self.id = f"{screen}-{driver._snapshots[screen].order(node)}"
+
+    def _bounds(self):
+        return self._driver._snapshots[self._screen].bounds(self._node) or (0, 0, 0, 0)
+
+    def _center(self):
+        x1, y1, x2, y2 = self._bounds()
+        return (x1 + x2) // 2, (y1 + y2) // 2
+
+    @property
+    def text(self):
+        self._driver._command('element_text')
+        return self._node.get('text') or ""
+
+    @property
+    def tag_name(self):
+        self._driver._command('element_tag_name')
+        return self._node.get('class') or self._node.tag
+
+    @property
+    def rect(self):
+        self._driver._command('element_rect')
+        x1, y1, x2, y2 = self._bounds()
+        return {'x': x1, 'y': y1, 'width': x2 - x1, 'height': y2 - y1}
+
+    @property
+    def location(self):
+        self._driver._command('element_location')
+        x1, y1, _, _ = self._bounds()
+        return {'x': x1, 'y': y1}
+
+    @property
+    def size(self):
+        self._driver._command('element_size')
+        x1, y1, x2, y2 = self._bounds()
+        return {'width': x2 - x1, 'height': y2 - y1}
+
+    def get_attribute(self, name):
+        self._driver._command('element_attribute')
+        return self._node.get(name)
+
+    def click(self):
+        self._driver._command('element_click')
+        self._driver._tap_point(*self._center())
+
+    def clear(self):
+        self._driver._command('element_clear')
+        self._node.set('text', "")
+        self._driver._touch(self._screen)
+
+    def send_keys(self, *keys):
+        self._driver._command('element_send_keys')
+        text = "".join(str(k) for k in keys).replace("\n", "")
+        self._node.set('text', (self._node.get('text') or "") + text)
+        self._driver._touch(self._screen)
+        # 输入框输入后跳转（如搜索联想/结果页）
+        target = self._driver._screens[self._screen].get('on_input')
+        if target and self._driver.current == self._screen:
+            self._driver._goto(target)
+
+
+class FakeDriver:
+    """实现 DamaiBot 所用驱动子集的离线替身
+
+    参数:
+        scenario_dir: 录制目录，包含 scenario.json 与各页面的层级 XML
+        latency: 每条命令的模拟往返延迟（秒）
+        command_latency: 按命令名覆盖延迟，如 {"page_source": 0.08}
+    """
+
+    def __init__(self, scenario_dir=REPLAY_DIR, latency=0.0, command_latency=None):
+        self.scenario = load_scenario(scenario_dir)
+        self.latency = latency
+        self.command_latency = command_latency or {}
+        self.session_id = "replay-session"
+        self._screens = self.scenario['screens']
+        self._snapshots = {}
+        for name, screen in self._screens.items():
+            with open(os.path.join(scenario_dir, screen['source']), 'r', encoding='utf-8') as f:
+                # 回放时按点击修改节点属性，使用可修改的 ElementTree 存储
+                self._snapshots[name] = Snapshot(f.read(), store=ElementStore)
+        self.current = self.scenario['start']
+        self.package = self.scenario.get('package', 'cn.damai')
+        self.settings = {}
+        self.commands = []
+        self.history = [self.current]
+        self.quit_called = False
+
+    # ---- 计时与状态 ----
+    def _command(self, name):
+        """模拟一次设备往返"""
+        delay = self.command_latency.get(name, self.latency)
+        if delay > 0:
+            time.sleep(delay)
+        self.commands.append((name, time.perf_counter()))
+
+    def command_counts(self):
+        return Counter(name for name, _ in self.commands)
+
+    def _goto(self, screen):
+        self.current = screen
+        self.history.append(screen)
+
+    def _touch(self, screen):
+        """节点属性被修改后刷新页面源码"""
+        snapshot = self._snapshots[screen]
+        snapshot.source = ET.tostring(snapshot.root, encoding='unicode')
+
+    def _tap_point(self, x, y):
+        """按坐标命中当前页面的可交互节点，执行跳转或状态变化"""
+        screen = self.current
+        snapshot = self._snapshots[screen]
+        for transition in self._screens[screen].get('transitions', []):
+            hits = [n for n in snapshot.find('xpath', transition['tap'])
+                    if _inside(snapshot.bounds(n), x, y)]
+            if not hits:
+                continue
+            if 'toggle' in transition:
+                attr = transition['toggle']
+                hits[0].set(attr, 'false' if hits[0].get(attr) == 'true' else 'true')
+                self._touch(screen)
+            if 'increment' in transition:
+                for node in snapshot.find('xpath', transition['increment']):
+                    node.set('text', str(int(node.get('text') or 0) + 1))
+                self._touch(screen)
+            if 'to' in transition:
+                self._goto(transition['to'])
+            return True
+        return False
+
+    # ---- 驱动接口 ----
+    def find_elements(self, by, value):
+        self._command('find_elements')
+        try:
+            nodes = self._snapshots[self.current].find(by, value)
+        except LocatorUnsupported as e:
+            raise InvalidSelectorException(str(e))
+        return [FakeElement(self, self.current, node) for node in nodes]
+
+    def find_element(self, by, value):
+        self._command('find_element')
+        try:
+            nodes = self._snapshots[self.current].find(by, value)
+        except LocatorUnsupported as e:
+            raise InvalidSelectorException(str(e))
+        if not nodes:
+            raise NoSuchElementException(f"{by}={value}")
+        return FakeElement(self, self.current, nodes[0])
+
+    @property
+    def page_source(self):
+        self._command('page_source')
+        snapshot = self._snapshots[self.current]
+        depth = self.settings.get('snapshotMaxDepth')
+        if depth:
+            return _truncated_source(snapshot.root, depth)
+        return snapshot.source
+
+    @property
+    def current_activity(self):
+        self._command('current_activity')
+        return self._screens[self.current].get('activity', "")
+
+    @property
+    def current_package(self):
+        self._command('current_package')
+        return self.package
+
+    def get_window_size(self):
+        self._command('get_window_size')
+        return dict(self.scenario['window_size'])
+
+    def tap(self, positions, duration=None):
+        self._command('tap')
+        for x, y in positions:
+            self._tap_point(x, y)
+
+    def execute_script(self, script, *args):
+        self._command('execute_script')
+        params = args[0] if args else {}
+        if script != 'mobile: clickGesture':
+            raise WebDriverException(f"回放驱动不支持的脚本: {script}")
+        if 'elementId' in params:
+            screen, _, order = params['elementId'].rpartition('-')
+            snapshot = self._snapshots[screen]
+            node = next(n for n in snapshot.root.iter() if snapshot.order(n) == int(order))
+            x, y = snapshot.center(node)
+        else:
+            x, y = params['x'], params['y']
+        self._tap_point(x, y)
+
+    def execute(self, command, params=None):
+        """只支持 W3C actions：一次命令依次执行其中的各次点击"""
+        if command != Command.W3C_ACTIONS:
+            raise WebDriverException(f"回放驱动不支持的命令: {command}")
+        self._command('actions')
+        for x, y in action_taps(params['actions']):
+            self._tap_point(x, y)
+        return {"value": None}
+
+    def activate_app(self, app_id):
+        self._command('activate_app')
+
+    def back(self):
+        self._command('back')
+        target = self._screens[self.current].get('back')
+        if target:
+            self._goto(target)
+
+    def update_settings(self, settings):
+        self._command('update_settings')
+        self.settings.update(settings)
+
+    def quit(self):
+        self._command('quit')
+        self.quit_called = True
+
+
+def _inside(bounds, x, y):
+    return bounds is not None and bounds[0] <= x < bounds[2] and bounds[1] <= y < bounds[3]
+
+
+def _truncated_source(root, depth):
+    """按 UiAutomator2 的 snapshotMaxDepth 截断层级：只保留前 depth 层节点"""
+    def copy(node, level):
+        clone = ET.Element(node.tag, node.attrib)
+        clone.text, clone.tail = node.text, node.tail
+        if level < depth:
+            clone.extend(copy(child, level + 1) for child in node)
+        return clone
+    return ET.tostring(copy(root, 1), encoding='unicode')
+
+
+def replay_config(scenario_dir=REPLAY_DIR, **overrides):
+    """录制场景对应的配置，开抢时间设为当前时刻，使流程不再等待"""
+    config = dict(load_scenario(scenario_dir)['config'])
+    config['time'] = datetime.now().strftime("%H:%M:%S")
+    config.update(overrides)
+    return Config.from_dict(config)
+
+
+def run_replay(latency=0.0, scenario_dir=REPLAY_DIR, strategy="ranked", bounds_cache=None, **config_overrides):
+    """用回放驱动完整执行一次 run_ticket_grabbing，返回 (是否成功, 耗时秒, DamaiBot)
+
+    strategy 为选择器级联策略，"sequential" 复现逐个 WebDriverWait 的原始行为；
+    bounds_cache 为坐标缓存，默认每次回放使用空的内存缓存
+    """
+    from bounds_cache import BoundsCache
+    from calibration import Calibration
+    from damai_app import DamaiBot
+    from screen_classifier import ScreenClassifier
+    from selector_cascade import CascadeStats, compile_cascades
+
+    driver = FakeDriver(scenario_dir, latency=latency)
+    bot = DamaiBot(config=replay_config(scenario_dir, **config_overrides),
+                   driver_factory=lambda: driver,
+                   selector_stats=CascadeStats(path=None),
+                   classifier=ScreenClassifier(path=None),
+                   calibration=Calibration(path=None),
+                   bounds_cache=bounds_cache or BoundsCache(path=None))
+    if strategy != "ranked":
+        bot.cascades = compile_cascades(bot.config, bot.selector_stats, strategy)
+    start = time.perf_counter()
+    success = bot.run_ticket_grabbing()
+    bot.close()
+    return success, time.perf_counter() - start, bot
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="离线回放抢票流程并计时")
+    parser.add_argument("--latency-ms", type=float, default=30, help="每条命令的模拟往返延迟（毫秒）")
+    parser.add_argument("--scenario", default=REPLAY_DIR, help="录制目录")
+    parser.add_argument("--no-snapshot", action="store_true", help="关闭快照模式")
+    parser.add_argument("--strategy", choices=["ranked", "sequential"], default="ranked", help="选择器级联策略")
+    parser.add_argument("--trace", help="计时输出文件（.json 为 Chrome Trace，.jsonl 为 JSON Lines）")
+    parser.add_argument("--warm-cache", action="store_true", help="先回放一次填充坐标缓存，计时第二次回放")
+    args = parser.parse_args()
+
+    from bounds_cache import BoundsCache
+    cache = BoundsCache(path=None)
+    if args.warm_cache:
+        run_replay(args.latency_ms / 1000, args.scenario, args.strategy, cache,
+                   snapshot_mode=not args.no_snapshot)
+    success, elapsed, bot = run_replay(args.latency_ms / 1000, args.scenario, args.strategy, cache,
+                                       snapshot_mode=not args.no_snapshot, trace_file=args.trace)
+    logger.flush()
+    driver = getattr(bot.driver, 'wrapped_driver', bot.driver)
+    print(f"\n回放结果: {'成功' if success else '失败'}，耗时 {elapsed * 1000:.1f} ms，"
+          f"设备命令 {len(driver.commands)} 次，页面路径: {' -> '.join(driver.history)}")
+    for name, count in driver.command_counts().most_common():
+        print(f"  {name}: {count}")
@@ -0,0 +1,47 @@
+# -*- coding: UTF-8 -*-
+"""
+批量手势：同一页面上的一串点击编成一个 W3C actions 请求，一次往返执行完，
+点击之间的间隔在设备端按 pause 执行，不占用网络往返
+"""
+
+from selenium.webdriver.remote.command import Command
+
+
+# 每次按下的时长与两次点击之间的间隔（毫秒）
+TAP_HOLD_MS = 30
+TAP_GAP_MS = 50
+
+
+def tap_actions(points, hold_ms=TAP_HOLD_MS, gap_ms=TAP_GAP_MS):
+    """一串点击对应的 W3C actions 参数"""
+    steps = []
+    for i, (x, y) in enumerate(points):
+        if i:
+            steps.append({"type": "pause", "duration": gap_ms})
+        steps.extend([
+            {"type": "pointerMove", "duration": 0, "origin": "viewport", "x": int(x), "y": int(y)},
+            {"type": "pointerDown", "button": 0},
+            {"type": "pause", "duration": hold_ms},
+            {"type": "pointerUp", "button": 0},
+        ])
+    return [{"type": "pointer", "id": "finger1", "parameters": {"pointerType": "touch"}, "actions": steps}]
+
+
+def perform_taps(driver, points, hold_ms=TAP_HOLD_MS, gap_ms=TAP_GAP_MS):
+    """一次请求依次点击 points 中的各坐标"""
+    if not points:
+        return
+    driver.execute(Command.W3C_ACTIONS, {"actions": tap_actions(points, hold_ms, gap_ms)})
+
+
+def action_taps(actions):
+    """从 W3C actions 参数中还原各次按下的坐标（供回放驱动使用）"""
+    points = []
+    for source in actions:
+        x = y = None
+        for step in source.get("actions", []):
+            if step["type"] == "pointerMove":
+                x, y = step["x"], step["y"]
+            elif step["type"] == "pointerDown" and x is not None:
+                points.append((x, y))
+    return points
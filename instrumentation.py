@@ -0,0 +1,213 @@
+# -*- coding: UTF-8 -*-
+"""
+热路径计时：按阶段、方法、选择器尝试和每条驱动命令记录时间段（span），
+统计设备往返次数，区分 WebDriverWait 轮询与真正的点击耗时，
+输出为 JSON Lines 或 Chrome Trace（chrome://tracing / Perfetto 可直接打开）
+"""
+
+import functools
+import json
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from logger import log
+
+
+# 访问即触发一次设备往返的驱动属性
+REMOTE_DRIVER_PROPERTIES = {'page_source', 'current_activity', 'current_package',
+                            'current_context', 'contexts', 'orientation'}
+REMOTE_ELEMENT_PROPERTIES = {'text', 'rect', 'location', 'size', 'tag_name'}
+CLICK_COMMANDS = {'tap', 'click'}
+
+
+class Tracer:
+    """收集 span 与计数；未启用时 span() 只是一个空的上下文"""
+
+    def __init__(self):
+        self.enabled = False
+        self.origin = time.perf_counter()
+        self.events = []
+        self.counters = Counter()
+        self._phase = None
+
+    def enable(self):
+        self.enabled = True
+        self.origin = time.perf_counter()
+        self.events = []
+        self.counters = Counter()
+        self._phase = None
+
+    def disable(self):
+        self.enabled = False
+
+    def _record(self, name, cat, start, end, args):
+        self.events.append({
+            "name": name,
+            "cat": cat,
+            "start": start - self.origin,
+            "dur": end - start,
+            "args": args,
+        })
+
+    @contextmanager
+    def span(self, name, cat, **args):
+        """记录一段耗时；yield 出的 args 字典可在块内补充结果字段"""
+        if not self.enabled:
+            yield args
+            return
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            self._record(name, cat, start, time.perf_counter(), args)
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] += value
+
+    def begin_phase(self, name):
+        """结束上一阶段并开始新阶段"""
+        if not self.enabled:
+            return
+        self.end_phase()
+        self._phase = (name, time.perf_counter())
+
+    def end_phase(self):
+        if self.enabled and self._phase is not None:
+            name, start = self._phase
+            self._record(name, "phase", start, time.perf_counter(), {})
+            self._phase = None
+
+    def summary(self):
+        """按类别汇总耗时，按阶段汇总耗时与设备往返次数"""
+        by_cat = defaultdict(lambda: [0, 0.0])
+        for event in self.events:
+            by_cat[event["cat"]][0] += 1
+            by_cat[event["cat"]][1] += event["dur"]
+        remote = [e for e in self.events if e["cat"] in ("driver", "click")]
+        phases = []
+        for event in self.events:
+            if event["cat"] != "phase":
+                continue
+            end = event["start"] + event["dur"]
+            calls = sum(1 for e in remote if event["start"] <= e["start"] < end)
+            phases.append((event["name"], event["dur"] * 1000, calls))
+        return {
+            "categories": {cat: {"count": n, "ms": round(total * 1000, 1)} for cat, (n, total) in by_cat.items()},
+            "phases": phases,
+            "remote_calls": dict(self.counters),
+        }
+
+    def print_summary(self):
+        summary = self.summary()
+        log.info("===== 计时汇总 =====")
+        for name, ms, calls in summary["phases"]:
+            log.info(f"阶段 {name}: {ms:.1f} ms，设备往返 {calls} 次")
+        for cat, data in summary["categories"].items():
+            log.info(f"类别 {cat}: {data['count']} 次，共 {data['ms']} ms")
+        log.info(f"设备命令: {summary['remote_calls']}")
+
+    def write(self, path):
+        """.jsonl 输出 JSON Lines，其余输出 Chrome Trace"""
+        if path.endswith('.jsonl'):
+            with open(path, 'w', encoding='utf-8') as f:
+                for event in self.events:
+                    f.write(json.dumps({
+                        "name": event["name"],
+                        "cat": event["cat"],
+                        "start_ms": round(event["start"] * 1000, 3),
+                        "dur_ms": round(event["dur"] * 1000, 3),
+                        "args": event["args"],
+                    }, ensure_ascii=False, default=str) + "\n")
+            return
+        trace_events = [{
+            "name": event["name"],
+            "cat": event["cat"],
+            "ph": "X",
+            "ts": round(event["start"] * 1e6, 1),
+            "dur": round(event["dur"] * 1e6, 1),
+            "pid": 1,
+            "tid": 1,
+            "args": event["args"],
+        } for event in sorted(self.events, key=lambda e: (e["start"], -e["dur"]))]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f, ensure_ascii=False, default=str)
+
+
+TRACER = Tracer()
+
+
+def traced(func):
+    """记录方法调用耗时（类别 method）"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not TRACER.enabled:
+            return func(*args, **kwargs)
+        with TRACER.span(func.__name__, "method"):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _is_element(value):
+    return hasattr(value, 'id') and hasattr(value, 'click') and not isinstance(value, type)
+
+
+def _wrap_result(value, tracer):
+    if _is_element(value):
+        return InstrumentedElement(value, tracer)
+    if isinstance(value, list) and value and all(_is_element(v) for v in value):
+        return [InstrumentedElement(v, tracer) for v in value]
+    return value
+
+
+def _command_category(name, args):
+    if name in CLICK_COMMANDS:
+        return "click"
+    if name == 'execute_script' and args and 'click' in str(args[0]).lower():
+        return "click"
+    return "driver"
+
+
+class _Instrumented:
+    """驱动/元素代理：每次远程调用记录一个 span 并计数"""
+
+    _remote_properties = set()
+
+    def __init__(self, target, tracer=TRACER):
+        self.__dict__['_target'] = target
+        self.__dict__['_tracer'] = tracer
+
+    def __getattr__(self, name):
+        tracer = self._tracer
+        if name in self._remote_properties:
+            with tracer.span(name, "driver"):
+                value = getattr(self._target, name)
+            tracer.count(name)
+            return _wrap_result(value, tracer)
+        value = getattr(self._target, name)
+        if name.startswith('_') or not callable(value):
+            return value
+
+        @functools.wraps(value)
+        def call(*args, **kwargs):
+            with tracer.span(name, _command_category(name, args)):
+                result = value(*args, **kwargs)
+            tracer.count(name)
+            return _wrap_result(result, tracer)
+        return call
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+
+class InstrumentedDriver(_Instrumented):
+    _remote_properties = REMOTE_DRIVER_PROPERTIES
+
+    @property
+    def wrapped_driver(self):
+        return self._target
+
+
+class InstrumentedElement(_Instrumented):
+    _remote_properties = REMOTE_ELEMENT_PROPERTIES
@@ -0,0 +1,176 @@
+# -*- coding: UTF-8 -*-
+"""
+异步分级日志：调用线程只做入队，由后台线程写控制台/文件
+
+- 低于控制台级别的记录（通常是 DEBUG 细节）只进入环形缓冲区，失败时调用 dump_debug() 才输出
+- 静默区间（begin_quiet/end_quiet）内只输出 WARNING 及以上，其余记录暂存，
+  区间结束后再补输出，用于开售后从点击立即预订到提交订单的关键窗口
+- 调试文件（失败时的页面层级）同样由后台线程写出，见 dump_file()
+"""
+
+import atexit
+import logging
+import queue
+import sys
+import threading
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener
+
+
+LOG_FORMAT = "%(message)s"
+FILE_FORMAT = "%(asctime)s %(levelname)s %(message)s"
+
+log = logging.getLogger("damai")
+
+
+class _ConsoleHandler(logging.StreamHandler):
+    """每次写入时取当前的 sys.stdout，使 contextlib.redirect_stdout 仍然生效"""
+
+    def __init__(self):
+        super().__init__(sys.stdout)
+
+    @property
+    def stream(self):
+        return sys.stdout
+
+    @stream.setter
+    def stream(self, value):
+        pass
+
+
+class AsyncHandler(QueueHandler):
+    """按级别与静默状态分流：入队输出、进入环形缓冲区或暂存到静默结束"""
+
+    def __init__(self, log_queue, console_level=logging.INFO, ring_size=2000):
+        super().__init__(log_queue)
+        self.console_level = console_level
+        self.ring = deque(maxlen=ring_size)
+        self.held = deque(maxlen=ring_size)
+        self.quiet = False
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        # 同进程内的后台线程直接使用原记录，消息格式化推迟到写入线程
+        return record
+
+    def emit(self, record):
+        if record.levelno < self.console_level:
+            self.ring.append(record)
+        elif self.quiet and record.levelno < logging.WARNING:
+            self.held.append(record)
+        else:
+            self.enqueue(record)
+
+    def begin_quiet(self):
+        self.quiet = True
+
+    def end_quiet(self, replay=True):
+        with self._lock:
+            self.quiet = False
+            held = list(self.held)
+            self.held.clear()
+        if replay:
+            for record in held:
+                self.enqueue(record)
+
+    def dump_ring(self, reason):
+        with self._lock:
+            records = list(self.ring)
+            self.ring.clear()
+        if not records:
+            return
+        header = logging.makeLogRecord({
+            "name": log.name, "levelno": logging.WARNING, "levelname": "WARNING",
+            "msg": f"===== 调试记录（{reason}，共 {len(records)} 条） =====",
+        })
+        self.enqueue(header)
+        for record in records:
+            self.enqueue(record)
+
+
+_queue = queue.Queue()
+_handler = None
+_listener = None
+_settings = None
+_dumps = queue.Queue()
+_dump_thread = None
+
+
+def setup_logging(level="INFO", log_file=None, ring_size=2000):
+    """配置日志：控制台级别、可选的日志文件（与控制台输出相同的记录，附带时间与级别）"""
+    global _handler, _listener, _settings
+    if _settings == (level, log_file, ring_size):
+        return log
+    _settings = (level, log_file, ring_size)
+    if _listener is not None:
+        _listener.stop()
+    if _handler is not None:
+        log.removeHandler(_handler)
+
+    console_level = logging.getLevelName(level.upper()) if isinstance(level, str) else level
+    _handler = AsyncHandler(_queue, console_level, ring_size)
+    log.addHandler(_handler)
+    log.setLevel(logging.DEBUG)
+    log.propagate = False
+
+    console = _ConsoleHandler()
+    console.setFormatter(logging.Formatter(LOG_FORMAT))
+    handlers = [console]
+    if log_file:
+        file_handler = logging.FileHandler(log_file, encoding="utf-8")
+        file_handler.setFormatter(logging.Formatter(FILE_FORMAT))
+        handlers.append(file_handler)
+    _listener = QueueListener(_queue, *handlers)
+    _listener.start()
+    return log
+
+
+def begin_quiet():
+    """进入静默区间：只输出 WARNING 及以上"""
+    _handler.begin_quiet()
+
+
+def end_quiet(replay=True):
+    """离开静默区间，replay 为真时补输出区间内暂存的记录"""
+    _handler.end_quiet(replay)
+
+
+def dump_debug(reason="失败"):
+    """失败时输出环形缓冲区中的调试记录"""
+    _handler.dump_ring(reason)
+
+
+def _write_dumps():
+    while True:
+        path, content = _dumps.get()
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(content)
+        except Exception as e:
+            log.warning(f"保存调试文件 {path} 失败: {e}")
+        finally:
+            _dumps.task_done()
+
+
+def dump_file(path, content):
+    """由后台线程把 content 写入 path，调用线程只做入队"""
+    global _dump_thread
+    if _dump_thread is None:
+        _dump_thread = threading.Thread(target=_write_dumps, name="DebugDump", daemon=True)
+        _dump_thread.start()
+    _dumps.put((path, content))
+
+
+def flush():
+    """等待后台线程写完已入队的记录与调试文件"""
+    _dumps.join()
+    _queue.join()
+
+
+def _shutdown():
+    if _listener is not None:
+        _listener.stop()
+
+
+setup_logging()
+atexit.register(_shutdown)
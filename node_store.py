@@ -0,0 +1,248 @@
+# -*- coding: UTF-8 -*-
+"""
+页面层级的节点存储，即定位求值使用的树访问接口（children/parent/tag/attr/order/descendants）：
+
+- NodeStore：紧凑存储。节点是 __slots__ 记录，属性值存为元组，同一组属性名共用一份名称表；
+  class、resource-id、package、"true"/"false" 等重复出现的值在进程内只保留一份。
+  节点按文档顺序存放，子树是连续区间，descendants 为一次切片
+- ElementStore：ElementTree 存储，节点可以修改（回放驱动按点击修改属性时使用）
+
+多台设备长时间运行时每份快照都保留一棵树，用紧凑存储减少常驻内存。
+直接运行本文件用 replay 目录中的层级（或指定的层级文件）对比两种存储的内存与解析耗时；
+ElementStore 的内存包含 ElementTree 本身与父节点、文档顺序两张映射表
+"""
+
+import argparse
+import glob
+import os
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from xml.parsers import expat
+
+
+# 不做驻留的属性：每个节点各不相同，驻留只会让驻留表变大
+UNINTERNED_ATTRS = frozenset(('bounds',))
+# 驻留表的上限，超出后清空重建（已建好的树不受影响）
+MAX_INTERNED = 65536
+
+_strings = {}
+_schemas = {}
+_NO_CHILDREN = ()
+
+
+def _intern(value):
+    cached = _strings.get(value)
+    if cached is None:
+        if len(_strings) >= MAX_INTERNED:
+            _strings.clear()
+        _strings[value] = cached = value
+    return cached
+
+
+def _schema(names):
+    """属性名元组对应的 {属性名: 下标}，相同的属性名组合共用一份"""
+    schema = _schemas.get(names)
+    if schema is None:
+        schema = _schemas[names] = {name: i for i, name in enumerate(names)}
+    return schema
+
+
+class CompactNode:
+    """NodeStore 中的一个节点
+
+    order 为文档顺序（根节点为 0，虚拟文档节点为 -1），end 为子树之后第一个节点的序号
+    """
+
+    __slots__ = ('tag', 'parent', 'children', 'order', 'end', 'names', 'values')
+
+    def __init__(self, tag, parent, order, names, values):
+        self.tag = tag
+        self.parent = parent
+        self.children = _NO_CHILDREN
+        self.order = order
+        self.end = order + 1
+        self.names = names
+        self.values = values
+
+    def get(self, name, default=None):
+        index = self.names.get(name)
+        return default if index is None else self.values[index]
+
+    @property
+    def attrib(self):
+        return dict(zip(self.names, self.values))
+
+
+class NodeStore:
+    """紧凑节点存储，用 expat 直接从源码构建，不经过 ElementTree"""
+
+    def __init__(self, source):
+        self.document = CompactNode('#document', None, -1, _schema(()), ())
+        self.nodes = []
+        self._by_bounds = None
+        stack = [self.document]
+        pending = [[]]
+        nodes = self.nodes
+
+        def start(tag, attrs):
+            names = _schema(tuple(attrs[0::2]))
+            values = tuple(value if name in UNINTERNED_ATTRS else _intern(value)
+                           for name, value in zip(attrs[0::2], attrs[1::2]))
+            node = CompactNode(_intern(tag), stack[-1], len(nodes), names, values)
+            pending[-1].append(node)
+            nodes.append(node)
+            stack.append(node)
+            pending.append([])
+
+        def end(tag):
+            node = stack.pop()
+            children = pending.pop()
+            if children:
+                node.children = tuple(children)
+            node.end = len(nodes)
+
+        parser = expat.ParserCreate()
+        parser.ordered_attributes = True
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.Parse(source, True)
+        if not nodes:
+            raise ValueError("层级中没有节点")
+        self.document.children = tuple(pending.pop())
+        self.document.end = len(nodes)
+        self.root = self.document.children[0]
+
+    def children(self, node):
+        return node.children
+
+    def parent(self, node):
+        return node.parent
+
+    def tag(self, node):
+        return node.tag
+
+    def attr(self, node, name):
+        index = node.names.get(name)
+        return None if index is None else node.values[index]
+
+    def attrs(self, node):
+        return dict(zip(node.names, node.values))
+
+    def order(self, node):
+        return node.order
+
+    def descendants(self, node):
+        return self.nodes[node.order + 1:node.end]
+
+    def iter(self):
+        return iter(self.nodes)
+
+    def subtree(self, node):
+        return self.nodes[node.order:node.end]
+
+    def nodes_at(self, bounds):
+        """bounds 属性等于给定字符串的节点，首次调用时建立索引"""
+        if self._by_bounds is None:
+            self._by_bounds = {}
+            for node in self.nodes:
+                value = node.get('bounds')
+                if value:
+                    self._by_bounds.setdefault(value, []).append(node)
+        return self._by_bounds.get(bounds, [])
+
+
+class ElementStore:
+    """ElementTree 节点存储，节点是可修改的 Element"""
+
+    def __init__(self, source):
+        self.root = ET.fromstring(source.encode('utf-8') if isinstance(source, str) else source)
+        # 虚拟文档节点，使 "/hierarchy" 与 "//x" 的语义与设备端一致
+        self.document = ET.Element('#document')
+        self._by_bounds = None
+        self._parent = {id(self.root): self.document}
+        self._order = {id(self.document): -1}
+        for index, node in enumerate(self.root.iter()):
+            self._order[id(node)] = index
+            for child in node:
+                self._parent[id(child)] = node
+
+    def children(self, node):
+        return [self.root] if node is self.document else list(node)
+
+    def parent(self, node):
+        return self._parent.get(id(node))
+
+    def tag(self, node):
+        return node.tag
+
+    def attr(self, node, name):
+        return node.get(name)
+
+    def attrs(self, node):
+        return dict(node.attrib)
+
+    def order(self, node):
+        return self._order.get(id(node), -1)
+
+    def descendants(self, node):
+        if node is self.document:
+            return list(self.root.iter())
+        return [n for n in node.iter() if n is not node]
+
+    def iter(self):
+        return self.root.iter()
+
+    def subtree(self, node):
+        return list(node.iter())
+
+    def nodes_at(self, bounds):
+        """bounds 属性等于给定字符串的节点，首次调用时建立索引"""
+        if self._by_bounds is None:
+            self._by_bounds = {}
+            for node in self.root.iter():
+                value = node.get('bounds')
+                if value:
+                    self._by_bounds.setdefault(value, []).append(node)
+        return self._by_bounds.get(bounds, [])
+
+
+# ---- 内存基准 ----
+
+def measure(store_class, source, copies=1):
+    """构建 copies 份存储，返回 (每份常驻内存字节数, 每份构建耗时毫秒)；耗时在关闭内存跟踪后单独测量"""
+    _strings.clear()
+    tracemalloc.start()
+    stores = [store_class(source) for _ in range(copies)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del stores
+    start = time.perf_counter()
+    for _ in range(copies):
+        store_class(source)
+    return current // copies, round((time.perf_counter() - start) * 1000 / copies, 3)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="紧凑节点存储与 ElementStore（ElementTree + 父节点/顺序映射）的内存、解析耗时对比")
+    parser.add_argument("files", nargs="*", help="层级 XML 文件，默认使用 replay 目录中的录制")
+    parser.add_argument("--copies", type=int, default=20, help="每个文件构建的份数（模拟同时保留的快照）")
+    args = parser.parse_args()
+
+    files = args.files or sorted(glob.glob(os.path.join(os.path.dirname(__file__) or '.', 'replay', '*.xml')))
+    baseline = "ElementStore（ElementTree + 父节点/顺序映射）"
+    totals = {ElementStore: 0, NodeStore: 0}
+    for path in files:
+        with open(path, 'r', encoding='utf-8') as f:
+            source = f.read()
+        row = {}
+        for store_class in totals:
+            row[store_class] = measure(store_class, source, args.copies)
+            totals[store_class] += row[store_class][0]
+        nodes = len(NodeStore(source).nodes)
+        (tree_bytes, tree_ms), (compact_bytes, compact_ms) = row[ElementStore], row[NodeStore]
+        print(f"{os.path.basename(path)}: {nodes} 个节点，ElementStore {tree_bytes / 1024:.1f} KB / {tree_ms} ms，"
+              f"紧凑存储 {compact_bytes / 1024:.1f} KB / {compact_ms} ms")
+    if totals[NodeStore]:
+        print(f"合计每份（{args.copies} 份）: {baseline} {totals[ElementStore] / 1024:.1f} KB，"
+              f"紧凑存储 {totals[NodeStore] / 1024:.1f} KB，为 ElementStore 的 {totals[NodeStore] / totals[ElementStore]:.0%}")
@@ -0,0 +1,308 @@
+# -*- coding: UTF-8 -*-
+"""
+开抢时刻调度：单调时钟 + 粗粒度睡眠后短时自旋
+
+- 开抢时间支持 "HH:MM:SS"（当天）与完整时间戳（"2025-10-20 13:17:00"、ISO 8601 带时区），
+  时区可用 IANA 名称（"Asia/Shanghai"）或偏移（"+08:00"）指定
+- 可选通过 SNTP 测量本机时钟相对参考服务器的偏差，调度时予以补偿；
+  LocalTimeServer 是本地替身服务器，可设定偏差用于验证
+- 每次触发记录实际抖动，写入 JSON Lines 日志，供 jitter_report 汇总后调整提前量
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import socket
+import struct
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from logger import log
+
+
+JITTER_LOG = os.path.join(os.path.dirname(__file__), 'schedule_jitter.jsonl')
+NTP_PORT = 123
+# 1900-01-01 与 1970-01-01 之间的秒数
+NTP_EPOCH_DELTA = 2208988800
+_OFFSET_PATTERN = re.compile(r'^(?:UTC|GMT)?([+-])(\d{1,2}):?(\d{2})?$')
+
+
+def resolve_timezone(name):
+    """IANA 名称或 "+08:00" 形式的偏移转换为 tzinfo，为空时使用本机时区"""
+    if not name:
+        return datetime.now().astimezone().tzinfo
+    match = _OFFSET_PATTERN.match(name.strip())
+    if match:
+        sign, hours, minutes = match.groups()
+        delta = timedelta(hours=int(hours), minutes=int(minutes or 0))
+        return dt_timezone(-delta if sign == '-' else delta)
+    from zoneinfo import ZoneInfo
+    return ZoneInfo(name)
+
+
+def parse_sale_time(value, tz=None):
+    """解析开抢时间，返回带时区的 datetime
+
+    "HH:MM:SS[.ffffff]" 视为当天；完整时间戳未带时区时按 tz 解释
+    """
+    tzinfo = resolve_timezone(tz) if tz is None or isinstance(tz, str) else tz
+    value = value.strip()
+    if re.match(r'^\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?$', value):
+        clock = datetime.strptime(value, "%H:%M:%S.%f" if '.' in value else
+                                  "%H:%M:%S" if value.count(':') == 2 else "%H:%M").time()
+        today = datetime.now(tzinfo).date()
+        return datetime.combine(today, clock, tzinfo)
+    target = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if target.tzinfo is None:
+        target = target.replace(tzinfo=tzinfo)
+    return target
+
+
+def _parse_server(server):
+    host, _, port = server.rpartition(':') if server.count(':') == 1 else (server, '', '')
+    return (host or server), int(port) if port else NTP_PORT
+
+
+def _to_ntp(timestamp):
+    seconds = timestamp + NTP_EPOCH_DELTA
+    return struct.pack("!II", int(seconds), int((seconds % 1) * 2 ** 32))
+
+
+def _from_ntp(data):
+    seconds, fraction = struct.unpack("!II", data)
+    return seconds - NTP_EPOCH_DELTA + fraction / 2 ** 32
+
+
+def sntp_sample(server, timeout=1.0):
+    """一次 SNTP 查询，返回 (偏差秒, 往返秒)；偏差为参考时间减本机时间"""
+    address = _parse_server(server)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        t1 = time.time()
+        start = time.perf_counter()
+        # LI=0, VN=4, Mode=3（客户端），发送时间写入 transmit 字段
+        packet = b'\x23' + b'\0' * 39 + _to_ntp(t1)
+        sock.sendto(packet, address)
+        data, _ = sock.recvfrom(512)
+        t4 = t1 + (time.perf_counter() - start)
+    if len(data) < 48 or data[24:32] != packet[40:48]:
+        raise ValueError("SNTP 响应无效")
+    t2 = _from_ntp(data[32:40])
+    t3 = _from_ntp(data[40:48])
+    offset = ((t2 - t1) + (t3 - t4)) / 2
+    delay = (t4 - t1) - (t3 - t2)
+    return offset, delay
+
+
+def measure_offset(server, samples=4, timeout=1.0):
+    """多次采样，取往返最短的一次，返回 (偏差秒, 往返秒)；全部失败返回 None"""
+    best = None
+    for _ in range(samples):
+        try:
+            offset, delay = sntp_sample(server, timeout)
+        except (OSError, ValueError) as e:
+            log.warning(f"时钟偏差采样失败 {server}: {e}")
+            continue
+        if best is None or delay < best[1]:
+            best = (offset, delay)
+    return best
+
+
+class LocalTimeServer:
+    """本地 SNTP 替身服务器，按设定偏差应答，用于验证偏差测量与调度补偿"""
+
+    def __init__(self, offset=0.0, host="127.0.0.1", port=0):
+        self.offset = offset
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((host, port))
+        self._sock.settimeout(0.2)
+        self._running = False
+        self._thread = None
+
+    @property
+    def address(self):
+        host, port = self._sock.getsockname()
+        return f"{host}:{port}"
+
+    def _serve(self):
+        while self._running:
+            try:
+                data, client = self._sock.recvfrom(512)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            now = _to_ntp(time.time() + self.offset)
+            # LI=0, VN=4, Mode=4（服务器），stratum 1
+            header = b'\x24\x01\x00\xec' + b'\0' * 20
+            self._sock.sendto(header + data[40:48] + now + now, client)
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, name="LocalTimeServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        self._sock.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class Scheduler:
+    """在参考时钟的目标时刻触发
+
+    参数:
+        timezone: 开抢时间的时区，为空使用本机时区
+        time_server: SNTP 参考服务器（"host" 或 "host:port"），为空时不做偏差补偿
+        spin_window: 目标前最后这段时间（秒）改为自旋等待
+        jitter_log: 触发抖动日志，为空不记录
+        keep_alive_margin: 目标前最后这段时间（秒）不再调用保活回调
+    """
+
+    def __init__(self, timezone=None, time_server=None, spin_window=0.005, jitter_log=JITTER_LOG,
+                 keep_alive_margin=3.0):
+        self.tz = resolve_timezone(timezone)
+        self.time_server = time_server
+        self.spin_window = spin_window
+        self.jitter_log = jitter_log
+        self.keep_alive_margin = keep_alive_margin
+        self.offset = 0.0
+        self.offset_delay = None
+        self.last_report = None
+
+    @staticmethod
+    def from_config(config):
+        return Scheduler(timezone=config.timezone, time_server=config.time_server)
+
+    def sync(self):
+        """测量本机时钟偏差，失败时保留上一次的结果"""
+        if not self.time_server:
+            return self.offset
+        result = measure_offset(self.time_server)
+        if result is not None:
+            self.offset, self.offset_delay = result
+            log.info(f"本机时钟偏差 {self.offset * 1000:+.1f} ms（往返 {self.offset_delay * 1000:.1f} ms，"
+                     f"参考 {self.time_server}）")
+        return self.offset
+
+    def reference_now(self):
+        """按参考时钟校正后的当前时间戳"""
+        return time.time() + self.offset
+
+    def _deadline(self, target_ts):
+        """目标时间戳换算为单调时钟的截止点"""
+        return time.monotonic() + (target_ts - self.reference_now())
+
+    def wait(self, target, advance_seconds=0, keep_alive=None, keep_alive_interval=30.0):
+        """等待到目标时刻（减去 advance_seconds），返回本次触发报告
+
+        keep_alive: 等待期间每隔 keep_alive_interval 秒调用一次（如会话保活），
+                    最后 keep_alive_margin 秒内不再调用，以免影响触发精度
+        """
+        if isinstance(target, str):
+            target = parse_sale_time(target, self.tz)
+        target_ts = target.timestamp() - advance_seconds
+        if self.time_server and target_ts - time.time() > 2:
+            self.sync()
+        deadline = self._deadline(target_ts)
+        late_start = time.monotonic() >= deadline
+        log.info(f"等待到 {datetime.fromtimestamp(target_ts, self.tz)} ...")
+
+        resynced = False
+        next_keep_alive = time.monotonic() + keep_alive_interval
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= self.spin_window:
+                break
+            if keep_alive and remaining > self.keep_alive_margin and time.monotonic() >= next_keep_alive:
+                keep_alive()
+                next_keep_alive = time.monotonic() + keep_alive_interval
+                continue
+            # 长时间等待时，在最后 30 秒前重新测量一次偏差并重新锚定
+            if self.time_server and not resynced and 30 < remaining < 35:
+                resynced = True
+                self.sync()
+                deadline = self._deadline(target_ts)
+                continue
+            time.sleep(min(remaining - self.spin_window, 1.0))
+        while time.monotonic() < deadline:
+            pass
+
+        fired = time.monotonic()
+        report = {
+            "target": datetime.fromtimestamp(target_ts, self.tz).isoformat(),
+            "advance_seconds": advance_seconds,
+            "jitter_ms": round((fired - deadline) * 1000, 3),
+            "wall_error_ms": round((self.reference_now() - target_ts) * 1000, 3),
+            "offset_ms": round(self.offset * 1000, 3),
+            "spin_window_ms": self.spin_window * 1000,
+            "late_start": late_start,
+        }
+        self.last_report = report
+        log.info("时间已到，开始执行点击操作！")
+        log.debug(f"触发抖动 {report['jitter_ms']} ms，参考时钟误差 {report['wall_error_ms']} ms")
+        # 目标时刻已过才开始等待的不是有效样本
+        if self.jitter_log and not late_start:
+            try:
+                with open(self.jitter_log, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(report, ensure_ascii=False) + "\n")
+            except OSError as e:
+                log.warning(f"写入触发抖动日志失败: {e}")
+        return report
+
+
+def jitter_report(path=JITTER_LOG):
+    """汇总抖动日志，返回 {count, p50_ms, p95_ms, max_ms}"""
+    samples = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                samples.append(json.loads(line)["wall_error_ms"])
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def pct(p):
+        return ordered[max(1, math.ceil(p / 100 * len(ordered))) - 1]
+
+    return {"count": len(ordered), "p50_ms": pct(50), "p95_ms": pct(95), "max_ms": ordered[-1]}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="开抢调度器：时钟偏差测量与触发抖动")
+    parser.add_argument("--server", help="测量本机相对该 SNTP 服务器的偏差（host 或 host:port）")
+    parser.add_argument("--standin-offset", type=float, help="启动本地替身服务器并设定偏差（秒），验证测量与补偿")
+    parser.add_argument("--fire-in", type=float, default=1.0, help="在多少秒后触发一次并报告抖动")
+    parser.add_argument("--runs", type=int, default=0, help="触发次数")
+    parser.add_argument("--spin-ms", type=float, default=5, help="自旋窗口（毫秒）")
+    parser.add_argument("--report", action="store_true", help="汇总抖动日志")
+    args = parser.parse_args()
+
+    import logger
+    standin = LocalTimeServer(args.standin_offset).start() if args.standin_offset is not None else None
+    server = standin.address if standin else args.server
+    scheduler = Scheduler(time_server=server, spin_window=args.spin_ms / 1000)
+    if server:
+        scheduler.sync()
+    for _ in range(args.runs):
+        target = datetime.fromtimestamp(scheduler.reference_now() + args.fire_in, scheduler.tz)
+        report = scheduler.wait(target.isoformat())
+        logger.flush()
+        print(f"触发抖动 {report['jitter_ms']} ms，参考时钟误差 {report['wall_error_ms']} ms")
+    if standin:
+        standin.stop()
+    if args.report and os.path.exists(JITTER_LOG):
+        print(f"抖动汇总: {jitter_report()}")
+    logger.flush()
@@ -0,0 +1,203 @@
+# -*- coding: UTF-8 -*-
+"""
+页面识别：从一份层级快照提取指纹（resource-id 集合与命中的关键文本），一次判定当前页面。
+判定结果按应用版本与判定规则的版本缓存在指纹表中，下次遇到相同指纹直接查表；
+与上一份快照相比只有不涉及 resource-id 增删、也不涉及判定文本的变化时，沿用上一次的判定，不再扫描整份源码
+"""
+
+import hashlib
+from collections import Counter
+import json
+import os
+import re
+
+from logger import log
+
+
+FINGERPRINT_FILE = os.path.join(os.path.dirname(__file__), 'screen_fingerprints.json')
+# 每个应用版本最多保留的指纹条数
+MAX_FINGERPRINTS = 512
+
+HOME = "home"
+SEARCH = "search"
+RESULTS = "results"
+DETAIL = "detail"
+CITY_LIST = "city_list"
+SESSION = "session"
+TIER = "tier"
+ATTENDEE = "attendee"
+ORDER = "order"
+DONE = "done"
+UNKNOWN = "unknown"
+
+# 各页面的判定标记：命中任一 resource-id 或文本即视为该页面。
+# 按顺序判定，同时包含多个页面元素的（如票档页也显示场次）排在前面
+SCREEN_MARKERS = [
+    (DONE, {
+        "ids": ["cn.damai:id/pay_btn"],
+        "texts": ["订单已提交"],
+    }),
+    (ATTENDEE, {
+        "ids": ["cn.damai:id/purchaser_list"],
+        "texts": ["选择购票人", "选择观演人"],
+    }),
+    (ORDER, {
+        "ids": ["cn.damai:id/tv_submit"],
+        "texts": ["确认订单", "立即提交"],
+    }),
+    (TIER, {
+        "ids": ["cn.damai:id/project_price_list", "cn.damai:id/layout_price_title"],
+        "texts": ["票档"],
+    }),
+    (SESSION, {
+        "ids": ["cn.damai:id/project_perform_list"],
+    }),
+    (CITY_LIST, {
+        "ids": ["cn.damai:id/city_list_recycler"],
+        "texts": ["选择城市"],
+    }),
+    (DETAIL, {
+        "ids": ["cn.damai:id/trade_project_detail_purchase_status_bar_container_fl",
+                "cn.damai:id/project_detail_scroll", "cn.damai:id/detail_title"],
+    }),
+    (RESULTS, {
+        "ids": ["cn.damai:id/search_result_list", "cn.damai:id/ll_search_item"],
+    }),
+    (SEARCH, {
+        "ids": ["cn.damai:id/header_search_v2_input", "cn.damai:id/search_history_title"],
+    }),
+    (HOME, {
+        "ids": ["cn.damai:id/homepage_header_search_text", "cn.damai:id/homepage_tab_layout"],
+    }),
+]
+
+
+# 全部页面的判定文本
+MARKER_TEXTS = tuple(text for _, markers in SCREEN_MARKERS for text in markers.get("texts", ()))
+
+# 指纹 key 的计算方式，改动 Fingerprint 的 key 时递增
+FINGERPRINT_RECIPE = 2
+# 判定规则的版本：SCREEN_MARKERS 或 key 的计算方式变化后，旧的指纹表不再使用
+RULES_VERSION = hashlib.sha1(json.dumps([FINGERPRINT_RECIPE, SCREEN_MARKERS], ensure_ascii=False,
+                                        sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+_ID_RE = re.compile(r'resource-id="([^"]+)"')
+_TEXT_RE = re.compile(r'\stext="([^"]+)"')
+
+
+class Fingerprint:
+    """一份快照的页面指纹
+
+    key 由 resource-id 集合与命中的判定文本（SCREEN_MARKERS 中的 texts）决定，用于查表；
+    同一组 resource-id 下文本不同（如确认订单与订单已提交）的页面 key 不同
+    """
+
+    __slots__ = ("ids", "texts", "key")
+
+    def __init__(self, ids, texts):
+        self.ids = frozenset(ids)
+        self.texts = frozenset(texts)
+        markers = sorted({prefix for prefix in MARKER_TEXTS if any(text.startswith(prefix) for text in self.texts)})
+        digest = hashlib.sha1("\n".join(sorted(self.ids) + ["#texts"] + markers).encode("utf-8"))
+        self.key = digest.hexdigest()[:16]
+
+    @classmethod
+    def of(cls, snapshot):
+        """单次扫描快照源码提取指纹，不遍历元素树"""
+        source = snapshot.source
+        return cls(_ID_RE.findall(source), _TEXT_RE.findall(source))
+
+
+def fingerprint_kept(diff):
+    """快照间的变化是否保持指纹与判定不变：变化区间内 resource-id 的增删相互抵消，且不涉及判定文本
+
+    只有文本变化的页面切换（如确认订单变为订单已提交）须重新判定
+    """
+    if any(text in diff.removed or text in diff.added for text in MARKER_TEXTS):
+        return False
+    return Counter(_ID_RE.findall(diff.removed)) == Counter(_ID_RE.findall(diff.added))
+
+
+def _matches(fp, markers):
+    if any(rid in fp.ids for rid in markers.get("ids", ())):
+        return True
+    prefixes = tuple(markers.get("texts", ()))
+    return bool(prefixes) and any(text.startswith(prefixes) for text in fp.texts)
+
+
+def classify_fingerprint(fp):
+    """按判定标记返回页面，都不符合时返回 UNKNOWN"""
+    for state, markers in SCREEN_MARKERS:
+        if _matches(fp, markers):
+            return state
+    return UNKNOWN
+
+
+class ScreenClassifier:
+    """带指纹表的页面识别器，指纹表按应用版本与判定规则的版本持久化
+
+    参数:
+        path: 指纹表文件，为 None 时不读写文件
+        app_version: 应用版本，不同版本的指纹互不共用
+    """
+
+    def __init__(self, path=FINGERPRINT_FILE, app_version="default"):
+        self.path = path
+        self.app_version = app_version or "default"
+        self.tables = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.tables = json.load(f)
+            except Exception as e:
+                log.warning(f"读取页面指纹表失败: {e}")
+        # 同一应用版本在旧判定规则下记下的表不再可信，丢弃
+        table_key = f"{self.app_version}#{RULES_VERSION}"
+        stale = [key for key in self.tables
+                 if key != table_key and key.split("#", 1)[0] == self.app_version]
+        for key in stale:
+            del self.tables[key]
+        self.table = self.tables.setdefault(table_key, {})
+        self.dirty = bool(stale)
+        self.hits = 0
+        self.misses = 0
+        # 上一次判定：(快照序号, 页面)
+        self._last = (None, None)
+
+    def classify(self, snapshot):
+        """返回快照所在的页面；与上一次判定的快照相比指纹不变时沿用其结果，指纹已知时直接查表"""
+        serial, state = self._last
+        if state not in (None, UNKNOWN) and (
+                snapshot.serial == serial
+                or (snapshot.diff is not None and snapshot.diff.base_serial == serial
+                    and fingerprint_kept(snapshot.diff))):
+            self._last = (snapshot.serial, state)
+            self.hits += 1
+            return state
+        state = self._classify(snapshot)
+        self._last = (snapshot.serial, state)
+        return state
+
+    def _classify(self, snapshot):
+        fp = Fingerprint.of(snapshot)
+        state = self.table.get(fp.key)
+        if state is not None:
+            self.hits += 1
+            return state
+        self.misses += 1
+        state = classify_fingerprint(fp)
+        # 无法识别的页面不入表，下次仍按规则判定
+        if state != UNKNOWN and len(self.table) < MAX_FINGERPRINTS:
+            self.table[fp.key] = state
+            self.dirty = True
+        return state
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self.tables, f, ensure_ascii=False, indent=1)
+            self.dirty = False
+        except Exception as e:
+            log.warning(f"保存页面指纹表失败: {e}")
@@ -0,0 +1,84 @@
+# -*- coding: UTF-8 -*-
+"""
+页面状态机：每一步先用一份快照判定当前页面，再调用该页面的处理函数，
+处理函数执行一次页面跳转所需的操作；页面未按预期变化时重试，出现意外页面时直接转到对应的处理函数
+"""
+
+import time
+
+from calibration import TRANSITION
+from instrumentation import TRACER
+from logger import log
+from waits import screen_changed
+
+
+class ScreenFlow:
+    """按页面状态驱动抢票流程
+
+    参数:
+        bot: 提供 classify_screen / fresh_snapshot / wait_for 的 DamaiBot
+        handlers: {页面: 处理函数}；处理函数返回 None 表示已执行跳转操作，
+                  返回 True/False 表示流程成功/失败结束
+        max_steps: 最多执行的处理次数
+        max_repeats: 同一页面连续处理的最多次数，超过视为卡住
+        transition_timeout: 处理后等待页面变化的最长时间（秒），为 None 时按设备标定；
+                            轮询间隔由 bot.waiter 自适应
+    """
+
+    def __init__(self, bot, handlers, max_steps=40, max_repeats=3, transition_timeout=None):
+        self.bot = bot
+        self.handlers = handlers
+        self.max_steps = max_steps
+        self.max_repeats = max_repeats
+        self.transition_timeout = transition_timeout or bot.timeout("transition")
+        self.history = []
+        # 当前页面已连续处理的次数，处理函数据此区分首次进入与重试
+        self.repeats = 0
+
+    def current_state(self):
+        return self.bot.classify_screen()
+
+    def await_change(self, state):
+        """等待页面离开 state，返回新页面；超时返回 None。切换耗时计入设备标定
+
+        处理函数已用探测确认过页面变化时（快照未过期也未作废），直接按该快照判定，不再往返
+        """
+        snapshot = self.bot.fresh_snapshot()
+        if snapshot is not None:
+            current = self.bot.classifier.classify(snapshot)
+            if current != state:
+                return current
+        start = time.perf_counter()
+        current = self.bot.wait_for(screen_changed(self.bot, state), self.transition_timeout, f"离开 {state}")
+        if current is not None:
+            self.bot.calibration.observe(TRANSITION, time.perf_counter() - start)
+        return current
+
+    def run(self):
+        previous = None
+        for _ in range(self.max_steps):
+            state = self.current_state()
+            self.repeats = self.repeats + 1 if state == previous else 0
+            if self.repeats >= self.max_repeats:
+                log.warning(f"页面 {state} 连续 {self.repeats} 次处理后仍未变化，放弃")
+                return False
+            previous = state
+            self.history.append(state)
+            log.info(f"当前页面: {state}")
+
+            handler = self.handlers.get(state)
+            if handler is None:
+                log.warning(f"页面 {state} 没有对应的处理函数")
+                return False
+            try:
+                with TRACER.span(state, "screen"):
+                    result = handler()
+            except Exception as e:
+                log.warning(f"处理页面 {state} 时出错: {e}")
+                result = None
+            if result is not None:
+                return result
+            if self.await_change(state) is None:
+                log.warning(f"页面 {state} 在 {self.transition_timeout} 秒内未变化，重新处理")
+        log.warning(f"超过最大步数 {self.max_steps}，流程结束")
+        return False
@@ -0,0 +1,324 @@
+# -*- coding: UTF-8 -*-
+"""
+选择器级联：每个页面的选择器只在这里声明一次，启动时编译，
+按历史命中率排序，并尽量用一次设备往返完成定位
+"""
+
+import json
+import os
+import time
+
+from appium.webdriver.common.appiumby import AppiumBy
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+from instrumentation import TRACER
+from logger import log
+from ui_snapshot import LocatorUnsupported
+
+
+STATS_FILE = os.path.join(os.path.dirname(__file__), 'selector_stats.json')
+
+# 按页面声明的选择器模板，{keyword}/{city}/{date}/{month_day} 在编译时替换为配置值
+SCREEN_SELECTORS = {
+    "home": {
+        "featured_tab": [
+            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().text("精选")'),
+            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().textContains("精选")'),
+            (AppiumBy.XPATH, '//android.widget.TextView[@text="精选"]'),
+            (AppiumBy.XPATH, '//*[contains(@text, "精选")]'),
+        ],
+        "nav_button": [
+            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().text("首页")'),
+            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().text("我的")'),
+            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().text("发现")'),
+            (AppiumBy.XPATH, '//android.widget.TextView[@text="首页"]'),
+            (AppiumBy.XPATH, '//android.widget.TextView[@text="我的"]'),
+            (AppiumBy.XPATH, '//android.widget.TextView[@text="发现"]'),
+        ],
+        "search_box": [
+            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().textContains("搜索")'),
+            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().resourceId("cn.damai:id/search_bar")'),
+            (AppiumBy.XPATH, '//*[contains(@text, "搜索")]'),
+        ],
+    },
+    "search": {
+        "search_button": [
+            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().text("搜索")'),
+            (AppiumBy.XPATH, '//android.widget.TextView[@text="搜索"]'),
+        ],
+    },
+    "results": {
+        "first_result": [
+            # 演员名称特定选择器（最高优先级）
+            (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "{keyword}")]/parent::*'),
+            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().textContains("{keyword}")'),
+            # 第一个搜索结果选择器（通用）
+            (AppiumBy.XPATH, '//android.widget.LinearLayout[@resource-id="cn.damai:id/ll_search_item"][1]'),
+            (AppiumBy.XPATH, '//android.widget.TextView[@resource-id="cn.damai:id/item_title"][1]'),
+            (AppiumBy.XPATH, '//android.widget.ListView/android.widget.LinearLayout[1]'),
+            (AppiumBy.XPATH, '//android.widget.RecyclerView/android.widget.LinearLayout[1]'),
+            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().className("android.widget.ListView").childSelector(new UiSelector().index(0))'),
+            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().className("android.widget.RecyclerView").childSelector(new UiSelector().index(0))'),
+        ],
+    },
+    "detail": {
+        "booking": [
+            # 底部购买栏（立即预订/立即购买/预约抢票）
+            (AppiumBy.ID, "cn.damai:id/trade_project_detail_purchase_status_bar_container_fl"),
+            (AppiumBy.XPATH, '//*[@text="立即预订" or @text="立即购买" or @text="预约抢票" or @text="即将开抢"]/..'),
+            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().textMatches(".*立即预订.*|.*立即购买.*|.*预约抢票.*")'),
+        ],
+        "city": [
+            # 精确匹配城市名
+            (AppiumBy.XPATH, '//android.widget.TextView[@text="{city}"]'),
+            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().text("{city}")'),
+            # 包含城市名
+            (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "{city}")]'),
+            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().textContains("{city}")'),
+            # 城市名所在的父元素
+            (AppiumBy.XPATH, '//*[contains(@text, "{city}")]/parent::*'),
+            (AppiumBy.XPATH, '//*[contains(@text, "{city}")]/..'),
+            # 城市卡片选择器
+            (AppiumBy.XPATH, '//android.view.View[contains(@content-desc, "{city}")]'),
+            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().descriptionContains("{city}")'),
+            # 针对城市列表页面的特殊选择器
+            (AppiumBy.XPATH, '//android.widget.FrameLayout[.//android.widget.TextView[contains(@text, "{city}")]]'),
+            (AppiumBy.XPATH, '//android.view.ViewGroup[.//android.widget.TextView[contains(@text, "{city}")]]'),
+            # 针对热卖中标签的选择器
+            (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "{city}")]/following-sibling::android.widget.TextView[contains(@text, "热卖中")]/../..'),
+            (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "{city}")]/parent::*/parent::*'),
+            (AppiumBy.XPATH, '//android.widget.TextView[@text="{city}"]/parent::android.view.ViewGroup'),
+            (AppiumBy.XPATH, '//android.widget.TextView[@text="{city}"]/following-sibling::android.widget.TextView'),
+            (AppiumBy.XPATH, '//android.widget.TextView[@text="{city}"]/../..'),
+            (AppiumBy.XPATH, '//android.widget.TextView[@text="{city}"]/following-sibling::*[1]'),
+        ],
+    },
+    "session": {
+        "date": [
+            # 匹配 "YYYY-MM-DD 周X HH:MM" 格式
+            (AppiumBy.XPATH, '//android.widget.TextView[starts-with(@text, "{date}")]'),
+            (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "{date}")]'),
+            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().textContains("{date}")'),
+            # 匹配月日部分（例如"11-02"）
+            (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "{month_day}")]'),
+            (AppiumBy.XPATH, '//android.view.ViewGroup//android.widget.TextView[contains(@text, "周") and contains(@text, ":")]'),
+            (AppiumBy.XPATH, '//android.widget.TextView[contains(@resource-id, "dateItemText")]'),
+            (AppiumBy.XPATH, '//android.widget.TextView[contains(@resource-id, "date")]'),
+            (AppiumBy.XPATH, '//android.widget.TextView[@enabled="true" and contains(@resource-id, "date")]'),
+            (AppiumBy.XPATH, '//android.view.ViewGroup[contains(@resource-id, "calendar")]/android.widget.TextView'),
+        ],
+    },
+    "tier": {
+        "ticket": [
+            # 价格元素（如"499元"），排除缺货登记
+            (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "元") and not(contains(@text, "缺货登记"))]/../..'),
+            (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "元")]/../..'),
+            (AppiumBy.XPATH, '//android.widget.TextView[matches(@text, "[0-9]+元") and not(contains(@text, "缺货登记"))]/../..'),
+            (AppiumBy.XPATH, '//android.widget.TextView[matches(@text, "[0-9]+元")]/../..'),
+            (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "票档")]/../..'),
+            (AppiumBy.XPATH, '//android.view.ViewGroup[contains(@resource-id, "item_container")]'),
+            (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "¥")]/../..'),
+            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().textContains("¥")'),
+            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().textContains("票档")'),
+            (AppiumBy.XPATH, '//android.widget.FrameLayout[contains(@resource-id, "item_container")]'),
+            (AppiumBy.XPATH, '//android.widget.LinearLayout[contains(@resource-id, "item_container")]'),
+        ],
+        "plus_button": [
+            (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "+")]'),
+            (AppiumBy.XPATH, '//android.widget.Button[contains(@resource-id, "plus")]'),
+            (AppiumBy.XPATH, '//android.widget.ImageView[contains(@resource-id, "plus")]'),
+            (AppiumBy.XPATH, '//android.view.View[contains(@resource-id, "plus")]'),
+            (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "1")]/following-sibling::*'),
+            (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "1张")]/following-sibling::*'),
+        ],
+        "quantity": [
+            (AppiumBy.ID, "cn.damai:id/tv_num"),
+            (AppiumBy.XPATH, '//android.widget.TextView[contains(@resource-id, "num")]'),
+        ],
+        "confirm": [
+            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().textMatches(".*确定.*|.*购买.*")'),
+            (AppiumBy.XPATH, '//android.widget.Button[contains(@text, "确定")]'),
+            (AppiumBy.XPATH, '//android.widget.TextView[contains(@text, "确定")]'),
+            (AppiumBy.ID, "btn_buy_view"),
+            (AppiumBy.XPATH, '//android.view.View[contains(@text, "确定")]'),
+        ],
+    },
+    "order": {
+        "submit": [
+            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().text("立即提交")'),
+            (AppiumBy.ANDROID_UIAUTOMATOR, 'new UiSelector().textMatches(".*提交.*|.*确认.*")'),
+            (AppiumBy.XPATH, '//*[contains(@text,"提交")]'),
+        ],
+    },
+}
+
+
+def month_day(date):
+    """从 YYYY-MM-DD 中取出 MM-DD，格式不符时原样返回"""
+    parts = date.split("-") if date else []
+    return "-".join(parts[1:]) if len(parts) > 2 else (date or "")
+
+
+class CascadeStats:
+    """选择器命中统计，跨运行持久化，用于给级联排序"""
+
+    def __init__(self, path=STATS_FILE):
+        self.path = path
+        self.counts = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.counts = json.load(f)
+            except Exception as e:
+                log.warning(f"读取选择器命中统计失败: {e}")
+        self.dirty = False
+
+    def score(self, cascade, value):
+        """命中率（拉普拉斯平滑），无记录的选择器得 0.5"""
+        hits, misses = self.counts.get(cascade, {}).get(value, (0, 0))
+        return (hits + 1) / (hits + misses + 2)
+
+    def record(self, cascade, value, hit):
+        hits, misses = self.counts.setdefault(cascade, {}).get(value, (0, 0))
+        self.counts[cascade][value] = (hits + 1, misses) if hit else (hits, misses + 1)
+        self.dirty = True
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        try:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump(self.counts, f, ensure_ascii=False, indent=1)
+            self.dirty = False
+        except Exception as e:
+            log.warning(f"保存选择器命中统计失败: {e}")
+
+
+class SelectorCascade:
+    """编译后的一组等价选择器
+
+    ranked 策略：每轮先试命中率最高的选择器（一次往返），未命中时把其余 XPath
+    合并成一个 union 查询作为闸门，闸门为空就整体跳过这些 XPath，全程不使用
+    WebDriverWait 的阻塞等待。sequential 策略保留原来逐个 WebDriverWait 的行为，
+    仅用于基准对比。
+    """
+
+    def __init__(self, name, selectors, stats=None, strategy="ranked"):
+        self.name = name
+        self.selectors = selectors
+        self.stats = stats or CascadeStats(path=None)
+        self.strategy = strategy
+        self._union_ok = True
+
+    def ranked(self):
+        order = range(len(self.selectors))
+        order = sorted(order, key=lambda i: (-self.stats.score(self.name, self.selectors[i][1]), i))
+        return [self.selectors[i] for i in order]
+
+    def resolve(self, driver, timeout=0, poll=0.05):
+        """返回 (命中的选择器, 元素列表)；超时未命中返回 (None, [])"""
+        if self.strategy == "sequential":
+            return sequential_find(driver, self.selectors, timeout)
+
+        deadline = time.monotonic() + timeout
+        while True:
+            ranked = self.ranked()
+            for selector in self._probe_order(driver, ranked):
+                with TRACER.span(self.name, "selector", selector=selector[1]) as span:
+                    elements = _find_elements(driver, selector)
+                    span["hit"] = bool(elements)
+                if elements:
+                    self._record(ranked, selector)
+                    return selector, elements
+            if time.monotonic() >= deadline:
+                return None, []
+            time.sleep(poll)
+
+    def resolve_local(self, snapshot):
+        """在本地快照中按排序求值，返回 (命中的选择器, 节点列表, 是否存在无法本地求值的选择器)"""
+        tried = []
+        unsupported = False
+        for selector in self.ranked():
+            with TRACER.span(self.name, "selector", selector=selector[1], local=True) as span:
+                try:
+                    nodes = snapshot.find(*selector)
+                except LocatorUnsupported:
+                    nodes = None
+                span["hit"] = bool(nodes)
+            if nodes is None:
+                unsupported = True
+                continue
+            tried.append(selector)
+            if nodes:
+                self._record(tried, selector)
+                return selector, nodes, unsupported
+        return None, [], unsupported
+
+    def _probe_order(self, driver, ranked):
+        """惰性生成本轮需要真正查询的选择器"""
+        yield ranked[0]
+        rest = ranked[1:]
+        xpaths = [value for by, value in rest if by == AppiumBy.XPATH]
+        if self._union_ok and len(xpaths) > 1:
+            try:
+                with TRACER.span(self.name, "selector", selector="union", size=len(xpaths)) as span:
+                    gate = driver.find_elements(AppiumBy.XPATH, " | ".join(xpaths))
+                    span["hit"] = bool(gate)
+                if not gate:
+                    rest = [s for s in rest if s[0] != AppiumBy.XPATH]
+            except WebDriverException:
+                # 含设备端不支持的语法（如 matches()）时，退回逐个查询
+                self._union_ok = False
+        for selector in rest:
+            yield selector
+
+    def _record(self, ranked, winner):
+        for selector in ranked:
+            if selector == winner:
+                self.stats.record(self.name, selector[1], True)
+                break
+            self.stats.record(self.name, selector[1], False)
+
+
+def _find_elements(driver, selector):
+    try:
+        return driver.find_elements(*selector)
+    except WebDriverException:
+        return []
+
+
+def sequential_find(driver, selectors, timeout):
+    """原始行为：按声明顺序对每个选择器各做一次 WebDriverWait"""
+    for by, value in selectors:
+        try:
+            with TRACER.span("WebDriverWait", "wait", selector=value):
+                WebDriverWait(driver, timeout).until(EC.presence_of_element_located((by, value)))
+            return (by, value), driver.find_elements(by, value)
+        except (TimeoutException, WebDriverException):
+            continue
+    return None, []
+
+
+def compile_cascades(config, stats=None, strategy="ranked"):
+    """按配置展开全部页面的选择器模板，返回 {"页面.名称": SelectorCascade}"""
+    if stats is None:
+        stats = CascadeStats()
+    fields = {
+        "keyword": config.keyword,
+        "city": config.city,
+        "date": config.date,
+        "month_day": month_day(config.date),
+    }
+    cascades = {}
+    for screen, groups in SCREEN_SELECTORS.items():
+        for group, templates in groups.items():
+            selectors = []
+            for by, template in templates:
+                selector = (by, template.format(**fields))
+                if selector not in selectors:
+                    selectors.append(selector)
+            name = f"{screen}.{group}"
+            cascades[name] = SelectorCascade(name, selectors, stats, strategy)
+    return cascades
@@ -0,0 +1,105 @@
+# -*- coding: UTF-8 -*-
+"""
+驱动会话管理：保持一个经过验证的会话，失败重试时先做一次往返的健康检查（同时并发取回页面层级），
+会话可用时返回上一页回到可继续的页面，只有会话失效时才重新创建（耗时记入计时）。
+
+UiAutomator2 同一台设备只能有一个会话，新建会话会结束旧会话，因此不保留备用会话；
+重新创建时复用同一套能力配置
+"""
+
+import time
+
+from calibration import RTT
+from instrumentation import TRACER
+from logger import log
+from screen_classifier import DETAIL, HOME, RESULTS, SEARCH
+from waits import package_is, screen_changed
+
+
+APP_PACKAGE = "cn.damai"
+# 从这些页面重新开始流程不会重复下单
+RESUME_STATES = (DETAIL, RESULTS, SEARCH, HOME)
+
+
+class SessionManager:
+    """DamaiBot 的会话管理
+
+    参数:
+        bot: 提供 driver / probe / _setup_driver / classify_screen / wait_for 的 DamaiBot
+        max_backs: 恢复时最多返回上一页的次数
+    """
+
+    def __init__(self, bot, max_backs=4):
+        self.bot = bot
+        self.max_backs = max_backs
+        # 每次重新创建会话的耗时（毫秒）
+        self.reconnects = []
+
+    def check(self):
+        """一次往返的健康检查，返回前台包名；会话失效返回 None"""
+        start = time.perf_counter()
+        try:
+            package = self.bot.driver.current_package
+        except Exception as e:
+            log.warning(f"会话健康检查失败: {e}")
+            return None
+        self.bot.calibration.observe(RTT, time.perf_counter() - start)
+        return package
+
+    def probe(self):
+        """健康检查的同时并发取回页面层级，供随后的页面识别直接使用；返回前台包名，会话失效返回 None"""
+        try:
+            return self.bot.probe()
+        except Exception as e:
+            log.warning(f"会话健康检查失败: {e}")
+            return None
+
+    def reconnect(self):
+        """结束旧会话并重新创建"""
+        start = time.perf_counter()
+        with TRACER.span("reconnect", "session") as span:
+            try:
+                self.bot.driver.quit()
+            except Exception:
+                pass
+            self.bot._setup_driver()
+            elapsed = (time.perf_counter() - start) * 1000
+            span["ms"] = round(elapsed, 1)
+        self.reconnects.append(elapsed)
+        log.info(f"已重新创建会话，耗时 {elapsed:.0f} ms")
+
+    def recover(self):
+        """失败后恢复到可继续的页面，返回恢复后的页面；会话失效时重新创建，返回 None"""
+        with TRACER.span("recover", "session") as span:
+            package = self.probe()
+            if package is None:
+                self.reconnect()
+                return None
+            try:
+                return self._navigate_back(package, span)
+            except Exception as e:
+                log.warning(f"返回可继续页面时出错: {e}")
+                self.reconnect()
+                return None
+
+    def _navigate_back(self, package, span):
+        bot = self.bot
+        if package != APP_PACKAGE:
+            log.info("大麦APP不在前台，重新切换到前台...")
+            bot.invalidate_snapshot()
+            bot.driver.activate_app(APP_PACKAGE)
+            bot.wait_for(package_is(bot.driver, APP_PACKAGE), bot.timeout("launch"), "等待APP启动")
+        # 首次识别使用健康检查时并发取回的层级，之后使用等待返回时取得的层级
+        for backs in range(self.max_backs + 1):
+            state = bot.classify_screen()
+            if state in RESUME_STATES:
+                span["backs"] = backs
+                log.info(f"已返回页面 {state}，复用当前会话重试")
+                return state
+            if backs == self.max_backs:
+                break
+            bot.driver.back()
+            bot.wait_for(screen_changed(bot, state), bot.timeout("transition"), "等待返回上一页")
+        log.warning(f"返回 {self.max_backs} 次后仍在页面 {state}，从当前页面继续")
+        span["backs"] = self.max_backs
+        return state
@@ -0,0 +1,197 @@
+# -*- coding: UTF-8 -*-
+"""
+本地定位求值（compile_locator）与设备端结果的对照。
+
+期望结果是设备对 replay 目录中录制层级执行同一条定位语句时返回的节点（以 bounds 标识，按文档顺序），
+逐条对照 XML 手工确认，不依赖本地求值本身。每条用例在紧凑存储与 ElementTree 存储上各跑一遍。
+末尾是快照差异按子树判定变化的用例
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_driver import REPLAY_DIR, replay_config  # noqa: E402
+from node_store import ElementStore, NodeStore  # noqa: E402
+from selector_cascade import CascadeStats, compile_cascades  # noqa: E402
+from ui_snapshot import LocatorUnsupported, Snapshot, compile_locator  # noqa: E402
+
+XPATH = 'xpath'
+UIAUTOMATOR = '-android uiautomator'
+ID = 'id'
+
+_SOURCES = {}
+
+
+def load(screen, store):
+    if screen not in _SOURCES:
+        with open(os.path.join(REPLAY_DIR, f"{screen}.xml"), 'r', encoding='utf-8') as f:
+            _SOURCES[screen] = f.read()
+    return Snapshot(_SOURCES[screen], store=store)
+
+
+def bounds_of(snapshot, by, value):
+    return [snapshot.store.attr(node, 'bounds') for node in compile_locator(by, value)(snapshot.store)]
+
+
+STORES = pytest.mark.parametrize("store", [NodeStore, ElementStore], ids=["compact", "element"])
+
+# SCREEN_SELECTORS 中的选择器，按 replay/scenario.json 的配置（刘若英 / 南京 / 2025-11-02）展开
+SCREEN_SELECTOR_CASES = [
+    ("home", UIAUTOMATOR, 'new UiSelector().text("精选")', ["[20,240][180,330]"]),
+    ("home", XPATH, '//*[contains(@text, "精选")]', ["[20,240][180,330]"]),
+    ("home", UIAUTOMATOR, 'new UiSelector().textContains("搜索")', ["[130,120][1040,220]"]),
+    ("home", UIAUTOMATOR, 'new UiSelector().resourceId("cn.damai:id/search_bar")', ["[40,120][1040,220]"]),
+    ("home", XPATH, '//android.widget.TextView[@text="我的"]', ["[810,2260][1080,2400]"]),
+    # 输入框 EditText 的文本也是关键词，但不是 TextView
+    ("results", XPATH, '//android.widget.TextView[contains(@text, "刘若英")]/parent::*',
+     ["[310,320][1050,680]", "[310,740][1050,1100]", "[310,1160][1050,1520]", "[310,1580][1050,1940]"]),
+    ("results", UIAUTOMATOR, 'new UiSelector().textContains("刘若英")',
+     ["[120,120][900,220]", "[310,320][1050,440]", "[310,740][1050,860]", "[310,1160][1050,1280]",
+      "[310,1580][1050,1700]"]),
+    # 位置谓词作用于每个父节点下的同名兄弟：搜索项同属一个列表，标题各在自己的容器里
+    ("results", XPATH, '//android.widget.LinearLayout[@resource-id="cn.damai:id/ll_search_item"][1]',
+     ["[0,300][1080,700]"]),
+    ("results", XPATH, '//android.widget.TextView[@resource-id="cn.damai:id/item_title"][1]',
+     ["[310,320][1050,440]", "[310,740][1050,860]", "[310,1160][1050,1280]", "[310,1580][1050,1700]",
+      "[310,2000][1050,2120]"]),
+    # 录制中的列表是 androidx 的 RecyclerView，设备上按 android.widget 类名查不到
+    ("results", XPATH, '//android.widget.RecyclerView/android.widget.LinearLayout[1]', []),
+    ("results", UIAUTOMATOR,
+     'new UiSelector().className("android.widget.RecyclerView").childSelector(new UiSelector().index(0))', []),
+    ("detail", ID, "cn.damai:id/trade_project_detail_purchase_status_bar_container_fl", ["[600,2200][1080,2400]"]),
+    ("detail", XPATH, '//*[@text="立即预订" or @text="立即购买" or @text="预约抢票" or @text="即将开抢"]/..',
+     ["[600,2200][1080,2400]"]),
+    ("detail", UIAUTOMATOR, 'new UiSelector().textMatches(".*立即预订.*|.*立即购买.*|.*预约抢票.*")',
+     ["[600,2200][1080,2400]"]),
+    ("detail", XPATH, '//android.widget.TextView[@text="南京"]/following-sibling::*[1]', ["[60,1290][250,1350]"]),
+    ("detail", XPATH, '//android.widget.TextView[@text="南京"]/following-sibling::android.widget.TextView',
+     ["[60,1290][250,1350]", "[60,1360][250,1420]"]),
+    ("detail", XPATH, '//android.widget.TextView[contains(@text, "南京")]/following-sibling::android.widget.TextView'
+                      '[contains(@text, "热卖中")]/../..', ["[0,1180][1080,1500]"]),
+    ("detail", XPATH, '//android.view.ViewGroup[.//android.widget.TextView[contains(@text, "南京")]]',
+     ["[40,1180][270,1480]"]),
+    ("detail", XPATH, '//android.widget.TextView[@text="南京"]/parent::android.view.ViewGroup',
+     ["[40,1180][270,1480]"]),
+    ("session", XPATH, '//android.widget.TextView[starts-with(@text, "2025-11-02")]', ["[60,1030][1020,1160]"]),
+    ("session", XPATH, '//android.view.ViewGroup//android.widget.TextView[contains(@text, "周") and contains(@text, ":")]',
+     ["[60,840][1020,970]", "[60,1030][1020,1160]"]),
+    # 缺货登记是单独的标签节点，价格文本本身不含它
+    ("tier", XPATH, '//android.widget.TextView[contains(@text, "元") and not(contains(@text, "缺货登记"))]/../..',
+     ["[40,1120][530,1280]", "[550,1120][1040,1280]", "[40,1300][530,1460]", "[550,1300][1040,1460]"]),
+    ("tier", XPATH, '//android.widget.TextView[contains(@text, "+")]', ["[940,1900][1040,2000]"]),
+    # 场次文本含 "1"，其后的兄弟是整个面板的下半部分；数量 "1" 的兄弟是加号
+    ("tier", XPATH, '//android.widget.TextView[contains(@text, "1")]/following-sibling::*',
+     ["[40,1040][400,1100]", "[40,1120][1040,1480]", "[40,1900][400,2000]", "[700,1900][1040,2000]",
+      "[940,1900][1040,2000]", "[40,2250][1040,2380]"]),
+    ("tier", ID, "cn.damai:id/tv_num", ["[800,1900][940,2000]"]),
+    ("tier", ID, "btn_buy_view", ["[40,2250][1040,2380]"]),
+    ("tier", UIAUTOMATOR, 'new UiSelector().textMatches(".*确定.*|.*购买.*")', ["[40,2250][1040,2380]"]),
+    ("order", UIAUTOMATOR, 'new UiSelector().text("立即提交")', ["[700,2250][1060,2390]"]),
+    ("order", XPATH, '//*[contains(@text,"提交")]', ["[700,2250][1060,2390]"]),
+]
+
+# not(contains())、位置谓词与 resourceId().text() 链的补充用例
+EXTRA_CASES = [
+    ("home", XPATH, '//android.widget.TextView[@resource-id="cn.damai:id/channel_title" and not(contains(@text, "演"))]',
+     ["[20,240][180,330]", "[360,240][560,330]", "[560,240][720,330]", "[720,240][920,330]"]),
+    ("tier", XPATH, '//android.widget.FrameLayout[@resource-id="cn.damai:id/item_price"'
+                    ' and not(.//*[contains(@text, "缺货登记")])]',
+     ["[40,1120][530,1280]", "[550,1120][1040,1280]", "[40,1300][530,1460]"]),
+    ("order", XPATH, '//android.widget.TextView[@resource-id="cn.damai:id/text_name" and not(contains(@text, "1"))]',
+     ["[40,720][400,780]", "[40,880][400,940]"]),
+    ("home", XPATH, '//*[@resource-id="cn.damai:id/homepage_item"][2]/android.widget.TextView[1]',
+     ["[280,640][1040,710]"]),
+    ("home", XPATH, '//android.widget.LinearLayout[@resource-id="cn.damai:id/homepage_item"]/android.widget.TextView[3]',
+     ["[280,520][600,580]", "[280,780][600,840]", "[280,1040][600,1100]", "[280,1300][600,1360]",
+      "[280,1560][600,1620]", "[280,1820][600,1880]", "[280,2080][600,2140]"]),
+    ("order", XPATH, '//android.widget.LinearLayout[@resource-id="cn.damai:id/item_purchaser"][2]/android.widget.CheckBox',
+     ["[940,730][1020,810]"]),
+    ("home", UIAUTOMATOR, 'new UiSelector().resourceId("cn.damai:id/tab_title").text("我的")', ["[810,2260][1080,2400]"]),
+    ("home", UIAUTOMATOR, 'new UiSelector().resourceId("cn.damai:id/tab_title").text("精选")', []),
+    ("home", UIAUTOMATOR, 'new UiSelector().resourceId("cn.damai:id/channel_title").selected(true)',
+     ["[20,240][180,330]"]),
+    ("tier", UIAUTOMATOR, 'new UiSelector().resourceId("cn.damai:id/item_text").textContains("99")',
+     ["[60,1140][510,1260]", "[570,1140][1020,1260]", "[60,1320][510,1440]", "[570,1320][1020,1440]"]),
+    ("order", UIAUTOMATOR, 'new UiSelector().resourceId("cn.damai:id/text_name").text("用户3")', ["[40,880][400,940]"]),
+    ("order", UIAUTOMATOR, 'new UiSelector().resourceId("cn.damai:id/text_name").textStartsWith("用户").instance(1)',
+     ["[40,720][400,780]"]),
+    ("order", UIAUTOMATOR, 'new UiSelector().resourceId("cn.damai:id/item_purchaser")'
+                           '.childSelector(new UiSelector().className("android.widget.CheckBox"))',
+     ["[940,570][1020,650]", "[940,730][1020,810]", "[940,890][1020,970]"]),
+    ("order", UIAUTOMATOR, 'new UiSelector().resourceId("cn.damai:id/text_name").text("用户2")'
+                           '.fromParent(new UiSelector().resourceId("cn.damai:id/checkbox"))',
+     ["[940,730][1020,810]"]),
+]
+
+
+def _case_id(case):
+    screen, by, value, _ = case
+    return f"{screen}:{value}"
+
+
+@STORES
+@pytest.mark.parametrize("case", SCREEN_SELECTOR_CASES + EXTRA_CASES, ids=_case_id)
+def test_matches_device_result(case, store):
+    screen, by, value, expected = case
+    assert bounds_of(load(screen, store), by, value) == expected
+
+
+def test_cases_cover_screen_selectors():
+    """SCREEN_SELECTORS 用例中的选择器都来自按回放配置展开的级联"""
+    declared = {selector for cascade in compile_cascades(replay_config(), CascadeStats(path=None)).values()
+                for selector in cascade.selectors}
+    for screen, by, value, _ in SCREEN_SELECTOR_CASES:
+        assert (by, value) in declared, value
+
+
+@pytest.mark.parametrize("screen", ["home", "search", "results", "detail", "session", "tier", "order", "done"])
+def test_screen_selectors_evaluate_or_defer(screen):
+    """每条声明的选择器要么能在本地求值，要么明确抛出 LocatorUnsupported 交给设备"""
+    snapshot = load(screen, NodeStore)
+    for cascade in compile_cascades(replay_config(), CascadeStats(path=None)).values():
+        for by, value in cascade.selectors:
+            try:
+                compile_locator(by, value)(snapshot.store)
+            except LocatorUnsupported:
+                pass
+
+
+@pytest.mark.parametrize("value", [
+    '//android.widget.TextView[@resource-id="cn.damai:id/channel_title"][last()]',
+    '//android.widget.TextView[@resource-id="cn.damai:id/channel_title"][position() > 3]',
+    '(//android.widget.TextView[@resource-id="cn.damai:id/item_title"])[1]',
+])
+def test_unsupported_xpath_is_deferred(value):
+    """本地不支持的写法必须抛出 LocatorUnsupported，不能返回与设备不同的结果"""
+    with pytest.raises(LocatorUnsupported):
+        compile_locator(XPATH, value)
+
+
+def _changed(screen, old, new):
+    before = load(screen, NodeStore)
+    source = before.source.replace(old, new, 1)
+    assert source != before.source
+    return before, Snapshot.from_source(source, previous=before)
+
+
+def test_subtree_unchanged_when_change_is_elsewhere():
+    """变化在其他票档内时，第一个票档的子树视为未变化"""
+    before, after = _changed("tier", 'text="缺货登记"', 'text="已售罄"')
+    assert not after.unchanged_since(before.serial)
+    assert after.unchanged_since(before.serial, "[40,1120][530,1280]")
+    assert not after.unchanged_since(before.serial, "[550,1300][1040,1460]")
+
+
+def test_subtree_changed_when_node_or_child_changes():
+    """节点自身或子节点的属性变化都算子树变化"""
+    before, after = _changed("tier", 'selected="false" bounds="[40,1120][530,1280]"',
+                             'selected="true" bounds="[40,1120][530,1280]"')
+    assert not after.unchanged_since(before.serial, "[40,1120][530,1280]")
+    assert after.unchanged_since(before.serial, "[550,1120][1040,1280]")
+    before, after = _changed("tier", 'text="399元"', 'text="399元 已选"')
+    assert not after.unchanged_since(before.serial, "[40,1120][530,1280]")
@@ -0,0 +1,217 @@
+# -*- coding: UTF-8 -*-
+"""
+Appium 客户端的 HTTP 传输调优：
+
+- 长连接池按并发查询数（async_driver.MAX_CONCURRENT_QUERIES）设置大小，
+  并发探测的每条在途请求各占一条连接；池满时不阻塞、不丢弃连接
+- 套接字开启 TCP_NODELAY（小请求不等 Nagle 合并）与 SO_KEEPALIVE
+- 忽略 HTTP(S)_PROXY 环境变量，本机/局域网的 Appium 服务器不经代理
+- 失败不做 urllib3 的自动重试，由上层的选择器级联与会话恢复处理
+- 每条命令记录往返耗时，按命令汇总延迟直方图
+
+直接运行本文件可对照本地替身 HTTP 服务器测量每条命令的客户端开销
+"""
+
+import argparse
+import bisect
+import json
+import os
+import socket
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import urllib3
+from appium.webdriver.appium_connection import AppiumConnection
+from appium.webdriver.client_config import AppiumClientConfig
+
+from async_driver import MAX_CONCURRENT_QUERIES
+from logger import log
+
+
+# 直方图桶上界（毫秒），最后一个桶收纳更大的值
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+SOCKET_OPTIONS = [
+    (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+    (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+]
+
+
+class LatencyHistogram:
+    """按命令统计往返耗时的直方图"""
+
+    def __init__(self, buckets_ms=BUCKETS_MS):
+        self.buckets_ms = list(buckets_ms)
+        self.counts = defaultdict(lambda: [0] * (len(self.buckets_ms) + 1))
+        self.totals = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def record(self, command, seconds):
+        ms = seconds * 1000
+        index = bisect.bisect_left(self.buckets_ms, ms)
+        with self._lock:
+            self.counts[command][index] += 1
+            self.totals[command] += ms
+
+    def reset(self):
+        with self._lock:
+            self.counts.clear()
+            self.totals.clear()
+
+    def percentile(self, command, p):
+        """按桶估计第 p 百分位数（返回所在桶的上界，毫秒）"""
+        counts = self.counts.get(command)
+        if not counts:
+            return None
+        target = sum(counts) * p / 100
+        seen = 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= target:
+                return self.buckets_ms[index] if index < len(self.buckets_ms) else float('inf')
+        return float('inf')
+
+    def summary(self):
+        """{命令: {count, mean_ms, p50_ms, p95_ms, p99_ms}}，p 值为桶上界"""
+        result = {}
+        for command, counts in self.counts.items():
+            n = sum(counts)
+            result[command] = {
+                "count": n,
+                "mean_ms": round(self.totals[command] / n, 2),
+                "p50_ms": self.percentile(command, 50),
+                "p95_ms": self.percentile(command, 95),
+                "p99_ms": self.percentile(command, 99),
+            }
+        return result
+
+    def log_summary(self):
+        for command, stats in sorted(self.summary().items(), key=lambda item: -item[1]["count"]):
+            log.info(f"命令 {command}: {stats['count']} 次，平均 {stats['mean_ms']} ms，"
+                     f"p50≤{stats['p50_ms']} ms，p95≤{stats['p95_ms']} ms")
+
+
+HISTOGRAM = LatencyHistogram()
+
+
+class TunedConnection(AppiumConnection):
+    """调优后的 Appium 连接
+
+    参数:
+        server_url: Appium 服务器地址
+        pool_size: 每个主机保留的长连接数，默认等于 DriverLoop 同时在途的查询数
+        timeout: 单个请求的超时（秒）
+        histogram: 记录每条命令耗时的直方图，为 None 不记录
+    """
+
+    def __init__(self, server_url, pool_size=MAX_CONCURRENT_QUERIES, timeout=30, histogram=HISTOGRAM):
+        self.pool_size = pool_size
+        self.histogram = histogram
+        client_config = AppiumClientConfig(remote_server_addr=server_url, keep_alive=True, timeout=timeout)
+        super().__init__(client_config=client_config, ignore_proxy=True)
+
+    def _get_connection_manager(self):
+        return urllib3.PoolManager(
+            num_pools=2,
+            maxsize=self.pool_size,
+            block=False,
+            retries=False,
+            timeout=self._client_config.timeout,
+            socket_options=SOCKET_OPTIONS,
+        )
+
+    def execute(self, command, params):
+        if self.histogram is None:
+            return super().execute(command, params)
+        start = time.perf_counter()
+        try:
+            return super().execute(command, params)
+        finally:
+            self.histogram.record(command, time.perf_counter() - start)
+
+
+# ---- 替身服务器与基准 ----
+
+class _StubHandler(BaseHTTPRequestHandler):
+    """按 WebDriver 格式应答的替身，响应一次写出，可设定服务端延迟"""
+
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    body = json.dumps({"value": "<hierarchy/>"}).encode('utf-8')
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        if self.latency:
+            time.sleep(self.latency)
+        self.wfile.write(b"HTTP/1.1 200 OK\r\n"
+                         b"Content-Type: application/json; charset=utf-8\r\n"
+                         b"Content-Length: " + str(len(self.body)).encode('ascii') + b"\r\n\r\n" + self.body)
+
+    do_GET = _reply
+    do_POST = _reply
+
+
+def start_stub_server(latency=0.0):
+    """启动本地替身 HTTP 服务器，返回 (server, url)"""
+    handler = type("StubHandler", (_StubHandler,), {"latency": latency})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="StubServer", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def measure(connection, requests, command="getPageSource"):
+    """连续发送 requests 条命令，返回每条耗时（毫秒）列表"""
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        connection.execute(command, {"sessionId": "stub"})
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def _stats(samples):
+    ordered = sorted(samples)
+    return {"mean_ms": round(sum(ordered) / len(ordered), 3),
+            "p50_ms": round(ordered[len(ordered) // 2], 3),
+            "p95_ms": round(ordered[int(len(ordered) * 0.95) - 1], 3)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Appium 传输调优基准：对照本地替身服务器测量每条命令的客户端开销")
+    parser.add_argument("--requests", type=int, default=500, help="每种连接发送的命令数")
+    parser.add_argument("--latency-ms", type=float, default=0, help="替身服务器的应答延迟（毫秒）")
+    args = parser.parse_args()
+
+    import logger
+    server, url = start_stub_server(args.latency_ms / 1000)
+    variants = [
+        ("默认连接（每条命令新建连接）", lambda: AppiumConnection(
+            client_config=AppiumClientConfig(remote_server_addr=url, keep_alive=False))),
+        ("默认长连接", lambda: AppiumConnection(client_config=AppiumClientConfig(remote_server_addr=url))),
+        ("调优连接", lambda: TunedConnection(url, histogram=None)),
+    ]
+    print(f"代理环境变量: {'有' if os.environ.get('HTTP_PROXY') or os.environ.get('http_proxy') else '无'}")
+    results = {}
+    for name, factory in variants:
+        connection = factory()
+        try:
+            measure(connection, 20)
+            results[name] = _stats(measure(connection, args.requests))
+        except Exception as e:
+            # 默认连接会按环境变量走代理，本机服务器可能因此不可达
+            print(f"{name}: 失败 {type(e).__name__}: {str(e)[:120]}")
+            continue
+        print(f"{name}: {results[name]}")
+    base = results.get(variants[1][0])
+    tuned = results.get(variants[2][0])
+    if base and tuned:
+        print(f"调优连接相对默认长连接每条命令节省 {base['mean_ms'] - tuned['mean_ms']:.3f} ms")
+    server.shutdown()
+    logger.flush()
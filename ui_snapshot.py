@@ -0,0 +1,817 @@
+# -*- coding: UTF-8 -*-
+"""
+页面层级快照：一次拉取 page_source，在本地解析并求值 XPath / UiSelector，
+按计算出的 bounds 坐标点击，把 N 次设备往返压缩为一次。
+
+相邻两次拉取的层级按行比较（UiAutomator2 每个节点占一行）：源码相同时复用上一次的解析结果，
+不同时记录变化的行区间，页面识别与等待条件据此只处理变化的子树。
+
+树在第一次按结构查询时才解析，默认存为紧凑节点（见 node_store.py）；只需少数属性时（屏幕尺寸、某个 bounds 处的勾选状态）
+用 stream_nodes 流式读取，找到即停止
+"""
+
+import itertools
+import re
+import time
+from functools import lru_cache
+from xml.parsers import expat
+
+from node_store import NodeStore
+
+
+class LocatorUnsupported(Exception):
+    """定位语句超出本地求值支持的语法，需要回退到设备端查询"""
+
+
+_BOUNDS_RE = re.compile(r'\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]')
+
+
+def parse_bounds(value):
+    """解析 "[x1,y1][x2,y2]"，失败返回 None"""
+    m = _BOUNDS_RE.match(value or "")
+    return tuple(int(v) for v in m.groups()) if m else None
+
+
+def rect_center(rect):
+    """WebElement.rect 风格的 {'x', 'y', 'width', 'height'} 的中心坐标"""
+    return rect['x'] + rect['width'] // 2, rect['y'] + rect['height'] // 2
+
+
+def rect_bounds(rect):
+    """WebElement.rect 换算为层级中的 bounds 字符串，如 [x1,y1][x2,y2]"""
+    return f"[{rect['x']},{rect['y']}][{rect['x'] + rect['width']},{rect['y'] + rect['height']}]"
+
+
+# 流式读取时每次交给解析器的字符数
+STREAM_CHUNK = 16384
+
+
+def stream_nodes(source, chunk_size=STREAM_CHUNK):
+    """SAX 风格的层级读取：逐个产出节点的 (文档序号, 深度, 标签, 属性字典)，不建树
+
+    source 为源码字符串，或依次到达的源码片段（str/bytes）的可迭代对象。
+    按片段喂给 expat，每读完一个片段产出其中的节点；消费方停止迭代即停止解析，剩余源码不再处理。
+    文档序号与 Snapshot.order 一致（根节点为 0）
+    """
+    chunks = source
+    if isinstance(source, (str, bytes)):
+        chunks = (source[i:i + chunk_size] for i in range(0, len(source), chunk_size))
+    parser = expat.ParserCreate()
+    pending = []
+    count = depth = 0
+
+    def start(tag, attrs):
+        nonlocal count, depth
+        pending.append((count, depth, tag, attrs))
+        count += 1
+        depth += 1
+
+    def end(tag):
+        nonlocal depth
+        depth -= 1
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    for chunk in chunks:
+        parser.Parse(chunk, False)
+        if pending:
+            batch = pending[:]
+            pending.clear()
+            yield from batch
+    parser.Parse(b"", True)
+    yield from pending
+
+
+_SERIALS = itertools.count(1)
+
+
+class HierarchyDiff:
+    """两份快照之间的差异：去掉首尾相同的行后剩下的变化区间
+
+    参数:
+        base_serial: 旧快照的序号
+        start: 变化区间的起始行（新旧相同）
+        old_end / new_end: 变化区间在旧 / 新快照中的结束行（不含）
+        removed / added: 旧 / 新快照中变化区间的文本
+    """
+
+    __slots__ = ("base_serial", "start", "old_end", "new_end", "removed", "added")
+
+    def __init__(self, base_serial, start, old_end, new_end, removed="", added=""):
+        self.base_serial = base_serial
+        self.start = start
+        self.old_end = old_end
+        self.new_end = new_end
+        self.removed = removed
+        self.added = added
+
+    @classmethod
+    def between(cls, old, new):
+        a, b = old.lines, new.lines
+        n = min(len(a), len(b))
+        start = 0
+        while start < n and a[start] == b[start]:
+            start += 1
+        end = 0
+        while end < n - start and a[-1 - end] == b[-1 - end]:
+            end += 1
+        old_end, new_end = len(a) - end, len(b) - end
+        return cls(old.serial, start, old_end, new_end, "\n".join(a[start:old_end]), "\n".join(b[start:new_end]))
+
+    @property
+    def empty(self):
+        return self.start == self.old_end == self.new_end
+
+    def touches(self, first, last):
+        """变化区间是否落在新快照的第 first 至 last 行（一个节点的子树）之内"""
+        if self.empty:
+            return False
+        if self.new_end == self.start:
+            # 只有删除：删除点位于 start 行之前
+            return first < self.start <= last
+        return first < self.new_end and self.start <= last
+
+
+class Snapshot:
+    """一次 page_source 的本地解析结果
+
+    同时是定位求值所需的树访问接口：children/parent/tag/attr/order
+    """
+
+    def __init__(self, source, store=NodeStore):
+        self.source = source
+        self.serial = next(_SERIALS)
+        self.taken_at = time.monotonic()
+        self.stale = False
+        # 与上一份快照的差异，没有上一份时为 None
+        self.diff = None
+        self._lines = None
+        self._spans = None
+        self._size = None
+        # 树在第一次按结构访问时才解析：只做页面识别、按 bounds 读属性的快照不建树
+        self._store_class = store
+        self._store = None
+
+    @property
+    def store(self):
+        """节点存储（见 node_store.py），第一次访问时解析"""
+        if self._store is None:
+            self._store = self._store_class(self.source)
+        return self._store
+
+    @property
+    def root(self):
+        return self.store.root
+
+    @property
+    def document(self):
+        return self.store.document
+
+    @property
+    def parsed(self):
+        """是否已建树"""
+        return self._store is not None
+
+    @classmethod
+    def capture(cls, driver, previous=None):
+        """从设备拉取一次快照（一次往返），见 from_source"""
+        return cls.from_source(driver.page_source, previous)
+
+    @classmethod
+    def from_source(cls, source, previous=None):
+        """由已取得的层级源码生成快照
+
+        源码与 previous 相同时不再解析，刷新并返回 previous；不同时记录与 previous 的差异
+        """
+        if previous is not None and source == previous.source:
+            previous.refresh()
+            return previous
+        snapshot = cls(source)
+        if previous is not None:
+            snapshot.diff = HierarchyDiff.between(previous, snapshot)
+        return snapshot
+
+    def refresh(self):
+        """设备上的层级与本快照相同：重新计时，差异为空"""
+        self.taken_at = time.monotonic()
+        self.stale = False
+        self.diff = HierarchyDiff(self.serial, 0, 0, 0)
+
+    def age(self):
+        return time.monotonic() - self.taken_at
+
+    def is_fresh(self, max_age):
+        return not self.stale and self.age() <= max_age
+
+    # ---- 差异 ----
+    @property
+    def lines(self):
+        if self._lines is None:
+            self._lines = self.source.splitlines()
+        return self._lines
+
+    def line_spans(self):
+        """按文档顺序每个节点在源码中占的 [起始行, 结束行]；源码不是每个节点一行的格式时返回 None"""
+        if self._spans is None:
+            self._spans = self._scan_spans() or False
+        return self._spans or None
+
+    def _scan_spans(self):
+        spans, stack = [], []
+        for i, line in enumerate(self.lines):
+            text = line.strip()
+            if not text.startswith('<') or text.startswith(('<?', '<!')):
+                continue
+            if text.startswith('</'):
+                if not stack:
+                    return None
+                spans[stack.pop()][1] = i
+                continue
+            spans.append([i, i])
+            if not text.endswith('/>') and '</' not in text:
+                stack.append(len(spans) - 1)
+            if text.count('<') > (2 if '</' in text else 1):
+                # 一行有多个节点
+                return None
+        return spans if not stack else None
+
+    def changed_at(self, bounds):
+        """bounds（"[x1,y1][x2,y2]"）处第一个节点的子树相对上一份快照是否有变化；无法判定时返回 True
+
+        按源码行定位子树，不建树
+        """
+        if self.diff is None:
+            return True
+        if self.diff.empty:
+            return False
+        spans = self.line_spans()
+        if spans is None:
+            return True
+        needle = f'bounds="{bounds}"'
+        for first, last in spans:
+            if needle in self.lines[first]:
+                return self.diff.touches(first, last)
+        return True
+
+    def unchanged_since(self, serial, bounds=None):
+        """自序号为 serial 的快照以来，整个层级（或 bounds 处节点的子树）没有变化"""
+        if self.serial == serial:
+            return True
+        if self.diff is None or self.diff.base_serial != serial:
+            return False
+        return self.diff.empty if bounds is None else not self.changed_at(bounds)
+
+    # ---- 树访问接口 ----
+    def children(self, node):
+        return self.store.children(node)
+
+    def parent(self, node):
+        return self.store.parent(node)
+
+    def tag(self, node):
+        return self.store.tag(node)
+
+    def attr(self, node, name):
+        return self.store.attr(node, name)
+
+    def order(self, node):
+        return self.store.order(node)
+
+    def descendants(self, node):
+        return self.store.descendants(node)
+
+    # ---- 查询 ----
+    def find(self, by, value):
+        """按 Appium 定位方式在本地求值，返回按文档顺序排列的节点列表"""
+        return compile_locator(by, value)(self)
+
+    def bounds(self, node):
+        return parse_bounds(self.attr(node, 'bounds'))
+
+    def center(self, node):
+        b = self.bounds(node)
+        if not b:
+            return None
+        return (b[0] + b[2]) // 2, (b[1] + b[3]) // 2
+
+    def nodes_at(self, bounds):
+        """bounds 属性等于给定字符串的节点"""
+        return self.store.nodes_at(bounds)
+
+    def screen_size(self):
+        """层级根节点上的屏幕宽高（UiAutomator2 的 hierarchy 带 width/height），没有时返回 None
+
+        未建树时只流式读取根节点
+        """
+        if self._size is None:
+            attrs = self.store.attrs(self.root) if self.parsed else next(iter(self.stream()), (0, 0, '', {}))[3]
+            try:
+                self._size = {'width': int(attrs.get('width')), 'height': int(attrs.get('height'))}
+            except (TypeError, ValueError):
+                self._size = False
+        return self._size or None
+
+    # ---- 流式读取 ----
+    def stream(self):
+        """逐个产出节点的 (文档序号, 深度, 标签, 属性)，不建树，见 stream_nodes"""
+        return stream_nodes(self.source)
+
+    def attrs_at(self, bounds):
+        """bounds 集合中各值处第一个节点的属性，返回 {bounds: 属性字典}
+
+        已建树时查索引；否则流式读取，全部找到即停止
+        """
+        # 源码中没有出现的 bounds 不必读取
+        wanted = {b for b in bounds if f'bounds="{b}"' in self.source}
+        if not wanted:
+            return {}
+        if self.parsed:
+            return {b: self.store.attrs(nodes[0]) for b in wanted for nodes in [self.nodes_at(b)] if nodes}
+        found = {}
+        for _, _, _, attrs in self.stream():
+            value = attrs.get('bounds')
+            if value in wanted and value not in found:
+                found[value] = attrs
+                if len(found) == len(wanted):
+                    break
+        return found
+
+    def subtree_any(self, bounds, predicate):
+        """bounds 处节点（含其子树）中是否有属性满足 predicate 的节点
+
+        已建树时查索引；否则流式读取，读完第一个匹配节点的子树即停止
+        """
+        if f'bounds="{bounds}"' not in self.source:
+            return False
+        if self.parsed:
+            store = self.store
+            return any(predicate(store.attrs(item)) for node in self.nodes_at(bounds) for item in store.subtree(node))
+        inside = None
+        for _, depth, _, attrs in self.stream():
+            if inside is not None and depth <= inside:
+                return False
+            if inside is None and attrs.get('bounds') != bounds:
+                continue
+            if inside is None:
+                inside = depth
+            if predicate(attrs):
+                return True
+        return False
+
+
+class LocalElement:
+    """快照中的节点，提供与 WebElement 相近的只读属性，点击按 bounds 中心坐标执行"""
+
+    id = None
+
+    def __init__(self, driver, snapshot, node):
+        self._driver = driver
+        self._snapshot = snapshot
+        self._node = node
+
+    @property
+    def tag_name(self):
+        return self._snapshot.attr(self._node, 'class') or self._snapshot.tag(self._node)
+
+    @property
+    def text(self):
+        return self._snapshot.attr(self._node, 'text') or ""
+
+    @property
+    def rect(self):
+        x1, y1, x2, y2 = self._snapshot.bounds(self._node) or (0, 0, 0, 0)
+        return {'x': x1, 'y': y1, 'width': x2 - x1, 'height': y2 - y1}
+
+    @property
+    def location(self):
+        rect = self.rect
+        return {'x': rect['x'], 'y': rect['y']}
+
+    @property
+    def size(self):
+        rect = self.rect
+        return {'width': rect['width'], 'height': rect['height']}
+
+    def get_attribute(self, name):
+        return self._snapshot.attr(self._node, name)
+
+    def click(self):
+        x, y = self._snapshot.center(self._node)
+        self._driver.execute_script('mobile: clickGesture', {'x': x, 'y': y})
+        # 点击后页面可能变化，快照作废
+        self._snapshot.stale = True
+
+
+def _sorted_unique(tree, nodes):
+    seen = {}
+    for node in nodes:
+        seen.setdefault(id(node), node)
+    return sorted(seen.values(), key=tree.order)
+
+
+# ---------------------------------------------------------------------------
+# XPath 子集：位置路径、常用轴、谓词（位置、比较、and/or/not、
+# contains/starts-with/ends-with/matches、嵌套相对路径）以及 "|" 并集
+# ---------------------------------------------------------------------------
+
+_TOKEN_RE = re.compile(r'''
+    \s*(?:
+      (?P<str>"[^"]*"|'[^']*')
+    | (?P<num>\d+)
+    | (?P<op>//|::|!=|\.\.|[/\[\]()|,=@*.])
+    | (?P<name>[A-Za-z_][\w.\-]*)
+    )''', re.X)
+
+_AXES = {'child', 'parent', 'self', 'descendant', 'descendant-or-self',
+         'ancestor', 'following-sibling', 'preceding-sibling'}
+
+
+def _tokenize(expr):
+    tokens, pos = [], 0
+    expr = expr.strip()
+    while pos < len(expr):
+        m = _TOKEN_RE.match(expr, pos)
+        if not m or m.end() == pos:
+            raise LocatorUnsupported(f"无法解析的XPath片段: {expr[pos:]}")
+        pos = m.end()
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == 'str':
+            value = value[1:-1]
+        elif kind == 'name' and value.endswith('.'):
+            raise LocatorUnsupported(f"无法解析的名称: {value}")
+        tokens.append((kind, value))
+    return tokens
+
+
+class _XPathParser:
+    def __init__(self, expr):
+        self.tokens = _tokenize(expr)
+        self.pos = 0
+
+    def peek(self, offset=0):
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        kind, token = self.peek()
+        if value is not None and token != value:
+            raise LocatorUnsupported(f"期望 {value}，实际 {token}")
+        self.pos += 1
+        return kind, token
+
+    def parse(self):
+        paths = [self.path()]
+        while self.peek()[1] == '|':
+            self.take('|')
+            paths.append(self.path())
+        if self.peek()[0] is not None:
+            raise LocatorUnsupported(f"多余的XPath片段: {self.peek()[1]}")
+
+        def evaluate(tree, context=None):
+            result = []
+            for path in paths:
+                result.extend(path(tree, context))
+            return _sorted_unique(tree, result)
+        return evaluate
+
+    def path(self):
+        """返回 path(tree, context) -> 节点列表；绝对路径忽略 context"""
+        absolute = self.peek()[1] in ('/', '//')
+        steps = []
+        if not absolute:
+            steps.append(self.step())
+        while self.peek()[1] in ('/', '//'):
+            _, sep = self.take()
+            if sep == '//':
+                steps.append(('descendant-or-self', None, []))
+            steps.append(self.step())
+
+        def evaluate(tree, context=None):
+            nodes = [tree.document] if absolute or context is None else [context]
+            for step in steps:
+                nodes = _apply_step(tree, nodes, step)
+            return nodes
+        return evaluate
+
+    def step(self):
+        kind, token = self.peek()
+        if token == '.':
+            self.take()
+            return ('self', None, self.predicates())
+        if token == '..':
+            self.take()
+            return ('parent', None, self.predicates())
+        axis = 'child'
+        if token == '@':
+            raise LocatorUnsupported("不支持选取属性节点")
+        if kind == 'name' and self.peek(1)[1] == '::':
+            if token not in _AXES:
+                raise LocatorUnsupported(f"不支持的轴: {token}")
+            axis = token
+            self.take()
+            self.take('::')
+            kind, token = self.peek()
+        if token == '*':
+            self.take()
+            name = '*'
+        elif kind == 'name':
+            self.take()
+            name = token
+            if self.peek()[1] == '(':
+                # node() 之类的节点测试
+                if name != 'node':
+                    raise LocatorUnsupported(f"不支持的节点测试: {name}()")
+                self.take('(')
+                self.take(')')
+                name = None
+        else:
+            raise LocatorUnsupported(f"期望节点名，实际 {token}")
+        return (axis, name, self.predicates())
+
+    def predicates(self):
+        result = []
+        while self.peek()[1] == '[':
+            self.take('[')
+            result.append(self.or_expr())
+            self.take(']')
+        return result
+
+    def or_expr(self):
+        parts = [self.and_expr()]
+        while self.peek() == ('name', 'or'):
+            self.take()
+            parts.append(self.and_expr())
+        if len(parts) == 1:
+            return parts[0]
+        return ('bool', lambda tree, node, pos: any(_truth(p, tree, node, pos) for p in parts))
+
+    def and_expr(self):
+        parts = [self.comparison()]
+        while self.peek() == ('name', 'and'):
+            self.take()
+            parts.append(self.comparison())
+        if len(parts) == 1:
+            return parts[0]
+        return ('bool', lambda tree, node, pos: all(_truth(p, tree, node, pos) for p in parts))
+
+    def comparison(self):
+        left = self.primary()
+        if self.peek()[1] in ('=', '!='):
+            _, op = self.take()
+            right = self.primary()
+
+            def compare(tree, node, pos):
+                lv, rv = _values(left, tree, node), _values(right, tree, node)
+                if op == '=':
+                    return any(a == b for a in lv for b in rv)
+                return any(a != b for a in lv for b in rv)
+            return ('bool', compare)
+        return left
+
+    def primary(self):
+        kind, token = self.peek()
+        if kind == 'str':
+            self.take()
+            return ('value', lambda tree, node, v=token: [v])
+        if kind == 'num':
+            self.take()
+            return ('position', int(token))
+        if token == '@':
+            self.take()
+            _, attr = self.take()
+            return ('value', lambda tree, node, a=attr: [] if tree.attr(node, a) is None else [tree.attr(node, a)])
+        if token == '(':
+            self.take('(')
+            inner = self.or_expr()
+            self.take(')')
+            return inner
+        if kind == 'name' and self.peek(1)[1] == '(' and token not in ('node',):
+            return self.function()
+        # 嵌套相对路径，作为存在性判断
+        path = self.path()
+        return ('bool', lambda tree, node, pos: bool(path(tree, node)))
+
+    def function(self):
+        _, name = self.take()
+        self.take('(')
+        args = []
+        while self.peek()[1] != ')':
+            args.append(self.or_expr())
+            if self.peek()[1] == ',':
+                self.take(',')
+        self.take(')')
+        if name == 'not' and len(args) == 1:
+            return ('bool', lambda tree, node, pos: not _truth(args[0], tree, node, pos))
+        if name == 'text' and not args:
+            # uiautomator2 的层级 XML 没有文本节点，文本存放在 @text 中
+            return ('value', lambda tree, node: [] if tree.attr(node, 'text') is None else [tree.attr(node, 'text')])
+        tests = {
+            'contains': lambda s, p: p in s,
+            'starts-with': lambda s, p: s.startswith(p),
+            'ends-with': lambda s, p: s.endswith(p),
+            'matches': lambda s, p: re.search(p, s) is not None,
+        }
+        if name not in tests or len(args) != 2:
+            raise LocatorUnsupported(f"不支持的函数: {name}")
+        test = tests[name]
+
+        def call(tree, node, pos):
+            haystack = _values(args[0], tree, node)
+            needle = _values(args[1], tree, node)
+            return test(haystack[0] if haystack else "", needle[0] if needle else "")
+        return ('bool', call)
+
+
+def _values(expr, tree, node):
+    if expr[0] == 'value':
+        return expr[1](tree, node)
+    if expr[0] == 'position':
+        return [str(expr[1])]
+    raise LocatorUnsupported("比较运算只支持属性与字面量")
+
+
+def _truth(expr, tree, node, pos):
+    kind = expr[0]
+    if kind == 'bool':
+        return expr[1](tree, node, pos)
+    if kind == 'position':
+        return pos == expr[1]
+    return bool(expr[1](tree, node))
+
+
+def _axis_nodes(tree, node, axis):
+    if axis == 'child':
+        return tree.children(node)
+    if axis == 'parent':
+        parent = tree.parent(node)
+        return [parent] if parent is not None else []
+    if axis == 'self':
+        return [node]
+    if axis == 'descendant':
+        return tree.descendants(node)
+    if axis == 'descendant-or-self':
+        return [node] + tree.descendants(node)
+    if axis == 'ancestor':
+        result, parent = [], tree.parent(node)
+        while parent is not None:
+            result.append(parent)
+            parent = tree.parent(parent)
+        return result
+    parent = tree.parent(node)
+    siblings = tree.children(parent) if parent is not None else [node]
+    index = next(i for i, s in enumerate(siblings) if s is node)
+    if axis == 'following-sibling':
+        return siblings[index + 1:]
+    return list(reversed(siblings[:index]))
+
+
+def _apply_step(tree, nodes, step):
+    axis, name, predicates = step
+    result = []
+    for node in nodes:
+        candidates = [n for n in _axis_nodes(tree, node, axis)
+                      if name is None
+                      or (name == '*' and n is not tree.document)
+                      or tree.tag(n) == name]
+        for predicate in predicates:
+            candidates = [n for pos, n in enumerate(candidates, 1) if _truth(predicate, tree, n, pos)]
+        result.extend(candidates)
+    return _sorted_unique(tree, result)
+
+
+# ---------------------------------------------------------------------------
+# UiSelector 子集
+# ---------------------------------------------------------------------------
+
+_UI_TOKEN_RE = re.compile(r'\s*(?:(?P<str>"(?:[^"\\]|\\.)*")|(?P<num>-?\d+)|(?P<name>[A-Za-z_]\w*)|(?P<op>[().;]))')
+
+_UI_ATTR_TESTS = {
+    'text': ('text', lambda v, a: v == a),
+    'textContains': ('text', lambda v, a: a in v),
+    'textStartsWith': ('text', lambda v, a: v.startswith(a)),
+    'textMatches': ('text', lambda v, a: re.fullmatch(a, v, re.S) is not None),
+    'description': ('content-desc', lambda v, a: v == a),
+    'descriptionContains': ('content-desc', lambda v, a: a in v),
+    'descriptionStartsWith': ('content-desc', lambda v, a: v.startswith(a)),
+    'descriptionMatches': ('content-desc', lambda v, a: re.fullmatch(a, v, re.S) is not None),
+    'resourceId': ('resource-id', lambda v, a: v == a),
+    'resourceIdMatches': ('resource-id', lambda v, a: re.fullmatch(a, v, re.S) is not None),
+    'className': ('class', lambda v, a: v == a),
+    'classNameMatches': ('class', lambda v, a: re.fullmatch(a, v, re.S) is not None),
+    'packageName': ('package', lambda v, a: v == a),
+    'index': ('index', lambda v, a: v == str(a)),
+}
+_UI_FLAGS = {'checkable', 'checked', 'clickable', 'enabled', 'focusable', 'focused',
+             'longClickable', 'scrollable', 'selected'}
+_UI_FLAG_ATTRS = {'longClickable': 'long-clickable'}
+
+
+def _parse_uiselector(expr):
+    tokens, pos = [], 0
+    expr = expr.strip()
+    while pos < len(expr):
+        m = _UI_TOKEN_RE.match(expr, pos)
+        if not m or m.end() == pos:
+            raise LocatorUnsupported(f"无法解析的UiSelector片段: {expr[pos:]}")
+        pos = m.end()
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == 'str':
+            value = re.sub(r'\\(.)', r'\1', value[1:-1])
+        elif kind == 'num':
+            value = int(value)
+        tokens.append((kind, value))
+    tokens = [t for t in tokens if t != ('op', ';')]
+    selector, end = _parse_selector_chain(tokens, 0)
+    if end != len(tokens):
+        raise LocatorUnsupported("UiSelector 末尾存在多余内容")
+    return selector
+
+
+def _parse_selector_chain(tokens, i):
+    if tokens[i:i + 4] != [('name', 'new'), ('name', 'UiSelector'), ('op', '('), ('op', ')')]:
+        raise LocatorUnsupported("只支持 new UiSelector() 形式")
+    i += 4
+    filters, instance, child, parent_sel = [], None, None, None
+    while i < len(tokens) and tokens[i] == ('op', '.'):
+        method = tokens[i + 1][1]
+        if tokens[i + 2] != ('op', '('):
+            raise LocatorUnsupported(f"期望 ( : {method}")
+        i += 3
+        if tokens[i] == ('name', 'new'):
+            arg, i = _parse_selector_chain(tokens, i)
+        else:
+            kind, arg = tokens[i]
+            if kind == 'name':
+                if arg not in ('true', 'false'):
+                    raise LocatorUnsupported(f"不支持的参数: {arg}")
+                arg = arg == 'true'
+            i += 1
+        if tokens[i] != ('op', ')'):
+            raise LocatorUnsupported(f"期望 ) : {method}")
+        i += 1
+        if method in _UI_ATTR_TESTS:
+            attr, test = _UI_ATTR_TESTS[method]
+            filters.append((attr, test, arg))
+        elif method in _UI_FLAGS:
+            attr = _UI_FLAG_ATTRS.get(method, method)
+            filters.append((attr, lambda v, a: v == ('true' if a else 'false'), arg))
+        elif method == 'instance':
+            instance = arg
+        elif method == 'childSelector':
+            child = arg
+        elif method == 'fromParent':
+            parent_sel = arg
+        else:
+            raise LocatorUnsupported(f"不支持的UiSelector方法: {method}")
+    return (filters, instance, child, parent_sel), i
+
+
+def _match_uiselector(tree, selector, scope):
+    filters, instance, child, parent_sel = selector
+    matched = []
+    for node in scope:
+        if all(test(tree.attr(node, attr) or "", arg) for attr, test, arg in filters):
+            matched.append(node)
+    if instance is not None:
+        matched = matched[instance:instance + 1]
+    if child is not None:
+        result = []
+        for node in matched:
+            result.extend(_match_uiselector(tree, child, tree.descendants(node)))
+        matched = result
+    if parent_sel is not None:
+        result = []
+        for node in matched:
+            parent = tree.parent(node)
+            if parent is not None:
+                result.extend(_match_uiselector(tree, parent_sel, tree.descendants(parent)))
+        matched = result
+    return _sorted_unique(tree, matched)
+
+
+# ---------------------------------------------------------------------------
+# 定位方式分派
+# ---------------------------------------------------------------------------
+
+@lru_cache(maxsize=512)
+def compile_locator(by, value):
+    """把 (by, value) 编译为 evaluate(tree) -> 节点列表，不支持时抛出 LocatorUnsupported"""
+    if by == 'xpath':
+        xpath = _XPathParser(value).parse()
+        return lambda tree: xpath(tree)
+    if by == '-android uiautomator':
+        selector = _parse_uiselector(value)
+        return lambda tree: _match_uiselector(tree, selector, tree.descendants(tree.document))
+    if by == 'id':
+        def by_id(tree):
+            return [n for n in tree.descendants(tree.document)
+                    if (tree.attr(n, 'resource-id') or "") == value
+                    or (tree.attr(n, 'resource-id') or "").endswith(f":id/{value}")]
+        return by_id
+    if by == 'class name':
+        return lambda tree: [n for n in tree.descendants(tree.document) if tree.attr(n, 'class') == value]
+    if by == 'accessibility id':
+        return lambda tree: [n for n in tree.descendants(tree.document) if tree.attr(n, 'content-desc') == value]
+    raise LocatorUnsupported(f"不支持本地求值的定位方式: {by}")
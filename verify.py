@@ -0,0 +1,93 @@
+# -*- coding: UTF-8 -*-
+"""
+关键点击的校验：每个关键动作声明点击后应成立的条件（离开当前页面、票档被选中等），
+点击后用廉价的探测确认——一份页面层级，随后的页面识别直接复用，不额外往返。
+条件未成立时立即点击下一个候选，而不是等下游超时后才发现点错；无效点击按动作计数。
+只有确认仍停留在原处时才改点下一个候选（页面切换较慢时不会在下一个页面上盲点），
+一个动作的全部重试受总时长上限约束
+"""
+
+import time
+from collections import Counter
+
+from instrumentation import TRACER
+from logger import log
+
+
+# 一个动作所有候选的点击与等待合计不超过该时长（秒）
+MAX_RETRY_SECONDS = 20.0
+
+
+class TapMetrics:
+    """各关键动作的点击次数与无效点击次数"""
+
+    def __init__(self):
+        self.taps = Counter()
+        self.wasted = Counter()
+
+    def record(self, action, effective, count=1):
+        if count <= 0:
+            return
+        self.taps[action] += count
+        if not effective:
+            self.wasted[action] += count
+
+    @property
+    def total_wasted(self):
+        return sum(self.wasted.values())
+
+    def summary(self):
+        """{动作: {"taps": 点击次数, "wasted": 无效次数}}"""
+        return {action: {"taps": n, "wasted": self.wasted[action]} for action, n in self.taps.items()}
+
+    def log_summary(self):
+        for action, stats in self.summary().items():
+            log.info(f"点击 {action}: {stats['taps']} 次，无效 {stats['wasted']} 次")
+
+
+def verified_tap(bot, action, candidates, tap, postcondition, timeout, retry_if=None,
+                 budget=MAX_RETRY_SECONDS):
+    """依次点击候选，直到点击后的条件成立
+
+    参数:
+        bot: 提供 wait_for / invalidate_snapshot / tap_metrics 的 DamaiBot
+        action: 动作名称，用于日志与计数
+        candidates: 按优先级排列的候选
+        tap: tap(candidate) 执行一次点击
+        postcondition: postcondition(candidate) 返回 waits.py 风格的条件，成立时返回真值
+        timeout: 每次点击后等待条件成立的最长时间（秒）
+        retry_if: 条件未成立时调用，返回真值才改点下一个候选（如仍停留在原页面）；
+            否则不再点击，再等待至多 timeout 秒后结束。为 None 时总是改点下一个
+        budget: 全部候选的点击与等待合计的最长时间（秒）
+
+    返回 (条件成立的候选, 条件的值)；所有候选都未成立时返回 (None, None)
+    """
+    deadline = time.monotonic() + budget
+    for i, candidate in enumerate(candidates):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            log.warning(f"{action}: 重试已达 {budget} 秒上限，不再点击其余候选")
+            break
+        with TRACER.span(action, "verify", candidate=i) as span:
+            try:
+                tap(candidate)
+            except Exception as e:
+                log.warning(f"{action}: 第 {i + 1} 个候选点击失败: {e}")
+                span["ok"] = False
+                continue
+            bot.invalidate_snapshot()
+            result = bot.wait_for(postcondition(candidate), min(timeout, remaining), f"确认{action}")
+            stay = not result and retry_if is not None and not retry_if()
+            if stay:
+                # 已不在原处（加载中或切换较慢）：不在新页面上点击下一个候选，等待本次点击生效
+                remaining = max(0.0, deadline - time.monotonic())
+                result = bot.wait_for(postcondition(candidate), min(timeout, remaining), f"确认{action}")
+            span["ok"] = bool(result)
+        bot.tap_metrics.record(action, bool(result))
+        if result:
+            return candidate, result
+        if stay:
+            log.warning(f"{action}: 第 {i + 1} 个候选点击后未生效，且已不在可重试的位置，不再点击其余候选")
+            break
+        log.warning(f"{action}: 第 {i + 1} 个候选点击后 {timeout} 秒内未生效，改点下一个")
+    return None, None
@@ -0,0 +1,105 @@
+# -*- coding: UTF-8 -*-
+"""
+按可观察条件等待：页面层级变化、前台应用、节点选中、页面切换。
+轮询间隔从很短开始逐步放大（界面通常很快就绪，慢的时候也不会频繁打扰设备），
+截止时间是硬性的，到点即返回
+"""
+
+import time
+
+from instrumentation import TRACER
+
+
+class Waiter:
+    """自适应轮询的等待原语
+
+    参数:
+        poll: 首次轮询间隔（秒）
+        max_poll: 轮询间隔上限（秒）
+        backoff: 每轮间隔放大的倍数
+    """
+
+    def __init__(self, poll=0.02, max_poll=0.25, backoff=1.5):
+        self.poll = poll
+        self.max_poll = max_poll
+        self.backoff = backoff
+
+    def until(self, condition, timeout, name="条件"):
+        """反复求值 condition()，返回第一个真值；到截止时间仍不满足返回 None"""
+        deadline = time.monotonic() + timeout
+        poll = self.poll
+        with TRACER.span(name, "wait", timeout=timeout) as span:
+            polls = 0
+            while True:
+                polls += 1
+                value = condition()
+                if value:
+                    span["polls"] = polls
+                    return value
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    span["polls"] = polls
+                    span["timeout"] = True
+                    return None
+                time.sleep(min(poll, remaining))
+                poll = min(poll * self.backoff, self.max_poll)
+
+
+# ---- 条件：均返回满足时的值（真值），不满足返回 None ----
+
+def screen_changed(bot, state):
+    """页面离开 state，返回新页面"""
+    def condition():
+        bot.invalidate_snapshot()
+        current = bot.classify_screen()
+        return current if current != state else None
+    return condition
+
+
+def screen_in(bot, *states):
+    """页面为 states 之一，返回该页面"""
+    def condition():
+        bot.invalidate_snapshot()
+        current = bot.classify_screen()
+        return current if current in states else None
+    return condition
+
+
+def hierarchy_changed(bot, source, settled=None):
+    """页面层级与 source 不同（且 settled(快照) 成立），返回新快照"""
+    def condition():
+        bot.invalidate_snapshot()
+        snapshot = bot.take_snapshot()
+        if snapshot.source == source or (settled is not None and not settled(snapshot)):
+            return None
+        return snapshot
+    return condition
+
+
+def package_is(driver, package):
+    """前台应用为 package"""
+    def condition():
+        return driver.current_package == package or None
+    return condition
+
+
+def node_selected(bot, bounds):
+    """bounds（"[x1,y1][x2,y2]"）处的节点或其子节点已选中（selected/checked），返回新快照
+
+    流式读取该节点的子树，不建树；与上一轮检查时相比该子树没有变化（变化在页面其他位置，
+    如倒计时）则不再读取
+    """
+    checked = [None]
+
+    def selected(attrs):
+        return 'true' in (attrs.get('selected'), attrs.get('checked'))
+
+    def condition():
+        bot.invalidate_snapshot()
+        snapshot = bot.take_snapshot()
+        if checked[0] is not None and snapshot.unchanged_since(checked[0], bounds):
+            checked[0] = snapshot.serial
+            return None
+        checked[0] = snapshot.serial
+        return snapshot if snapshot.subtree_any(bounds, selected) else None
+    return condition